@@ -62,6 +62,17 @@ DATABASES = {
     }
 }
 
+# Кэш Django: номера поколений кэша списка и аналитики и роли пользователей.
+# Кэш в памяти процесса годится только для одного процесса (runserver);
+# при нескольких процессах нужен общий кэш, например
+# {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379'}.
+# Проверка: python manage.py check --deploy
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -94,6 +105,108 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 PASSPORTS_DIR = os.path.join(BASE_DIR, 'паспорта')
 os.makedirs(PASSPORTS_DIR, exist_ok=True)
 
+# Количество уровней подпапок по первым символам UUID для файлов паспортов
+# (0 - все файлы в одной папке, не больше 4). После изменения запустите
+# reshard_passports, указав на время переноса прежнее число уровней
+# в PASSPORT_SHARD_PREVIOUS_LEVELS
+PASSPORT_SHARD_LEVELS = 1
+
+# Прежние значения PASSPORT_SHARD_LEVELS, пока идет перенос файлов: файл,
+# которого нет в папке текущего разбиения, ищется в их папках, а запись
+# переносит его на новое место. После переноса список нужно очистить - иначе
+# каждое чтение отсутствующего файла проверяет лишние папки
+PASSPORT_SHARD_PREVIOUS_LEVELS = ()
+
+# Надежность записи файлов паспортов и истории (запись всегда атомарна):
+# 'none' - без fsync, данные сбрасывает ОС; 'batch' - один fsync на пачку
+# записей зеркала или импорта; 'always' - fsync каждого файла. Записи вне
+# пачек (история изменений из запросов) при 'batch' сбрасываются сразу, как при 'always'
+PASSPORT_FILE_DURABILITY = 'batch'
+
+# Возраст (сек), после которого временный файл записи, оставшийся после
+# сбоя процесса, удаляет cleanup_orphaned_files
+PASSPORT_TEMP_FILE_MAX_AGE = 60 * 60
+
+# Формат файла снимка паспорта: 'json' (с отступами), 'json-compact', 'gzip',
+# 'zstd' (пакет zstandard) или 'msgpack' (пакет msgpack). Читаются все форматы
+# независимо от настройки; существующие файлы переводит convert_passport_files
+PASSPORT_FILE_FORMAT = 'json'
+
+# Размер журнала работ (байт), после которого он уплотняется в снимок паспорта
+PASSPORT_WORKS_LOG_COMPACT_SIZE = 256 * 1024
+
+# Количество записей истории на странице паспорта и на странице истории
+PASSPORT_HISTORY_PREVIEW = 10
+PASSPORT_HISTORY_PAGE_SIZE = 50
+
+# Запись файлов паспортов и истории изменений в фоновом потоке после
+# фиксации транзакции. Очередь хранится в памяти процесса: при аварийном
+# завершении ожидавшие записи теряются (файлы паспортов восстанавливает
+# mirror_passports, историю - нет). При False файлы пишутся сразу после
+# фиксации, в том же запросе
+PASSPORT_MIRROR_ASYNC = True
+# Окно (сек), за которое отметки одного паспорта объединяются в одну запись
+PASSPORT_MIRROR_BATCH_DELAY = 0.5
+
+# Кэш разобранных файлов паспортов и истории: число паспортов в памяти
+# процесса (0 - отключить) и время хранения (сек) в общем кэше Django (0 - не использовать).
+# Общий уровень - отдельный кэш из CACHES, видимый всем процессам (Redis,
+# Memcached); None или кэш в памяти процесса - только память процесса
+PASSPORT_FILE_CACHE_SIZE = 1000
+PASSPORT_FILE_CACHE_TIMEOUT = 300
+PASSPORT_FILE_CACHE_ALIAS = None
+
+# Массовое удаление: паспортов в одной транзакции, потоков для удаления файлов
+# и размер выборки, начиная с которого удаление уходит в фоновое задание.
+# Ход задания хранится в БД (BulkDeleteJob) и виден всем процессам
+PASSPORT_BULK_DELETE_CHUNK_SIZE = 500
+PASSPORT_BULK_DELETE_WORKERS = 8
+PASSPORT_BULK_DELETE_SYNC_LIMIT = 1000
+
+# Потоков для чтения файлов паспортов в асинхронных представлениях (api/async/)
+PASSPORT_ASYNC_FILE_WORKERS = 16
+
+# Индексы по пользовательским полям для фильтров cf.<поле>: для паспортов
+# ('passport') и работ ('work') - {имя поля: 'number' или 'text'}, например
+# {'passport': {'Напряжение': 'number'}}. Создаются командой sync_custom_field_indexes
+PASSPORT_CUSTOM_FIELD_INDEXES = {}
+
+# Уменьшенные копии фото оборудования: {имя размера: (ширина, высота)}, качество
+# JPEG, потоков для их создания и время хранения в кэше браузера (сек).
+# При False копии создаются сразу после фиксации, в том же запросе
+PASSPORT_THUMBNAIL_SIZES = {'small': (160, 160), 'medium': (640, 640)}
+PASSPORT_THUMBNAIL_QUALITY = 85
+PASSPORT_THUMBNAIL_WORKERS = 2
+PASSPORT_THUMBNAIL_ASYNC = True
+PASSPORT_THUMBNAIL_MAX_AGE = 30 * 24 * 60 * 60
+
+# Время хранения (сек) отчетов /api/analytics/ в кэше Django (0 - не кэшировать).
+# Кэш сбрасывается при любом изменении работ или паспортов
+PASSPORT_ANALYTICS_CACHE_TIMEOUT = 600
+
+# Кэш таблицы списка паспортов: время хранения страницы (сек, 0 - не
+# кэшировать) и алиас кэша Django. Кэш сбрасывается при записи паспортов и работ
+PASSPORT_LIST_CACHE_TIMEOUT = 300
+PASSPORT_LIST_CACHE_ALIAS = 'default'
+
+# Время хранения (сек) роли пользователя (член группы «Администраторы» или нет)
+# в кэше Django. Кэш сбрасывается при изменении групп; с кэшем в памяти
+# процесса сброс виден только своему процессу, как и для кэша списка и аналитики
+PASSPORT_ROLE_CACHE_TIMEOUT = 300
+
+# Журнал изменений для синхронизации клиентов (/api/changes/): событий в
+# одном ответе и срок хранения событий в днях (команда prune_change_events)
+PASSPORT_CHANGES_PAGE_SIZE = 1000
+PASSPORT_CHANGES_RETENTION_DAYS = 90
+# Задержка (сек) выдачи свежих событий. Параллельные транзакции фиксируются
+# не в порядке номеров событий; для PostgreSQL стоит задать 5-10 секунд,
+# в SQLite запись последовательна
+PASSPORT_CHANGES_LAG = 0
+
+# Бэкенд поиска паспортов: 'auto' (FTS5 для SQLite, tsvector для PostgreSQL)
+# или путь к классу, например 'passports.search.BasicSearchBackend'
+PASSPORT_SEARCH_BACKEND = 'auto'
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
@@ -1,9 +1,11 @@
 from django.contrib import admin
+from django.conf import settings
 from django.http import HttpResponse
 from django.contrib import messages
 from django.utils.translation import ngettext
 from .models import EquipmentPassport, MaintenanceWork, EquipmentType
-from .utils import load_passport_from_file, delete_passport_file
+from .export import streaming_export_response
+from .deletion import bulk_delete_passports, start_bulk_delete_job
 
 
 @admin.register(EquipmentType)
@@ -20,7 +22,7 @@ class EquipmentPassportAdmin(admin.ModelAdmin):
     search_fields = ('name', 'serial_number', 'inventory_number', 'location')
     readonly_fields = ('created_at', 'updated_at')
     date_hierarchy = 'created_at'
-    actions = ['export_to_json', 'mass_delete', 'delete_selected_with_files']
+    actions = ['export_to_json', 'export_to_jsonl', 'export_to_csv', 'mass_delete', 'delete_selected_with_files']
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
@@ -30,27 +32,37 @@ class EquipmentPassportAdmin(admin.ModelAdmin):
 
     def export_to_json(self, request, queryset):
         """Действие для экспорта выбранных паспортов в JSON"""
-        import json
-        from django.http import HttpResponse
+        return streaming_export_response(queryset, 'json')
 
-        data = []
-        for passport in queryset:
-            file_data = load_passport_from_file(passport.id)
-            if file_data:
-                data.append(file_data)
+    export_to_json.short_description = "Экспортировать выбранные паспорта в JSON"
 
-        response = HttpResponse(json.dumps(data, indent=2, ensure_ascii=False), content_type='application/json')
-        response['Content-Disposition'] = 'attachment; filename="passports_export.json"'
-        return response
+    def export_to_jsonl(self, request, queryset):
+        """Действие для экспорта выбранных паспортов в JSON Lines (gzip)"""
+        return streaming_export_response(queryset, 'jsonl', compress=True)
 
-    export_to_json.short_description = "Экспортировать выбранные паспорта в JSON"
+    export_to_jsonl.short_description = "Экспортировать выбранные паспорта в JSON Lines (gzip)"
+
+    def export_to_csv(self, request, queryset):
+        """Действие для экспорта выбранных паспортов в CSV"""
+        return streaming_export_response(queryset, 'csv')
+
+    export_to_csv.short_description = "Экспортировать выбранные паспорта в CSV"
 
     def mass_delete(self, request, queryset):
         """Действие для массового удаления с очисткой файлов"""
-        for passport in queryset:
-            delete_passport_file(passport.id)
         count = queryset.count()
-        queryset.delete()
+
+        # Большая выборка удаляется фоновым заданием
+        if count > settings.PASSPORT_BULK_DELETE_SYNC_LIMIT:
+            job = start_bulk_delete_job(queryset, request.user)
+            self.message_user(
+                request,
+                f"Запущено фоновое удаление {count} паспортов (задание {job['id']})",
+                messages.INFO
+            )
+            return
+
+        count = bulk_delete_passports(queryset).passports_deleted
 
         self.message_user(
             request,
@@ -112,13 +124,9 @@ class EquipmentPassportAdmin(admin.ModelAdmin):
     def get_actions(self, request):
         actions = super().get_actions(request)
         # Заменяем стандартное действие удаления на наше
+        # (delete_selected_with_files уже есть в списке actions)
         if 'delete_selected' in actions:
             del actions['delete_selected']
-        actions['delete_selected_with_files'] = (
-            self.delete_selected_with_files,
-            'delete_selected_with_files',
-            "Удалить выбранные паспорта (с файлами)"
-        )
         return actions
 
 
@@ -0,0 +1,157 @@
+"""Сводные показатели работ в строке паспорта.
+
+У паспорта хранятся число работ, их общая стоимость, дата последней работы,
+даты последних работ по типам и время последнего изменения работ (для
+условных запросов). Они обновляются при каждом изменении
+работы одним UPDATE строки паспорта, без агрегации по всей таблице работ,
+поэтому списки могут сортировать и фильтровать по ним без JOIN. Полный
+пересчет - команда rebuild_passport_aggregates.
+"""
+import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from .models import EquipmentPassport, MaintenanceWork
+
+AGGREGATE_FIELDS = ('works_count', 'works_total_cost', 'last_work_date', 'last_work_dates')
+
+
+def _empty_aggregates():
+    return {'works_count': 0, 'works_total_cost': Decimal('0'), 'last_work_date': None, 'last_work_dates': {}}
+
+
+def _add_work(aggregates, work_type, work_date, cost):
+    aggregates['works_count'] += 1
+    aggregates['works_total_cost'] += cost or 0
+    # Даты в JSON хранятся строками ISO - они сравниваются как даты
+    work_date = work_date.isoformat()
+    if work_date > aggregates['last_work_dates'].get(work_type, ''):
+        aggregates['last_work_dates'][work_type] = work_date
+
+
+def _finish(aggregates):
+    dates = aggregates['last_work_dates']
+    aggregates['last_work_date'] = datetime.date.fromisoformat(max(dates.values())) if dates else None
+    return aggregates
+
+
+def fill_aggregates(passports, works):
+    """Заполняет показатели новых паспортов по их работам, без запросов
+
+    Для массового создания: вызывается до bulk_create паспортов.
+    """
+    by_passport = {passport.id: _empty_aggregates() for passport in passports}
+    for work in works:
+        passport_id, state = work_state(work)
+        _add_work(by_passport[passport_id], *state)
+
+    now = timezone.now()
+    for passport in passports:
+        aggregates = _finish(by_passport[passport.id])
+        for field_name, value in aggregates.items():
+            setattr(passport, field_name, value)
+        passport.works_changed_at = now if aggregates['works_count'] else None
+
+
+def refresh_aggregates(passport_ids):
+    """Пересчитывает показатели паспортов по работам в базе данных
+
+    Один сгруппированный запрос по работам и один UPDATE на паспорт.
+    """
+    by_passport = {passport_id: _empty_aggregates() for passport_id in passport_ids}
+    rows = (
+        MaintenanceWork.objects.filter(passport_id__in=by_passport)
+        .order_by()
+        .values('passport_id', 'work_type')
+        .annotate(count=Count('id'), total_cost=Sum('cost'), last_date=Max('work_date'))
+    )
+    for row in rows:
+        aggregates = by_passport[row['passport_id']]
+        aggregates['works_count'] += row['count']
+        aggregates['works_total_cost'] += row['total_cost'] or 0
+        aggregates['last_work_dates'][row['work_type']] = row['last_date'].isoformat()
+
+    # Сводка входит в ответы API - ее пересчет тоже изменение для кэшей клиентов
+    now = timezone.now()
+    with transaction.atomic():
+        for passport_id, aggregates in by_passport.items():
+            # update() не отправляет сигналы и не меняет updated_at
+            EquipmentPassport.objects.filter(pk=passport_id).update(works_changed_at=now, **_finish(aggregates))
+
+
+def _apply_change(passport_id, removed=None, added=None):
+    """Учитывает в показателях паспорта удаление и/или добавление работы
+
+    removed и added - (тип, дата, стоимость). Строка паспорта блокируется
+    до конца транзакции, чтобы параллельные изменения не потерялись.
+    """
+    with transaction.atomic():
+        aggregates = (
+            EquipmentPassport.objects.select_for_update()
+            .filter(pk=passport_id)
+            .values(*AGGREGATE_FIELDS)
+            .first()
+        )
+        if aggregates is None:
+            # Паспорт удален вместе с работой
+            return
+
+        if removed is not None:
+            work_type, work_date, cost = removed
+            aggregates['works_count'] = max(aggregates['works_count'] - 1, 0)
+            aggregates['works_total_cost'] -= cost or 0
+            # Удалена последняя работа типа - дату берем из оставшихся
+            if aggregates['last_work_dates'].get(work_type) == work_date.isoformat():
+                last_date = (
+                    MaintenanceWork.objects.filter(passport_id=passport_id, work_type=work_type)
+                    .aggregate(last_date=Max('work_date'))['last_date']
+                )
+                if last_date is None:
+                    aggregates['last_work_dates'].pop(work_type)
+                else:
+                    aggregates['last_work_dates'][work_type] = last_date.isoformat()
+
+        if added is not None:
+            _add_work(aggregates, *added)
+
+        EquipmentPassport.objects.filter(pk=passport_id).update(works_changed_at=timezone.now(), **_finish(aggregates))
+
+
+def _touch(passport_id):
+    """Отмечает изменение работы, не влияющее на сводку (описание, материалы и т.п.)"""
+    EquipmentPassport.objects.filter(pk=passport_id).update(works_changed_at=timezone.now())
+
+
+def work_state(work):
+    """Поля работы, от которых зависят показатели паспорта"""
+    # Дата и стоимость могут быть присвоены строками - приводим как при чтении из БД
+    work_date = MaintenanceWork._meta.get_field('work_date').to_python(work.work_date)
+    cost = MaintenanceWork._meta.get_field('cost').to_python(work.cost)
+    return work.passport_id, (work.work_type, work_date, cost)
+
+
+def work_saved(old_state, work):
+    """Учитывает создание (old_state=None) или изменение работы"""
+    passport_id, state = work_state(work)
+    if old_state is None:
+        _apply_change(passport_id, added=state)
+        return
+
+    old_passport_id, old = old_state
+    if old_passport_id == passport_id:
+        if old != state:
+            _apply_change(passport_id, removed=old, added=state)
+        else:
+            _touch(passport_id)
+    else:
+        _apply_change(old_passport_id, removed=old)
+        _apply_change(passport_id, added=state)
+
+
+def work_deleted(work):
+    """Учитывает удаление работы"""
+    passport_id, state = work_state(work)
+    _apply_change(passport_id, removed=state)
@@ -0,0 +1,196 @@
+"""Отчеты по работам обслуживания.
+
+Отчеты считаются в базе данных: группировка values() + annotate(), месяцы
+через TruncMonth. Результат кэшируется в кэше Django по отчету, области
+видимости и набору фильтров. Ключ содержит номер поколения данных, который
+увеличивается после фиксации любой записи работ или паспортов, - так
+сбрасываются сразу все отчеты без перебора ключей.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Q, Sum, Window
+from django.db.models.functions import Lag, Round, TruncMonth
+from django.utils.dateparse import parse_date
+
+from .cache_utils import bump_generation, get_generation
+from .models import MaintenanceWork
+
+GENERATION_KEY = 'passports:analytics:generation'
+
+EQUIPMENT_TYPE = F('passport__equipment_type__name')
+LOCATION = F('passport__location')
+
+FILTER_PARAMS = ('date_from', 'date_to', 'work_type', 'equipment_type', 'location', 'status')
+
+
+class AnalyticsFilterError(ValueError):
+    """Неверное значение фильтра отчета"""
+
+
+def _totals():
+    return {'works': Count('id'), 'total_cost': Sum('cost'), 'avg_cost': Round(Avg('cost'), 2)}
+
+
+def cost_by_month(works):
+    """Работы и затраты по месяцам"""
+    rows = (
+        works.annotate(month=TruncMonth('work_date'))
+        .values('month')
+        .annotate(**_totals())
+        .order_by('month')
+    )
+    return list(rows)
+
+
+def by_work_type(works):
+    """Работы и затраты по типам работ"""
+    labels = dict(MaintenanceWork.WORK_TYPES)
+    rows = works.values('work_type').annotate(**_totals()).order_by('-total_cost', 'work_type')
+    return [{**row, 'work_type_display': labels.get(row['work_type'], row['work_type'])} for row in rows]
+
+
+def by_equipment_type(works):
+    """Работы и затраты по типам оборудования"""
+    rows = (
+        works.values(equipment_type=EQUIPMENT_TYPE)
+        .annotate(passports=Count('passport_id', distinct=True), **_totals())
+        .order_by('-total_cost', 'equipment_type')
+    )
+    return list(rows)
+
+
+def by_location(works):
+    """Работы и затраты по местам установки"""
+    rows = (
+        works.values(location=LOCATION)
+        .annotate(passports=Count('passport_id', distinct=True), **_totals())
+        .order_by('-total_cost', 'location')
+    )
+    return list(rows)
+
+
+def repair_intervals(works, work_type='repair'):
+    """Средний интервал между работами типа work_type (MTBF для ремонтов)
+
+    Интервалы считает база: LAG по дате внутри работ паспорта дает дату
+    предыдущей работы, затем Sum/Count по интервалам - в целом и по типам
+    оборудования. Первая работа паспорта интервала не имеет, поэтому
+    паспорта с одной работой в расчет не входят.
+    """
+    works = works.filter(work_type=work_type).annotate(
+        equipment_type=EQUIPMENT_TYPE,
+        interval=ExpressionWrapper(
+            F('work_date') - Window(Lag('work_date'), partition_by=F('passport_id'), order_by=F('work_date').asc()),
+            output_field=DurationField(),
+        ),
+    )
+
+    def totals(condition=None):
+        has_interval = Q(interval__isnull=False)
+        if condition is not None:
+            has_interval &= condition
+        return {
+            'passports': Count('passport_id', distinct=True, filter=has_interval),
+            'intervals': Count('interval', filter=has_interval),
+            'days': Sum('interval', filter=has_interval),
+        }
+
+    # Агрегаты по оконной функции база считает над подзапросом - группировку
+    # по типу оборудования задают условия, по одному набору на тип
+    names = list(works.order_by().values_list('equipment_type', flat=True).distinct())
+    aggregates = totals()
+    for index, name in enumerate(names):
+        condition = Q(equipment_type__isnull=True) if name is None else Q(equipment_type=name)
+        aggregates.update({f'{key}_{index}': value for key, value in totals(condition).items()})
+    row = works.aggregate(**aggregates)
+
+    def summary(suffix=''):
+        intervals = row[f'intervals{suffix}']
+        days = row[f'days{suffix}']
+        mean = round(days.days / intervals, 1) if intervals else None
+        return {'passports': row[f'passports{suffix}'], 'intervals': intervals, 'mean_interval_days': mean}
+
+    groups = [{'equipment_type': name, **summary(f'_{index}')} for index, name in enumerate(names)]
+    return {
+        'work_type': work_type,
+        **summary(),
+        'by_equipment_type': sorted(
+            (group for group in groups if group['passports']),
+            key=lambda group: (group['mean_interval_days'] is None, group['mean_interval_days'] or 0),
+        ),
+    }
+
+
+REPORTS = {
+    'cost-by-month': cost_by_month,
+    'by-work-type': by_work_type,
+    'by-equipment-type': by_equipment_type,
+    'by-location': by_location,
+    'repair-intervals': repair_intervals,
+}
+
+
+def parse_filters(params):
+    """Фильтры отчета из параметров запроса; пустые пропускаются"""
+    filters = {name: params[name].strip() for name in FILTER_PARAMS if params.get(name, '').strip()}
+    for name in ('date_from', 'date_to'):
+        if name in filters:
+            try:
+                value = parse_date(filters[name])
+            except ValueError:
+                value = None
+            if value is None:
+                raise AnalyticsFilterError(f'{name}: ожидается дата ГГГГ-ММ-ДД')
+            filters[name] = value.isoformat()
+    if 'work_type' in filters and filters['work_type'] not in dict(MaintenanceWork.WORK_TYPES):
+        raise AnalyticsFilterError(f"work_type: неизвестный тип работы {filters['work_type']!r}")
+    return filters
+
+
+def _filter_works(works, filters):
+    lookups = {
+        'date_from': 'work_date__gte',
+        'date_to': 'work_date__lte',
+        'equipment_type': 'passport__equipment_type__name',
+        'location': 'passport__location',
+        'status': 'passport__status',
+    }
+    return works.filter(**{lookups[name]: value for name, value in filters.items() if name in lookups})
+
+
+def run_report(report, works, filters, scope):
+    """Результат отчета report по работам works с фильтрами filters
+
+    scope - метка области видимости works (например, 'all' или 'user:5'),
+    она входит в ключ кэша.
+    """
+    timeout = settings.PASSPORT_ANALYTICS_CACHE_TIMEOUT
+    key = None
+    if timeout:
+        digest = hashlib.sha1(json.dumps(filters, sort_keys=True).encode()).hexdigest()
+        key = f'passports:analytics:{get_generation(cache, GENERATION_KEY)}:{report}:{scope}:{digest}'
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+    works = _filter_works(works, filters)
+    if report == 'repair-intervals':
+        result = repair_intervals(works, filters.get('work_type', 'repair'))
+    else:
+        if 'work_type' in filters:
+            works = works.filter(work_type=filters['work_type'])
+        result = REPORTS[report](works)
+
+    if key is not None:
+        cache.set(key, result, timeout)
+    return result
+
+
+def invalidate_reports():
+    """Сбрасывает кэш всех отчетов после фиксации текущей транзакции"""
+    if settings.PASSPORT_ANALYTICS_CACHE_TIMEOUT:
+        transaction.on_commit(lambda: bump_generation(cache, GENERATION_KEY))
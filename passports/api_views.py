@@ -1,55 +1,222 @@
+import csv
+import uuid
+
+from django.conf import settings
+from django.db.models import Q, prefetch_related_objects
+from django.utils.dateparse import parse_date
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from rest_framework.pagination import PageNumberPagination
 from django.shortcuts import get_object_or_404
 from .models import EquipmentPassport, MaintenanceWork
 from .serializers import EquipmentPassportSerializer, MaintenanceWorkSerializer
-from .utils import save_passport_to_file, load_passport_from_file
+from .pagination import SelectablePagination
+from .export import EXPORT_FORMATS, streaming_export_response
+from .importer import IMPORT_FORMATS, guess_import_format, import_passports, iter_rows, open_import_file
+from .deletion import bulk_delete_passports, delete_passport_with_files, get_bulk_delete_job, start_bulk_delete_job
+from .utils import load_passport_from_file, resolve_passport_paths
+from .file_cache import get_file_cache
+from .list_cache import stats as list_cache_stats
+from .conditional import not_modified, passport_file_validators, passport_validators, set_validators
+from .custom_fields import CustomFieldFilterError, filter_custom_fields
+from .analytics import REPORTS, AnalyticsFilterError, parse_filters, run_report
+from .changes import ChangeTokenExpired, collect_changes, current_token
+from .permissions import CanAccessPassport, IsPassportAdmin, can_access_passport, scope_label, scope_passports, \
+    scope_works
+from .mirror import get_writer, schedule_passport_save, schedule_work_save, schedule_work_delete
 
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 50
-    page_size_query_param = 'page_size'
-    max_page_size = 1000
+def _filter_custom_fields(queryset, request):
+    """Фильтры ?cf.<поле>__<сравнение>=<значение> по custom_fields"""
+    try:
+        return filter_custom_fields(queryset, request.query_params)
+    except CustomFieldFilterError as e:
+        raise ValidationError({'custom_fields': str(e)})
 
 
 class EquipmentPassportViewSet(viewsets.ModelViewSet):
     queryset = EquipmentPassport.objects.all()
     serializer_class = EquipmentPassportSerializer
-    pagination_class = StandardResultsSetPagination
-
-    def get_permissions(self):
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
-            permission_classes = [IsAuthenticated]
-        else:
-            permission_classes = [IsAuthenticated]
-        return [permission() for permission in permission_classes]
+    pagination_class = SelectablePagination
+    keyset_ordering = ('created_at', 'id')
+    # @action может задать свои права
+    permission_classes = [CanAccessPassport]
 
     def get_queryset(self):
-        if self.request.user.is_superuser or self.request.user.is_staff:
-            return EquipmentPassport.objects.all()
-        return EquipmentPassport.objects.filter(created_by=self.request.user)
+        queryset = scope_passports(self.request.user)
+
+        if self.action in ('list', 'export'):
+            queryset = self._filter_by_works(queryset)
+            queryset = _filter_custom_fields(queryset, self.request)
+
+        # План запроса под действие: связанные данные подгружаются только
+        # для тех действий и полей, которые действительно сериализуются
+        if self.action in ('list', 'retrieve', 'create', 'update', 'partial_update'):
+            if self._serializes('created_by_username'):
+                queryset = queryset.select_related('created_by')
+            # Для одного паспорта работы подгружает retrieve() - после проверки условного запроса
+            if self._serializes('maintenance_works') and self.action != 'retrieve':
+                queryset = queryset.prefetch_related('maintenance_works')
+        return queryset
+
+    def _filter_by_works(self, queryset):
+        """Фильтры по сводке работ: ?last_work_before=ГГГГ-ММ-ДД, ?min_works=N
+
+        last_work_before отбирает и паспорта без работ.
+        """
+        params = self.request.query_params
+        last_work_before = params.get('last_work_before')
+        if last_work_before:
+            try:
+                last_work_before = parse_date(last_work_before)
+            except ValueError:
+                last_work_before = None
+            if last_work_before is None:
+                raise ValidationError({'last_work_before': 'Ожидается дата ГГГГ-ММ-ДД'})
+            queryset = queryset.filter(Q(last_work_date__lt=last_work_before) | Q(last_work_date__isnull=True))
+
+        min_works = params.get('min_works')
+        if min_works:
+            if not min_works.isdigit():
+                raise ValidationError({'min_works': 'Ожидается целое число'})
+            queryset = queryset.filter(works_count__gte=int(min_works))
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # В списке работы отдаются только по ?expand=maintenance_works
+        context['expand_by_default'] = self.action != 'list'
+        return context
+
+    def _serializes(self, field_name):
+        return EquipmentPassportSerializer.includes_field(
+            self.request, field_name, expand_by_default=self.action != 'list'
+        )
 
     def perform_create(self, serializer):
         passport = serializer.save(created_by=self.request.user)
-        save_passport_to_file(passport)
+        schedule_passport_save(passport)
 
     def perform_update(self, serializer):
         passport = serializer.save()
-        save_passport_to_file(passport)
+        schedule_passport_save(passport)
 
     def perform_destroy(self, instance):
-        from .utils import delete_passport_file
-        delete_passport_file(instance.id)
-        instance.delete()
+        delete_passport_with_files(instance)
+
+    def retrieve(self, request, *args, **kwargs):
+        passport = self.get_object()
+        # От параметров запроса (?fields=, ?expand=) и формата зависит тело ответа
+        etag, last_modified = passport_validators(
+            passport.id, passport.updated_at, passport.works_changed_at,
+            request.accepted_renderer.format, request.user.pk, sorted(request.query_params.lists()),
+        )
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        if self._serializes('maintenance_works'):
+            prefetch_related_objects([passport], 'maintenance_works')
+        return set_validators(Response(self.get_serializer(passport).data), etag, last_modified)
 
     @action(detail=True, methods=['get'])
     def file_data(self, request, pk=None):
         passport = self.get_object()
-        file_data = load_passport_from_file(passport.id)
-        return Response(file_data)
+        paths = resolve_passport_paths(passport.id)
+        etag, last_modified = passport_file_validators(
+            passport.id, request.accepted_renderer.format, request.user.pk, paths=paths
+        )
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        file_data = load_passport_from_file(passport.id, paths)
+        return set_validators(Response(file_data), etag, last_modified)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Потоковая выгрузка паспортов: ?export_format=jsonl|csv|json, ?gzip=1"""
+        export_format = request.query_params.get('export_format', 'jsonl')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"Неизвестный формат, допустимые: {', '.join(EXPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        compress = request.query_params.get('gzip') in ('1', 'true')
+        return streaming_export_response(self.filter_queryset(self.get_queryset()), export_format, compress)
+
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser])
+    def bulk_import(self, request):
+        """Массовый импорт паспортов из файла file (JSON Lines или CSV, можно .gz)
+
+        Формат берется из ?import_format= или из расширения файла,
+        ?dry_run=1 только проверяет записи.
+        """
+        uploaded = request.FILES.get('file')
+        if uploaded is None:
+            return Response({'error': 'Не передан файл file'}, status=status.HTTP_400_BAD_REQUEST)
+
+        import_format = request.query_params.get('import_format') or guess_import_format(uploaded.name)
+        if import_format not in IMPORT_FORMATS:
+            return Response(
+                {'error': f"Неизвестный формат, допустимые: {', '.join(IMPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        dry_run = request.query_params.get('dry_run') in ('1', 'true')
+        try:
+            lines = open_import_file(uploaded.file, uploaded.name)
+            result = import_passports(iter_rows(lines, import_format), request.user, dry_run=dry_run)
+        except (UnicodeDecodeError, csv.Error, OSError, EOFError) as e:
+            return Response({'error': f'Не удалось прочитать файл: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        response_status = status.HTTP_201_CREATED if result.passports_created else status.HTTP_200_OK
+        return Response(result.as_dict(), status=response_status)
+
+    @action(detail=False, methods=['post'], permission_classes=[IsPassportAdmin])
+    def bulk_delete(self, request):
+        """Массовое удаление паспортов: {"passport_ids": [...], "background": false}
+
+        Выборка больше PASSPORT_BULK_DELETE_SYNC_LIMIT или с background=true
+        удаляется фоновым заданием; ответ 202 содержит его id.
+        """
+        passport_ids = request.data.get('passport_ids')
+        if not isinstance(passport_ids, list) or not passport_ids:
+            return Response({'error': 'Передайте непустой список passport_ids'}, status=status.HTTP_400_BAD_REQUEST)
+
+        valid_ids = []
+        for passport_id in passport_ids:
+            try:
+                valid_ids.append(uuid.UUID(str(passport_id)))
+            except ValueError:
+                pass
+        if not valid_ids:
+            return Response({'error': 'Нет валидных ID паспортов'}, status=status.HTTP_400_BAD_REQUEST)
+
+        passports = self.get_queryset().filter(id__in=valid_ids)
+        if request.data.get('background') or len(valid_ids) > settings.PASSPORT_BULK_DELETE_SYNC_LIMIT:
+            job = start_bulk_delete_job(passports, request.user)
+            job['status_url'] = reverse(
+                'passports:equipmentpassport-bulk-delete-status', args=[job['id']], request=request
+            )
+            return Response(job, status=status.HTTP_202_ACCEPTED)
+
+        report = bulk_delete_passports(passports)
+        return Response(report.as_dict())
+
+    @action(detail=False, methods=['get'], permission_classes=[IsPassportAdmin],
+            url_path=r'bulk_delete/(?P<job_id>[0-9a-f]{32})', url_name='bulk-delete-status')
+    def bulk_delete_status(self, request, job_id=None):
+        """Ход фонового удаления"""
+        job = get_bulk_delete_job(job_id)
+        if job is None:
+            return Response({'error': 'Задание не найдено'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job)
 
     @action(detail=True, methods=['get'])
     def maintenance_works(self, request, pk=None):
@@ -75,23 +242,124 @@ class EquipmentPassportViewSet(viewsets.ModelViewSet):
 class MaintenanceWorkViewSet(viewsets.ModelViewSet):
     queryset = MaintenanceWork.objects.all()
     serializer_class = MaintenanceWorkSerializer
-    permission_classes = [IsAuthenticated]
-    pagination_class = StandardResultsSetPagination
+    permission_classes = [CanAccessPassport]
+    pagination_class = SelectablePagination
+    keyset_ordering = ('work_date', 'id')
 
     def get_queryset(self):
-        if self.request.user.is_superuser or self.request.user.is_staff:
-            return MaintenanceWork.objects.all()
-        return MaintenanceWork.objects.filter(created_by=self.request.user)
+        queryset = scope_works(self.request.user)
+        if self.action == 'list':
+            queryset = _filter_custom_fields(queryset, self.request)
+        return queryset
+
+    def _check_passport(self, serializer):
+        """Работу можно добавить или перенести только в доступный паспорт"""
+        passport = serializer.validated_data.get('passport')
+        if passport is not None and not can_access_passport(self.request.user, passport):
+            raise PermissionDenied('Нет доступа к паспорту')
 
     def perform_create(self, serializer):
+        self._check_passport(serializer)
         work = serializer.save(created_by=self.request.user)
-        save_passport_to_file(work.passport)
+        schedule_work_save(work)
 
     def perform_update(self, serializer):
+        self._check_passport(serializer)
+        old_passport_id = serializer.instance.passport_id
         work = serializer.save()
-        save_passport_to_file(work.passport)
+        # Работа перенесена в другой паспорт - убираем ее из старого файла
+        if work.passport_id != old_passport_id:
+            schedule_work_delete(old_passport_id, work.id)
+        schedule_work_save(work)
 
     def perform_destroy(self, instance):
-        passport = instance.passport
+        passport_id, work_id = instance.passport_id, instance.id
         instance.delete()
-        save_passport_to_file(passport)
\ No newline at end of file
+        schedule_work_delete(passport_id, work_id)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def service_metrics(request):
+    """Метрики фоновых подсистем для мониторинга"""
+    return Response({
+        'mirror': get_writer().stats(),
+        'file_cache': get_file_cache().stats(),
+        'list_cache': list_cache_stats.as_dict(),
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def analytics_index(request):
+    """Список отчетов по работам"""
+    return Response({
+        report: reverse('passports:analytics_report', args=[report], request=request)
+        for report in REPORTS
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def analytics_report(request, report):
+    """Отчет по работам: ?date_from=, ?date_to=, ?work_type=, ?equipment_type=, ?location=, ?status=
+
+    Пользователь видит работы своих паспортов, администратор - все.
+    """
+    if report not in REPORTS:
+        return Response(
+            {'error': f"Неизвестный отчет, допустимые: {', '.join(REPORTS)}"},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    try:
+        filters = parse_filters(request.query_params)
+    except AnalyticsFilterError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'report': report,
+        'filters': filters,
+        'results': run_report(report, scope_works(request.user), filters, scope_label(request.user)),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def changes_feed(request):
+    """Изменения паспортов и работ после метки: ?since=<метка>, ?limit=N
+
+    Без since отдается только текущая метка: клиент запрашивает ее перед
+    полной загрузкой списка и дальше синхронизируется от нее. Устаревшая
+    метка - ответ 410, нужна полная загрузка.
+    """
+    since = request.query_params.get('since', '')
+    if not since:
+        return Response({'token': current_token()})
+    if not since.isdigit():
+        raise ValidationError({'since': 'Ожидается метка - целое число'})
+    limit = request.query_params.get('limit', '')
+    if limit and not (limit.isdigit() and int(limit) > 0):
+        raise ValidationError({'limit': 'Ожидается целое положительное число'})
+
+    try:
+        changes = collect_changes(request.user, int(since), int(limit) if limit else None)
+    except ChangeTokenExpired:
+        return Response(
+            {'error': 'Метка устарела, нужна полная синхронизация', 'token': current_token()},
+            status=status.HTTP_410_GONE
+        )
+
+    passport_context = {'request': request, 'expand_by_default': False}
+    return Response({
+        'token': changes['token'],
+        'has_more': changes['has_more'],
+        'passports': {
+            'created': EquipmentPassportSerializer(changes['passports']['created'], many=True, context=passport_context).data,
+            'updated': EquipmentPassportSerializer(changes['passports']['updated'], many=True, context=passport_context).data,
+            'deleted': changes['passports']['deleted'],
+        },
+        'works': {
+            'created': MaintenanceWorkSerializer(changes['works']['created'], many=True).data,
+            'updated': MaintenanceWorkSerializer(changes['works']['updated'], many=True).data,
+            'deleted': changes['works']['deleted'],
+        },
+    })
@@ -0,0 +1,131 @@
+"""Асинхронные представления чтения паспортов для ASGI.
+
+Запросы к базе данных идут через асинхронный ORM, а чтение файлов
+паспортов и истории - в отдельном пуле потоков (PASSPORT_ASYNC_FILE_WORKERS).
+Поэтому медленный клиент или медленный диск не занимает поток обработки
+запросов, и один ASGI-процесс обслуживает много одновременных запросов.
+Под WSGI представления тоже работают, но без этого выигрыша.
+
+Пользователь определяется по сессии, как на страницах сайта.
+"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+from .models import EquipmentPassport
+from .permissions import scope_passports
+from .serializers import EquipmentPassportSerializer
+from .utils import get_passport_history, load_passport_from_file
+
+LIST_FIELDS = ('id', 'name', 'serial_number', 'status', 'created_at')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PASSPORT_ASYNC_FILE_WORKERS, thread_name_prefix='passport-async-files'
+            )
+        return _executor
+
+
+async def _run_in_file_pool(func, *args, **kwargs):
+    """Выполняет блокирующее чтение файлов в пуле потоков"""
+    return await sync_to_async(func, thread_sensitive=False, executor=_get_executor())(*args, **kwargs)
+
+
+async def _passports_for(request):
+    """Паспорта, видимые пользователю, или ответ с ошибкой доступа"""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return None, JsonResponse({'error': 'Требуется вход в систему'}, status=401)
+    # Роль может потребовать запроса к базе
+    return await sync_to_async(scope_passports)(user), None
+
+
+async def _get_passport(request, pk, queryset_hook=None):
+    passports, error = await _passports_for(request)
+    if error is not None:
+        return None, error
+    if queryset_hook is not None:
+        passports = queryset_hook(passports)
+    try:
+        return await passports.aget(pk=pk), None
+    except EquipmentPassport.DoesNotExist:
+        # Чужой паспорт неотличим от несуществующего
+        return None, JsonResponse({'error': 'Паспорт не найден'}, status=404)
+
+
+@require_GET
+async def passport_list(request):
+    """Список паспортов потоком JSON-массива"""
+    passports, error = await _passports_for(request)
+    if error is not None:
+        return error
+
+    async def rows():
+        yield '['
+        separator = ''
+        async for row in passports.values(*LIST_FIELDS).aiterator(chunk_size=1000):
+            yield separator + json.dumps(row, ensure_ascii=False, cls=DjangoJSONEncoder)
+            separator = ',\n'
+        yield ']\n'
+
+    return StreamingHttpResponse(rows(), content_type='application/json')
+
+
+@require_GET
+async def passport_detail(request, pk):
+    """Паспорт из базы данных с работами"""
+    passport, error = await _get_passport(
+        request, pk, lambda passports: passports.select_related('created_by').prefetch_related('maintenance_works')
+    )
+    if error is not None:
+        return error
+    # Данные уже загружены - сериализация не обращается к базе
+    return JsonResponse(EquipmentPassportSerializer(passport, context={'request': request}).data)
+
+
+@require_GET
+async def passport_file_data(request, pk):
+    """Паспорт из файла зеркала"""
+    passport, error = await _get_passport(request, pk, lambda passports: passports.only('id'))
+    if error is not None:
+        return error
+    file_data = await _run_in_file_pool(load_passport_from_file, passport.id)
+    if file_data is None:
+        return JsonResponse({'error': 'Файл паспорта не найден'}, status=404)
+    return JsonResponse(file_data)
+
+
+@require_GET
+async def passport_history(request, pk):
+    """Страница истории изменений: ?page=N, страницы отсчитываются от новых записей"""
+    passport, error = await _get_passport(request, pk, lambda passports: passports.only('id'))
+    if error is not None:
+        return error
+
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    page_size = settings.PASSPORT_HISTORY_PAGE_SIZE
+
+    history = await _run_in_file_pool(
+        get_passport_history, passport.id, limit=page_size + 1, offset=(page - 1) * page_size
+    )
+    has_older = len(history) > page_size
+    if has_older:
+        history = history[1:]
+
+    return JsonResponse({'page': page, 'has_older': has_older, 'has_newer': page > 1, 'results': history})
@@ -0,0 +1,351 @@
+"""Нагрузочные замеры основных сценариев работы с паспортами.
+
+Сценарии сгруппированы в наборы и регистрируются декоратором scenario.
+Каждый сценарий получает BenchmarkContext с подготовленным парком и
+выполняется заданное число раз; результат - задержки и пропускная способность.
+Сценарий может вернуть словарь дополнительных метрик (например, размер файлов)
+или выбросить SkipScenario, если замер в этом окружении невозможен.
+"""
+import os
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+SUITES = {}
+
+
+class SkipScenario(Exception):
+    """Сценарий пропущен, например, не установлена нужная библиотека"""
+
+
+def scenario(suite, name):
+    """Регистрирует сценарий замера в наборе suite"""
+    def decorator(func):
+        SUITES.setdefault(suite, []).append((name, func))
+        return func
+    return decorator
+
+
+class BenchmarkContext:
+    """Подготовленные данные и клиенты, общие для всех сценариев"""
+
+    def __init__(self, passport_ids, staff_user, owner):
+        self.passport_ids = passport_ids
+        self.staff_user = staff_user
+        self.owner = owner
+
+        self.client = Client()
+        self.client.force_login(staff_user)
+        self.owner_client = Client()
+        self.owner_client.force_login(owner)
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(staff_user)
+
+        self._cursor = 0
+        self._samples = {}
+
+    def sample_passports(self, count):
+        """Первые count паспортов вместе с работами, загружаются один раз"""
+        from .models import EquipmentPassport
+
+        samples = self._samples.get(count)
+        if samples is None:
+            samples = self._samples[count] = list(
+                EquipmentPassport.objects.filter(id__in=self.passport_ids[:count])
+                .select_related('equipment_type', 'created_by')
+                .prefetch_related('maintenance_works__created_by')
+            )
+        return samples
+
+    def next_passport_id(self):
+        """Очередной паспорт по кругу, чтобы замеры не били в один и тот же"""
+        passport_id = self.passport_ids[self._cursor % len(self.passport_ids)]
+        self._cursor += 1
+        return passport_id
+
+
+def _check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f'{response.status_code}: {response.content[:200]!r}')
+    # Потоковые ответы нужно дочитать, чтобы замер включал формирование тела
+    if getattr(response, 'streaming', False):
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+# --- HTML-страницы ---
+
+@scenario('views', 'passport_list')
+def bench_passport_list(ctx):
+    _check(ctx.client.get('/passports/list/'))
+
+
+@scenario('views', 'passport_list: владелец, статус, стр. 5')
+def bench_passport_list_owner(ctx):
+    _check(ctx.owner_client.get('/passports/list/?status=in_operation&page=5'))
+
+
+@scenario('views', 'passport_list: поиск')
+def bench_passport_list_query(ctx):
+    _check(ctx.client.get('/passports/list/?q=насос'))
+
+
+@scenario('views', 'passport_search: ключевые слова')
+def bench_passport_search(ctx):
+    _check(ctx.client.get('/passports/search/?keywords=компрессор'))
+
+
+@scenario('views', 'passport_search: заводской номер')
+def bench_passport_search_serial(ctx):
+    _check(ctx.client.get('/passports/search/?serial_number=SN-0000012'))
+
+
+@scenario('views', 'view_passport')
+def bench_view_passport(ctx):
+    _check(ctx.client.get(f'/passports/view/{ctx.next_passport_id()}/'))
+
+
+# --- REST API ---
+
+@scenario('api', 'passports: список')
+def bench_api_list(ctx):
+    _check(ctx.api_client.get('/passports/api/passports/'))
+
+
+@scenario('api', 'passports: список с работами')
+def bench_api_list_expand(ctx):
+    _check(ctx.api_client.get('/passports/api/passports/?expand=maintenance_works'))
+
+
+@scenario('api', 'passports: курсорная страница')
+def bench_api_cursor(ctx):
+    _check(ctx.api_client.get('/passports/api/passports/?pagination=cursor&page_size=200'))
+
+
+@scenario('api', 'passports: детали')
+def bench_api_detail(ctx):
+    _check(ctx.api_client.get(f'/passports/api/passports/{ctx.next_passport_id()}/'))
+
+
+@scenario('api', 'passports: file_data')
+def bench_api_file_data(ctx):
+    _check(ctx.api_client.get(f'/passports/api/passports/{ctx.next_passport_id()}/file_data/'))
+
+
+@scenario('api', 'maintenance-works: список')
+def bench_api_works(ctx):
+    _check(ctx.api_client.get('/passports/api/maintenance-works/'))
+
+
+# --- Обслуживание файлов ---
+
+@scenario('cleanup', 'cleanup_orphaned_files')
+def bench_cleanup(ctx):
+    from .utils import cleanup_orphaned_files
+    cleanup_orphaned_files()
+
+
+# --- Надежность записи файлов ---
+
+DURABILITY_BATCH_SIZE = 20
+
+
+def _bench_snapshot_writes(ctx, durability):
+    from .utils import durable_batch, save_passport_to_file
+
+    with override_settings(PASSPORT_FILE_DURABILITY=durability), durable_batch():
+        for passport in ctx.sample_passports(DURABILITY_BATCH_SIZE):
+            save_passport_to_file(passport)
+
+
+def _bench_history_writes(ctx, durability):
+    from .utils import durable_batch, add_passport_history_entry
+
+    with override_settings(PASSPORT_FILE_DURABILITY=durability), durable_batch():
+        for passport in ctx.sample_passports(DURABILITY_BATCH_SIZE):
+            add_passport_history_entry(passport, ctx.staff_user, {'status': {'old': 'repair', 'new': 'reserve'}})
+
+
+@scenario('durability', f'снимки x{DURABILITY_BATCH_SIZE}: none')
+def bench_snapshots_none(ctx):
+    _bench_snapshot_writes(ctx, 'none')
+
+
+@scenario('durability', f'снимки x{DURABILITY_BATCH_SIZE}: batch')
+def bench_snapshots_batch(ctx):
+    _bench_snapshot_writes(ctx, 'batch')
+
+
+@scenario('durability', f'снимки x{DURABILITY_BATCH_SIZE}: always')
+def bench_snapshots_always(ctx):
+    _bench_snapshot_writes(ctx, 'always')
+
+
+@scenario('durability', f'история x{DURABILITY_BATCH_SIZE}: none')
+def bench_history_none(ctx):
+    _bench_history_writes(ctx, 'none')
+
+
+@scenario('durability', f'история x{DURABILITY_BATCH_SIZE}: batch')
+def bench_history_batch(ctx):
+    _bench_history_writes(ctx, 'batch')
+
+
+@scenario('durability', f'история x{DURABILITY_BATCH_SIZE}: always')
+def bench_history_always(ctx):
+    _bench_history_writes(ctx, 'always')
+
+
+# --- Форматы файлов снимков ---
+
+FORMATS_SAMPLE_SIZE = 20
+
+
+def _format_samples(ctx, file_format):
+    """Сериализованные паспорта и папка для файлов формата"""
+    from django.conf import settings
+    from django.core.exceptions import ImproperlyConfigured
+    from .formats import dumps_passport
+    from .utils import serialize_passport
+
+    if not hasattr(ctx, 'format_records'):
+        ctx.format_records = [serialize_passport(passport) for passport in ctx.sample_passports(FORMATS_SAMPLE_SIZE)]
+    try:
+        dumps_passport({}, file_format)
+    except ImproperlyConfigured as e:
+        raise SkipScenario(str(e))
+
+    # Папка вне подпапок разбиения - обход файлов зеркала ее не видит
+    directory = os.path.join(settings.PASSPORTS_DIR, 'formats-benchmark', file_format)
+    os.makedirs(directory, exist_ok=True)
+    return ctx.format_records, directory
+
+
+def _bench_format_write(ctx, file_format):
+    from .formats import dumps_passport
+    from .utils import _write_file_atomic
+
+    records, directory = _format_samples(ctx, file_format)
+    total_size = 0
+    with override_settings(PASSPORT_FILE_DURABILITY='none'):
+        for record in records:
+            data = dumps_passport(record, file_format)
+            _write_file_atomic(os.path.join(directory, f"{record['id']}.json"), data)
+            total_size += len(data)
+    return {'bytes_per_passport': total_size // len(records)}
+
+
+def _bench_format_read(ctx, file_format):
+    from .formats import loads_passport
+
+    records, directory = _format_samples(ctx, file_format)
+    if not os.listdir(directory):
+        _bench_format_write(ctx, file_format)
+    for record in records:
+        with open(os.path.join(directory, f"{record['id']}.json"), 'rb') as f:
+            loads_passport(f.read())
+
+
+@scenario('formats', f'запись x{FORMATS_SAMPLE_SIZE}: json')
+def bench_format_write_json(ctx):
+    return _bench_format_write(ctx, 'json')
+
+
+@scenario('formats', f'запись x{FORMATS_SAMPLE_SIZE}: json-compact')
+def bench_format_write_json_compact(ctx):
+    return _bench_format_write(ctx, 'json-compact')
+
+
+@scenario('formats', f'запись x{FORMATS_SAMPLE_SIZE}: gzip')
+def bench_format_write_gzip(ctx):
+    return _bench_format_write(ctx, 'gzip')
+
+
+@scenario('formats', f'запись x{FORMATS_SAMPLE_SIZE}: zstd')
+def bench_format_write_zstd(ctx):
+    return _bench_format_write(ctx, 'zstd')
+
+
+@scenario('formats', f'запись x{FORMATS_SAMPLE_SIZE}: msgpack')
+def bench_format_write_msgpack(ctx):
+    return _bench_format_write(ctx, 'msgpack')
+
+
+@scenario('formats', f'чтение x{FORMATS_SAMPLE_SIZE}: json')
+def bench_format_read_json(ctx):
+    _bench_format_read(ctx, 'json')
+
+
+@scenario('formats', f'чтение x{FORMATS_SAMPLE_SIZE}: json-compact')
+def bench_format_read_json_compact(ctx):
+    _bench_format_read(ctx, 'json-compact')
+
+
+@scenario('formats', f'чтение x{FORMATS_SAMPLE_SIZE}: gzip')
+def bench_format_read_gzip(ctx):
+    _bench_format_read(ctx, 'gzip')
+
+
+@scenario('formats', f'чтение x{FORMATS_SAMPLE_SIZE}: zstd')
+def bench_format_read_zstd(ctx):
+    _bench_format_read(ctx, 'zstd')
+
+
+@scenario('formats', f'чтение x{FORMATS_SAMPLE_SIZE}: msgpack')
+def bench_format_read_msgpack(ctx):
+    _bench_format_read(ctx, 'msgpack')
+
+
+def run_scenario(func, ctx, iterations, warmup=1):
+    """Выполняет сценарий и возвращает статистику задержек в миллисекундах"""
+    metrics = None
+    for _ in range(warmup):
+        metrics = func(ctx)
+
+    timings = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        func(ctx)
+        timings.append((time.perf_counter() - call_started) * 1000)
+    elapsed = time.perf_counter() - started
+
+    timings.sort()
+    result = {
+        'iterations': iterations,
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p50_ms': round(timings[len(timings) // 2], 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'max_ms': round(timings[-1], 3),
+        'throughput_rps': round(iterations / elapsed, 2) if elapsed else None,
+    }
+    if isinstance(metrics, dict):
+        result['metrics'] = metrics
+    return result
+
+
+def run_suites(ctx, suites, iterations, on_result=None):
+    """Прогоняет выбранные наборы сценариев"""
+    results = []
+    for suite in suites:
+        for name, func in SUITES[suite]:
+            try:
+                result = {'suite': suite, 'name': name, **run_scenario(func, ctx, iterations)}
+            except SkipScenario as e:
+                result = {'suite': suite, 'name': name, 'skipped': str(e)}
+            results.append(result)
+            if on_result:
+                on_result(result)
+    return results
+
+
+def create_benchmark_users(owners):
+    """Пользователи для замеров: администратор и владельцы паспортов"""
+    staff_user = User.objects.create(username='benchmark_staff', is_staff=True)
+    owner_users = [User.objects.create(username=f'benchmark_owner_{number}') for number in range(owners)]
+    return staff_user, owner_users
@@ -0,0 +1,27 @@
+"""Номера поколений в кэше Django.
+
+Номер поколения входит в ключи группы записей (страниц списка, отчетов,
+ролей). Увеличение номера сбрасывает сразу всю группу без перебора ключей,
+а устаревшие записи вытесняются по времени хранения.
+"""
+import time
+
+
+def get_generation(cache, key):
+    """Текущий номер поколения под ключом key в кэше cache"""
+    generation = cache.get(key)
+    if generation is None:
+        # Счетчик мог быть вытеснен раньше записей - новое поколение
+        # не должно совпасть с прежними, поэтому начинаем со времени
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(cache, key):
+    """Увеличивает номер поколения, сбрасывая все записи с ним в ключе"""
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Счетчика нет - следующее чтение начнет новое поколение со времени
+        pass
@@ -0,0 +1,221 @@
+"""Журнал изменений паспортов и работ для синхронизации клиентов.
+
+Каждое создание, изменение и удаление паспорта или работы записывается
+событием ChangeEvent в той же транзакции. Номер события (BigAutoField)
+служит меткой синхронизации: клиент запрашивает изменения после своей
+метки и получает только затронутые объекты и номера удаленных, то есть
+объем работы пропорционален числу изменений, а не размеру парка.
+
+Старые события удаляются командой prune_change_events. Клиент с меткой
+старше оставшихся событий получает ошибку ChangeTokenExpired и должен
+заново загрузить список целиком.
+"""
+import datetime
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import ChangeEvent, EquipmentPassport
+from .permissions import is_admin, scope_passports, scope_works
+
+PASSPORT = ChangeEvent.PASSPORT
+WORK = ChangeEvent.WORK
+CREATED = ChangeEvent.CREATED
+UPDATED = ChangeEvent.UPDATED
+DELETED = ChangeEvent.DELETED
+
+
+class ChangeTokenExpired(Exception):
+    """События после метки клиента уже удалены - нужна полная синхронизация"""
+
+
+def _passport_event(passport, action):
+    return ChangeEvent(
+        object_type=PASSPORT, object_id=passport.pk, passport_id=passport.pk,
+        owner_id=passport.created_by_id, action=action,
+    )
+
+
+def _work_event(work, action, passport_id=None, owner_id=None):
+    if passport_id is None:
+        passport_id = work.passport_id
+        owner_id = work.passport.created_by_id
+    return ChangeEvent(
+        object_type=WORK, object_id=work.pk, passport_id=passport_id, owner_id=owner_id, action=action,
+    )
+
+
+def passport_saved(passport, created):
+    _passport_event(passport, CREATED if created else UPDATED).save()
+
+
+def passport_deleted(passport):
+    _passport_event(passport, DELETED).save()
+
+
+def work_saved(work, created, old_passport_id=None):
+    """Событие сохранения работы; old_passport_id - паспорт до переноса работы"""
+    events = []
+    if old_passport_id is not None and old_passport_id != work.passport_id:
+        # У прежнего паспорта работа пропала - и, возможно, у другого владельца
+        old_owner_id = EquipmentPassport.objects.filter(pk=old_passport_id).values_list('created_by_id', flat=True).first()
+        events.append(_work_event(work, DELETED, old_passport_id, old_owner_id))
+    events.append(_work_event(work, CREATED if created else UPDATED))
+    ChangeEvent.objects.bulk_create(events)
+
+
+def work_deleted(work):
+    _work_event(work, DELETED).save()
+
+
+def passports_created(passports, works):
+    """События для паспортов и работ, созданных через bulk_create"""
+    owners = {passport.pk: passport.created_by_id for passport in passports}
+    ChangeEvent.objects.bulk_create(
+        [_passport_event(passport, CREATED) for passport in passports]
+        + [_work_event(work, CREATED, work.passport_id, owners.get(work.passport_id)) for work in works],
+        batch_size=1000,
+    )
+
+
+def passports_deleted(owners):
+    """События удаления паспортов {UUID паспорта: id владельца}; работы удаляются вместе с паспортом"""
+    ChangeEvent.objects.bulk_create(
+        [
+            ChangeEvent(object_type=PASSPORT, object_id=passport_id, passport_id=passport_id,
+                        owner_id=owner_id, action=DELETED)
+            for passport_id, owner_id in owners.items()
+        ],
+        batch_size=1000,
+    )
+
+
+def _upper_bound():
+    """Номер, до которого (не включая) события можно отдавать клиентам
+
+    События свежее PASSPORT_CHANGES_LAG секунд не отдаются: транзакции
+    фиксируются не в порядке номеров, и клиент, получив более поздний
+    номер, пропустил бы еще не зафиксированное событие с меньшим.
+    """
+    lag = settings.PASSPORT_CHANGES_LAG
+    if not lag:
+        return None
+    cutoff = timezone.now() - datetime.timedelta(seconds=lag)
+    return ChangeEvent.objects.filter(created_at__gt=cutoff).order_by('id').values_list('id', flat=True).first()
+
+
+def current_token():
+    """Метка, с которой начинает клиент после полной загрузки списка"""
+    upper = _upper_bound()
+    if upper is not None:
+        return upper - 1
+    return ChangeEvent.objects.aggregate(token=Max('id'))['token'] or 0
+
+
+def _check_token(since):
+    # Последнее событие команда очистки не удаляет, поэтому граница известна
+    # всегда. Пропуск номеров перед первым событием (откаченные транзакции)
+    # приводит к лишней полной синхронизации, но не к потере изменений
+    bounds = ChangeEvent.objects.order_by('id').values_list('id', flat=True)
+    oldest, latest = bounds.first(), bounds.last()
+    if oldest is None:
+        if since:
+            raise ChangeTokenExpired()
+        return
+    if since < oldest - 1 or since > latest:
+        raise ChangeTokenExpired()
+
+
+def _compact(events):
+    """Итоговое действие по каждому объекту: {(тип, UUID): действие}"""
+    actions = {}
+    for object_type, object_id, action in events:
+        key = (object_type, object_id)
+        # Созданный и затем измененный объект для клиента просто новый
+        if actions.get(key) == CREATED and action == UPDATED:
+            continue
+        actions[key] = action
+    return actions
+
+
+def collect_changes(user, since, limit=None):
+    """Изменения, видимые пользователю user, после метки since
+
+    Возвращает словарь с новой меткой token, признаком has_more (есть
+    следующая порция) и для паспортов и работ - списками created, updated
+    (объекты) и deleted (UUID). Паспорта, у которых изменились работы, тоже
+    попадают в updated: в них хранится сводка работ.
+    """
+    limit = min(limit or settings.PASSPORT_CHANGES_PAGE_SIZE, settings.PASSPORT_CHANGES_PAGE_SIZE)
+    _check_token(since)
+
+    # Граница берется до чтения событий: событие, зафиксированное после
+    # чтения, получит номер больше границы и придет в следующем запросе
+    bound = max(current_token(), since)
+    events = ChangeEvent.objects.filter(id__gt=since, id__lte=bound).order_by('id')
+    if not is_admin(user):
+        events = events.filter(owner=user)
+    rows = list(events.values_list('id', 'object_type', 'object_id', 'passport_id', 'action')[:limit + 1])
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    # Без has_more метка - граница: чужие события пропускаются целиком
+    token = rows[-1][0] if has_more else bound
+
+    actions = _compact((object_type, object_id, action) for _, object_type, object_id, _, action in rows)
+    changed = {
+        object_type: {CREATED: [], UPDATED: [], DELETED: []} for object_type in (PASSPORT, WORK)
+    }
+    for (object_type, object_id), action in actions.items():
+        changed[object_type][action].append(object_id)
+
+    deleted_passports = set(changed[PASSPORT][DELETED])
+    saved_passports = set(changed[PASSPORT][CREATED]) | set(changed[PASSPORT][UPDATED])
+    for _, object_type, _, passport_id, _ in rows:
+        if object_type == WORK and passport_id not in deleted_passports and passport_id not in saved_passports:
+            changed[PASSPORT][UPDATED].append(passport_id)
+            saved_passports.add(passport_id)
+
+    passports = scope_passports(user, EquipmentPassport.objects.select_related('created_by'))
+    works = scope_works(user)
+    # Объект мог быть удален после последнего события порции - его
+    # удаление придет в следующих событиях
+    passports = passports.in_bulk(saved_passports)
+    works = works.in_bulk(changed[WORK][CREATED] + changed[WORK][UPDATED])
+
+    def existing(objects, ids):
+        return [objects[object_id] for object_id in ids if object_id in objects]
+
+    return {
+        'token': token,
+        'has_more': has_more,
+        'passports': {
+            CREATED: existing(passports, changed[PASSPORT][CREATED]),
+            UPDATED: existing(passports, changed[PASSPORT][UPDATED]),
+            DELETED: changed[PASSPORT][DELETED],
+        },
+        'works': {
+            CREATED: existing(works, changed[WORK][CREATED]),
+            UPDATED: existing(works, changed[WORK][UPDATED]),
+            DELETED: changed[WORK][DELETED],
+        },
+    }
+
+
+def prune_events(before, batch_size=10000):
+    """Удаляет события старше before порциями; возвращает число удаленных
+
+    Последнее событие остается: по нему определяется, что метка клиента
+    устарела.
+    """
+    latest = ChangeEvent.objects.aggregate(latest=Max('id'))['latest']
+    if latest is None:
+        return 0
+    old = ChangeEvent.objects.filter(created_at__lt=before, id__lt=latest).order_by('id')
+    deleted = 0
+    while True:
+        ids = list(old.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += ChangeEvent.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,32 @@
+"""Проверки настроек приложения (manage.py check --deploy).
+
+Номера поколений кэша списка и аналитики и роли пользователей хранятся
+в кэше Django и должны быть видны всем процессам сервера. Кэш в памяти процесса (LocMemCache) подходит только
+для одного процесса, например runserver: сброс в одном процессе не
+доходит до других, и они до истечения срока хранения отдают устаревшие
+страницы, отчеты и роли.
+"""
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Tags, Warning, register
+
+
+def is_process_local(alias=DEFAULT_CACHE_ALIAS):
+    """Хранит ли кэш alias данные в памяти процесса (не виден другим процессам)"""
+    return isinstance(caches[alias], LocMemCache)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    aliases = {DEFAULT_CACHE_ALIAS, settings.PASSPORT_LIST_CACHE_ALIAS}
+    return [
+        Warning(
+            f"Кэш '{alias}' хранится в памяти процесса: сброс кэша списка, аналитики "
+            "и ролей не виден другим процессам сервера.",
+            hint="Для нескольких процессов задайте в CACHES общий кэш: Redis, Memcached или DatabaseCache.",
+            id='passports.W001',
+        )
+        for alias in sorted(aliases)
+        if is_process_local(alias)
+    ]
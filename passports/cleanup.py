@@ -0,0 +1,120 @@
+"""Удаление файлов зеркала, для которых нет паспортов в базе данных.
+
+Папка и ее подпапки читаются потоково через os.scandir, существование паспортов
+проверяется одним запросом id__in на порцию файлов, а удаление идет в
+пуле потоков. Память ограничена размером порции, а не числом файлов.
+
+Заодно удаляются временные файлы атомарной записи, оставшиеся после сбоя
+процесса. Файл младше PASSPORT_TEMP_FILE_MAX_AGE секунд может принадлежать
+идущей записи и не трогается.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .utils import iter_mirror_files, iter_temp_files
+
+
+class CleanupReport:
+    """Итог очистки: просмотренные и удаленные файлы, освобожденное место"""
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.scanned_files = 0
+        self.orphaned_passports = 0
+        self.deleted_files = 0
+        self.reclaimed_bytes = 0
+        self.temp_files_deleted = 0
+        self.errors = []
+
+    def as_dict(self):
+        return {
+            'dry_run': self.dry_run,
+            'scanned_files': self.scanned_files,
+            'orphaned_passports': self.orphaned_passports,
+            'deleted_files': self.deleted_files,
+            'reclaimed_bytes': self.reclaimed_bytes,
+            'temp_files_deleted': self.temp_files_deleted,
+            'errors': self.errors,
+        }
+
+
+def _existing_passport_ids(passport_ids):
+    from .models import EquipmentPassport
+    return set(EquipmentPassport.objects.filter(id__in=passport_ids).order_by().values_list('id', flat=True))
+
+
+def _remove_file(path, dry_run):
+    """Удаляет файл; возвращает (размер, ошибка), размер None - файла уже нет"""
+    try:
+        size = os.stat(path).st_size
+        if not dry_run:
+            os.remove(path)
+    except FileNotFoundError:
+        return None, None
+    except OSError as e:
+        return None, f'{path}: {e}'
+    return size, None
+
+
+def _process_batch(files_by_passport, executor, report):
+    existing = _existing_passport_ids(list(files_by_passport))
+    orphaned_paths = []
+    for passport_id, paths in files_by_passport.items():
+        if passport_id not in existing:
+            report.orphaned_passports += 1
+            orphaned_paths.extend(paths)
+
+    for size, error in executor.map(lambda path: _remove_file(path, report.dry_run), orphaned_paths):
+        if error:
+            report.errors.append(error)
+        elif size is not None:
+            report.deleted_files += 1
+            report.reclaimed_bytes += size
+
+
+def _remove_stale_temp_files(report, executor):
+    cutoff = time.time() - settings.PASSPORT_TEMP_FILE_MAX_AGE
+    stale_paths = []
+    for entry in iter_temp_files():
+        try:
+            if entry.stat().st_mtime < cutoff:
+                stale_paths.append(entry.path)
+        except FileNotFoundError:
+            # Запись завершилась, файл переименован
+            continue
+
+    for size, error in executor.map(lambda path: _remove_file(path, report.dry_run), stale_paths):
+        if error:
+            report.errors.append(error)
+        elif size is not None:
+            report.temp_files_deleted += 1
+            report.reclaimed_bytes += size
+
+
+def find_and_remove_orphaned_files(dry_run=False, batch_size=1000, workers=8):
+    """Удаляет файлы паспортов, которых нет в базе данных
+
+    Паспорт, файлы которого попали в разные порции, проверяется и
+    учитывается в отчете в каждой из них. Устаревшие временные файлы
+    записи тоже удаляются. С dry_run файлы только подсчитываются. Возвращает CleanupReport.
+    """
+    report = CleanupReport(dry_run=dry_run)
+    files_by_passport = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for passport_id, path in iter_mirror_files():
+            report.scanned_files += 1
+            files_by_passport.setdefault(passport_id, []).append(path)
+            if len(files_by_passport) >= batch_size:
+                _process_batch(files_by_passport, executor, report)
+                files_by_passport = {}
+
+        if files_by_passport:
+            _process_batch(files_by_passport, executor, report)
+
+        _remove_stale_temp_files(report, executor)
+
+    return report
@@ -0,0 +1,95 @@
+"""Условные GET-запросы к паспортам (ETag и Last-Modified).
+
+Валидаторы ответа вычисляются дешево, без загрузки и сериализации данных:
+для ответов из базы - по updated_at и works_changed_at паспорта, для ответов
+из файлов - по сигнатуре файлов (inode, размер, время изменения). Если
+клиент прислал совпадающий If-None-Match или If-Modified-Since, отвечаем
+304 без тела. ETag слабый: одно и то же состояние может отдаваться в разных
+байтах (сжатие, маскированный CSRF-токен на страницах).
+"""
+import hashlib
+import time
+from datetime import datetime
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .file_cache import file_signature
+from .utils import resolve_passport_paths
+
+
+def _to_timestamp(value):
+    return value.timestamp() if value is not None else None
+
+
+def make_validators(parts, modified=()):
+    """(ETag, Last-Modified) для состояния parts
+
+    parts - значения, от которых зависит ответ; modified - моменты изменения
+    (datetime или метка времени), из которых берется самый поздний.
+    Last-Modified с точностью до секунды, поэтому для изменения в текущей
+    секунде он не отдается (None): следующее изменение в ту же секунду
+    дало бы ту же дату, и клиент получил бы 304 на устаревшую копию.
+    """
+    digest = hashlib.sha1(repr(tuple(parts)).encode()).hexdigest()
+    timestamps = [
+        _to_timestamp(value) if isinstance(value, datetime) else value
+        for value in modified
+    ]
+    timestamps = [value for value in timestamps if value is not None]
+    last_modified = int(max(timestamps)) if timestamps else None
+    if last_modified is not None and last_modified >= int(time.time()):
+        last_modified = None
+    return 'W/' + quote_etag(digest), last_modified
+
+
+def passport_validators(passport_id, updated_at, works_changed_at, *extra):
+    """Валидаторы ответа, построенного по паспорту и его работам из базы"""
+    return make_validators(
+        (str(passport_id), _to_timestamp(updated_at), _to_timestamp(works_changed_at)) + extra,
+        (updated_at, works_changed_at),
+    )
+
+
+def file_validators(paths, *extra, modified=()):
+    """Валидаторы ответа, построенного по файлам paths
+
+    modified - моменты изменения других данных ответа, кроме файлов.
+    Ожидающая запись зеркала изменит файлы, а с ними и валидаторы.
+    """
+    signature = file_signature(paths)
+    modified = tuple(modified)
+    return make_validators(
+        (signature, tuple(_to_timestamp(value) for value in modified)) + extra,
+        [item[2] / 1e9 for item in signature if item is not None] + list(modified),
+    )
+
+
+def passport_file_validators(passport_id, *extra, history=False, modified=(), paths=None):
+    """Валидаторы ответа из файла паспорта (и, с history, из истории)
+
+    paths - пути из resolve_passport_paths; их же представление передает в чтение файлов.
+    """
+    paths = paths or resolve_passport_paths(passport_id)
+    files = [paths.snapshot, paths.works_log]
+    if history:
+        files += [paths.history, paths.legacy_history]
+    return file_validators(files, *extra, modified=modified)
+
+
+def not_modified(request, etag, last_modified):
+    """Ответ 304, если у клиента актуальная копия, иначе None"""
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    """Добавляет валидаторы к ответу; клиент должен сверяться с сервером перед повтором"""
+    response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
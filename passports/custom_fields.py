@@ -0,0 +1,176 @@
+"""Фильтры по пользовательским полям (custom_fields) паспортов и работ.
+
+Синтаксис параметров запроса: cf.<поле>__<сравнение>=<значение>, например
+cf.Напряжение__gte=380 или cf.Производитель=ABB. Значение поля берется из
+{"<поле>": {"value": ...}}, а для старых записей вида {"<поле>": ...} - из
+самого ключа.
+
+Имя поля подставляется в SQL литералом, а не параметром: только так
+выражение в запросе совпадает с выражением индекса и СУБД использует индекс.
+Поэтому имя поля проверяется по белому списку символов. Индексы для частых
+полей объявляются в PASSPORT_CUSTOM_FIELD_INDEXES и создаются командой
+sync_custom_field_indexes.
+"""
+import hashlib
+import json
+import re
+
+from django.conf import settings
+from django.db import NotSupportedError
+from django.db.models import F, FloatField, Func, TextField
+
+from .models import EquipmentPassport, MaintenanceWork
+
+PARAM_PREFIX = 'cf.'
+
+# Модели с пользовательскими полями - под этими именами они указываются в настройках
+MODELS = {'passport': EquipmentPassport, 'work': MaintenanceWork}
+
+LOOKUPS = ('exact', 'iexact', 'contains', 'icontains', 'startswith', 'gt', 'gte', 'lt', 'lte', 'in', 'isnull')
+RANGE_LOOKUPS = ('gt', 'gte', 'lt', 'lte')
+
+INDEX_PREFIX = 'cf_'
+
+# Версия SQL выражений индексов: входит в имя индекса, поэтому после
+# изменения выражений sync_custom_field_indexes пересоздает индексы
+INDEX_VERSION = 2
+
+# Буквы, цифры, пробел и знаки, которые не требуют экранирования ни в
+# строковом литерале SQL, ни в пути JSON
+_KEY_RE = re.compile(r'^[\w .,()/№-]{1,100}$')
+_NUMBER_RE = re.compile(r'^\s*-?\d+(\.\d+)?([eE][-+]?\d+)?\s*$')
+
+
+class CustomFieldFilterError(ValueError):
+    """Неверный фильтр по пользовательскому полю"""
+
+
+def validate_key(key):
+    if not _KEY_RE.match(key):
+        raise CustomFieldFilterError(f'Недопустимое имя пользовательского поля {key!r}')
+    return key
+
+
+def _value_sql(vendor, column_sql, key):
+    """SQL значения поля как есть: в SQLite JSON-число остается числом"""
+    if vendor == 'sqlite':
+        # Django хранит JSON с экранированием не-ASCII символов (\\uXXXX), а
+        # SQLite сравнивает ключи пути с сохраненным текстом - как и Django,
+        # записываем ключ в пути в том же виде
+        path_key = json.dumps(key)
+        return (f"COALESCE(JSON_EXTRACT({column_sql}, '$.{path_key}.\"value\"'), "
+                f"JSON_EXTRACT({column_sql}, '$.{path_key}'))")
+    if vendor == 'postgresql':
+        return f"COALESCE(({column_sql} -> '{key}' ->> 'value'), ({column_sql} ->> '{key}'))"
+    raise NotSupportedError(f'Фильтры по пользовательским полям не поддерживаются для {vendor}')
+
+
+def custom_field_sql(vendor, column_sql, key, numeric=False):
+    """SQL значения поля key из JSON-столбца column_sql
+
+    Без numeric - текст: число 220 и строка "220" дают одинаковое значение
+    '220'. Для numeric - число или NULL, если значение не является числом
+    в записи JSON (-?цифры[.цифры][e±цифры]).
+    """
+    value_sql = _value_sql(vendor, column_sql, validate_key(key))
+    if vendor == 'sqlite':
+        if not numeric:
+            # JSON_EXTRACT отдает JSON-число как INTEGER/REAL, а оно не равно
+            # никакой строке - приводим к тексту, как ->> в PostgreSQL
+            return f'CAST({value_sql} AS TEXT)'
+        # JSON_TYPE разбирает строку по грамматике JSON-числа; для
+        # некорректного JSON он выдает ошибку, поэтому сначала JSON_VALID
+        return (f"(CASE WHEN TYPEOF({value_sql}) IN ('integer', 'real') "
+                f"OR (CASE WHEN JSON_VALID(TRIM({value_sql})) THEN JSON_TYPE(TRIM({value_sql})) END) "
+                f"IN ('integer', 'real') "
+                f"THEN CAST({value_sql} AS REAL) END)")
+    if not numeric:
+        return value_sql
+    return (f"(CASE WHEN {value_sql} ~ '^\\s*-?(0|[1-9][0-9]*)(\\.[0-9]+)?([eE][-+]?[0-9]+)?\\s*$' "
+            f"THEN ({value_sql})::double precision END)")
+
+
+class CustomFieldValue(Func):
+    """Значение пользовательского поля key: текст или, с numeric, число"""
+
+    def __init__(self, key, numeric=False, field_name='custom_fields'):
+        self.key = validate_key(key)
+        self.numeric = numeric
+        super().__init__(F(field_name), output_field=FloatField() if numeric else TextField())
+
+    def as_sql(self, compiler, connection, **extra_context):
+        column_sql, params = compiler.compile(self.source_expressions[0])
+        return custom_field_sql(connection.vendor, column_sql, self.key, self.numeric), params
+
+
+def indexed_fields(model):
+    """Поля модели с индексами из настроек: {имя поля: 'number' или 'text'}"""
+    label = next(label for label, indexed_model in MODELS.items() if indexed_model is model)
+    return settings.PASSPORT_CUSTOM_FIELD_INDEXES.get(label, {})
+
+
+def parse_custom_field_filters(params):
+    """Разбирает параметры cf.<поле>__<сравнение> в список (поле, сравнение, значение)"""
+    filters = []
+    for name in params:
+        if not name.startswith(PARAM_PREFIX):
+            continue
+        key, _, lookup = name[len(PARAM_PREFIX):].rpartition('__')
+        if not key or lookup not in LOOKUPS:
+            key, lookup = name[len(PARAM_PREFIX):], 'exact'
+        validate_key(key)
+        for value in params.getlist(name):
+            filters.append((key, lookup, value))
+    return filters
+
+
+def _lookup_value(lookup, value, numeric):
+    if lookup == 'isnull':
+        if value.lower() not in ('1', 'true', '0', 'false'):
+            raise CustomFieldFilterError('Для isnull ожидается true или false')
+        return value.lower() in ('1', 'true')
+
+    values = [item.strip() for item in value.split(',')] if lookup == 'in' else [value]
+    if numeric:
+        if not all(_NUMBER_RE.match(item) for item in values):
+            raise CustomFieldFilterError(f'Ожидается число: {value!r}')
+        values = [float(item) for item in values]
+    return values if lookup == 'in' else values[0]
+
+
+def filter_custom_fields(queryset, params):
+    """Применяет к queryset фильтры cf.* из params (QueryDict)
+
+    Поле, объявленное в настройках как 'number', и сравнения больше/меньше
+    с числовым значением сравниваются как числа, остальные - как текст.
+    """
+    indexed = indexed_fields(queryset.model)
+    for key, lookup, value in parse_custom_field_filters(params):
+        numeric = indexed.get(key) == 'number' and lookup not in ('contains', 'icontains', 'startswith', 'iexact')
+        if lookup in RANGE_LOOKUPS and _NUMBER_RE.match(value):
+            numeric = True
+
+        expression = CustomFieldValue(key, numeric=numeric)
+        lookup_class = expression.get_lookup(lookup)
+        queryset = queryset.filter(lookup_class(expression, _lookup_value(lookup, value, numeric)))
+    return queryset
+
+
+def index_name(label, key, kind):
+    digest = hashlib.sha1(f'{key}:{kind}:{INDEX_VERSION}'.encode()).hexdigest()[:12]
+    return f'{INDEX_PREFIX}{label}_{digest}'
+
+
+def declared_indexes(vendor, quote_name):
+    """Индексы из настроек: {(таблица, имя индекса): SQL выражения}"""
+    indexes = {}
+    for label, fields in settings.PASSPORT_CUSTOM_FIELD_INDEXES.items():
+        model = MODELS[label]
+        column_sql = quote_name(model._meta.get_field('custom_fields').column)
+        for key, kind in fields.items():
+            if kind not in ('number', 'text'):
+                raise CustomFieldFilterError(f"Тип индекса поля {key!r} должен быть 'number' или 'text'")
+            indexes[(model._meta.db_table, index_name(label, key, kind))] = custom_field_sql(
+                vendor, column_sql, key, numeric=kind == 'number'
+            )
+    return indexes
@@ -0,0 +1,168 @@
+"""Массовое удаление паспортов вместе с работами и файлами.
+
+Строки удаляются порциями, каждая в своей транзакции: сначала работы,
+затем паспорта, одним DELETE ... WHERE ... IN (...) на таблицу через
+курсор, без загрузки объектов и каскадного сборщика Django. Файлы зеркала,
+фото и их уменьшенные копии удаляются после фиксации порции. Большие
+выборки можно удалять фоновым заданием, ход которого хранится в БД
+(BulkDeleteJob) и виден всем процессам сервера.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connections, router, transaction
+from django.utils import timezone
+
+from .models import BulkDeleteJob, EquipmentPassport, MaintenanceWork
+from .mirror import discard_passport
+from .signals import passports_bulk_deleted
+from .thumbnails import delete_photos
+from .utils import delete_multiple_passport_files, delete_passport_file
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionReport:
+    """Итог удаления: строки БД и файлы"""
+
+    def __init__(self, total=0):
+        self.total = total
+        self.passports_deleted = 0
+        self.works_deleted = 0
+        self.files_deleted = 0
+        self.file_errors = 0
+
+    def as_dict(self):
+        return {
+            'total': self.total,
+            'passports_deleted': self.passports_deleted,
+            'works_deleted': self.works_deleted,
+            'files_deleted': self.files_deleted,
+            'file_errors': self.file_errors,
+        }
+
+
+def delete_passport_with_files(passport):
+    """Удаляет паспорт с работами, файлы - после фиксации транзакции
+
+    Если удаление строки откатится, файлы паспорта останутся на месте.
+    """
+    passport_id, photo = passport.id, passport.photo
+    using = router.db_for_write(EquipmentPassport, instance=passport)
+
+    with transaction.atomic(using=using):
+        passport.delete()
+
+        def remove_files():
+            discard_passport(passport_id)
+            delete_passport_file(passport_id)
+            if photo:
+                delete_photos(photo.storage, [photo.name])
+
+        transaction.on_commit(remove_files, using=using)
+
+
+def _delete_rows(model, field_name, values, using):
+    """DELETE FROM <таблица модели> WHERE <поле> IN (values); возвращает число строк"""
+    connection = connections[using]
+    field = model._meta.get_field(field_name)
+    quote = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(values))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(model._meta.db_table)} WHERE {quote(field.column)} IN ({placeholders})',
+            [field.get_db_prep_value(value, connection) for value in values],
+        )
+        return cursor.rowcount
+
+
+def _delete_chunk(passport_ids, report, workers):
+    using = router.db_for_write(EquipmentPassport)
+
+    with transaction.atomic(using=using):
+        # Владельцы нужны журналу изменений, а имена фото - удалению файлов:
+        # после удаления строк их не узнать
+        owners, photo_names = {}, []
+        rows = EquipmentPassport.objects.using(using).filter(id__in=passport_ids).values_list(
+            'id', 'created_by_id', 'photo'
+        )
+        for passport_id, owner_id, photo_name in rows:
+            owners[passport_id] = owner_id
+            if photo_name:
+                photo_names.append(photo_name)
+
+        # Работы - единственная таблица со ссылкой на паспорт (CASCADE)
+        works_deleted = _delete_rows(MaintenanceWork, 'passport', passport_ids, using)
+        passports_deleted = _delete_rows(EquipmentPassport, 'id', passport_ids, using)
+
+        # post_delete при таком удалении не отправляется
+        passports_bulk_deleted.send(sender=EquipmentPassport, passport_ids=passport_ids, owners=owners)
+
+        def remove_files():
+            for passport_id in passport_ids:
+                discard_passport(passport_id)
+            files_deleted, file_errors = delete_multiple_passport_files(passport_ids, workers=workers)
+            storage = EquipmentPassport._meta.get_field('photo').storage
+            photos_deleted, photo_errors = delete_photos(storage, photo_names)
+            report.files_deleted += files_deleted + photos_deleted
+            report.file_errors += file_errors + photo_errors
+
+        transaction.on_commit(remove_files, using=using)
+
+    report.passports_deleted += passports_deleted
+    report.works_deleted += works_deleted
+
+
+def bulk_delete_passports(queryset, chunk_size=None, workers=None, progress=None):
+    """Удаляет паспорта из queryset порциями по chunk_size
+
+    Каждая порция фиксируется отдельно, поэтому при ошибке удаленными
+    остаются уже обработанные порции. progress(report) вызывается после
+    каждой порции. Возвращает DeletionReport.
+    """
+    chunk_size = chunk_size or settings.PASSPORT_BULK_DELETE_CHUNK_SIZE
+    workers = workers or settings.PASSPORT_BULK_DELETE_WORKERS
+    queryset = queryset.order_by()
+    report = DeletionReport(total=queryset.count())
+
+    while True:
+        # Удаленные строки из выборки пропадают - берем всегда первую порцию
+        passport_ids = list(queryset.values_list('id', flat=True)[:chunk_size])
+        if not passport_ids:
+            break
+        _delete_chunk(passport_ids, report, workers)
+        if progress:
+            progress(report)
+
+    return report
+
+
+def get_bulk_delete_job(job_id):
+    """Состояние фонового удаления или None, если задание не найдено"""
+    job = BulkDeleteJob.objects.select_related('created_by').filter(pk=job_id).first()
+    return job.as_dict() if job is not None else None
+
+
+def _run_job(job_id, queryset):
+    jobs = BulkDeleteJob.objects.filter(pk=job_id)
+    try:
+        report = bulk_delete_passports(queryset, progress=lambda report: jobs.update(**report.as_dict()))
+        jobs.update(status=BulkDeleteJob.DONE, **report.as_dict())
+    except Exception as e:
+        logger.exception('Фоновое удаление паспортов %s завершилось ошибкой', job_id)
+        jobs.update(status=BulkDeleteJob.FAILED, error=str(e))
+    finally:
+        jobs.update(finished_at=timezone.now())
+        close_old_connections()
+
+
+def start_bulk_delete_job(queryset, user):
+    """Запускает удаление в фоновом потоке и возвращает состояние задания с его id"""
+    job = BulkDeleteJob.objects.create(created_by=user, total=queryset.count())
+
+    thread = threading.Thread(
+        target=_run_job, args=(job.pk, queryset), name=f'passport-bulk-delete-{job.pk.hex}', daemon=True
+    )
+    thread.start()
+    return job.as_dict()
@@ -0,0 +1,125 @@
+"""Потоковая выгрузка паспортов в JSON Lines, CSV и JSON.
+
+Паспорта читаются из БД порциями через QuerySet.iterator(), а ответ
+формируется по мере чтения, поэтому расход памяти не зависит от размера парка.
+"""
+import csv
+import io
+import json
+import zlib
+
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+
+from .models import MaintenanceWork
+from .utils import serialize_passport
+
+EXPORT_FORMATS = {
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'json': ('application/json; charset=utf-8', 'json'),
+}
+
+# Колонки CSV; вложенные структуры записываются в колонку как JSON
+CSV_COLUMNS = [
+    'id', 'name', 'equipment_type', 'serial_number', 'inventory_number', 'production_date',
+    'commissioning_date', 'description', 'location', 'responsible_person', 'status',
+    'last_maintenance', 'created_by', 'created_at', 'updated_at', 'custom_fields', 'maintenance_works',
+]
+
+# Размер порции ответа: мелкие строки собираются в блоки перед отправкой
+STREAM_BUFFER_SIZE = 64 * 1024
+
+
+def iter_passport_records(queryset, chunk_size=500):
+    """Отдает паспорта вместе с работами в виде словарей, порциями из БД"""
+    queryset = queryset.select_related('equipment_type', 'created_by').prefetch_related(
+        Prefetch('maintenance_works', queryset=MaintenanceWork.objects.select_related('created_by'))
+    )
+    for passport in queryset.iterator(chunk_size=chunk_size):
+        yield serialize_passport(passport)
+
+
+def iter_jsonl(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def iter_json_array(records, **dumps_kwargs):
+    """JSON-массив, выдаваемый по одному элементу"""
+    yield '['
+    separator = ''
+    for record in records:
+        yield separator + json.dumps(record, ensure_ascii=False, **dumps_kwargs)
+        separator = ',\n'
+    yield ']\n'
+
+
+def iter_csv(records):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    writer.writerow(CSV_COLUMNS)
+    yield flush()
+    for record in records:
+        writer.writerow([
+            json.dumps(record[column], ensure_ascii=False)
+            if column in ('custom_fields', 'maintenance_works') else record[column]
+            for column in CSV_COLUMNS
+        ])
+        yield flush()
+
+
+def _buffered(chunks):
+    """Собирает мелкие строки в блоки и кодирует их в UTF-8"""
+    parts, size = [], 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        parts.append(data)
+        size += len(data)
+        if size >= STREAM_BUFFER_SIZE:
+            yield b''.join(parts)
+            parts, size = [], 0
+    if parts:
+        yield b''.join(parts)
+
+
+def _gzipped(chunks):
+    """Сжимает поток в формат gzip на лету"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def streaming_export_response(queryset, export_format='jsonl', compress=False, filename='passports_export',
+                              chunk_size=500):
+    """Потоковый ответ с выгрузкой паспортов"""
+    content_type, extension = EXPORT_FORMATS[export_format]
+    records = iter_passport_records(queryset, chunk_size=chunk_size)
+
+    if export_format == 'csv':
+        chunks = iter_csv(records)
+    elif export_format == 'json':
+        chunks = iter_json_array(records, indent=2)
+    else:
+        chunks = iter_jsonl(records)
+
+    stream = _buffered(chunks)
+    filename = f'{filename}.{extension}'
+    if compress:
+        stream = _gzipped(stream)
+        content_type = 'application/gzip'
+        filename += '.gz'
+
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
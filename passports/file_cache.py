@@ -0,0 +1,144 @@
+"""Кэш разобранных файлов паспортов и истории.
+
+Два уровня: LRU в памяти процесса и общий кэш Django для нескольких
+процессов. Общий уровень включается только отдельным кэшем
+PASSPORT_FILE_CACHE_ALIAS, который виден всем процессам (Redis, Memcached):
+кэш в памяти процесса лишь хранил бы вторую копию значений из LRU. Запись хранится вместе с сигнатурой файлов - inode, размер и
+время изменения - и используется, только пока сигнатура совпадает с
+текущей, поэтому изменения из других процессов видны сразу. Запись
+файлов в этом процессе сбрасывает кэш паспорта явно.
+
+Значения из кэша общие для всех запросов - изменять их нельзя.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .checks import is_process_local
+
+
+def file_signature(paths):
+    """Сигнатура файлов paths: (inode, размер, время изменения) или None для отсутствующего"""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            signature.append(None)
+            continue
+        signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+class FileCache:
+    """Кэш значений, вычисленных из файлов, с проверкой по сигнатуре
+
+    Ключ - (вид данных, UUID паспорта); под ключом хранятся варианты,
+    например разные страницы истории одного паспорта.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Метрики
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _shared_cache(self):
+        alias = settings.PASSPORT_FILE_CACHE_ALIAS
+        if not settings.PASSPORT_FILE_CACHE_TIMEOUT or alias is None or is_process_local(alias):
+            return None
+        return caches[alias]
+
+    @staticmethod
+    def _shared_key(kind, passport_id):
+        return f'passports:file:{kind}:{passport_id}'
+
+    def get_or_load(self, kind, passport_id, paths, loader, variant=None):
+        """Значение из кэша, если файлы paths не менялись, иначе loader()"""
+        key = (kind, str(passport_id))
+        # Сигнатура снимается до чтения: если файл изменится во время
+        # чтения, следующее обращение увидит другую сигнатуру
+        signature = file_signature(paths)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['signature'] == signature and variant in entry['variants']:
+                self._entries.move_to_end(key)
+                self.local_hits += 1
+                return entry['variants'][variant]
+
+        shared_cache = self._shared_cache()
+        shared_key = self._shared_key(*key)
+        shared_entry = shared_cache.get(shared_key) if shared_cache is not None else None
+        if shared_entry is not None and shared_entry['signature'] == signature \
+                and variant in shared_entry['variants']:
+            value = shared_entry['variants'][variant]
+            self.shared_hits += 1
+            self._store_local(key, signature, variant, value)
+            return value
+
+        value = loader()
+        self.misses += 1
+        self._store_local(key, signature, variant, value)
+
+        if shared_cache is not None:
+            if shared_entry is None or shared_entry['signature'] != signature:
+                shared_entry = {'signature': signature, 'variants': {}}
+            shared_entry['variants'][variant] = value
+            shared_cache.set(shared_key, shared_entry, settings.PASSPORT_FILE_CACHE_TIMEOUT)
+        return value
+
+    def _store_local(self, key, signature, variant, value):
+        if settings.PASSPORT_FILE_CACHE_SIZE <= 0:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['signature'] != signature:
+                entry = self._entries[key] = {'signature': signature, 'variants': {}}
+            entry['variants'][variant] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.PASSPORT_FILE_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, kind, passport_id):
+        """Сбрасывает кэш паспорта после записи или удаления его файлов"""
+        key = (kind, str(passport_id))
+        with self._lock:
+            self._entries.pop(key, None)
+            self.invalidations += 1
+
+        shared_cache = self._shared_cache()
+        if shared_cache is not None:
+            shared_cache.delete(self._shared_key(*key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.local_hits + self.shared_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': settings.PASSPORT_FILE_CACHE_SIZE,
+                'local_hits': self.local_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_ratio': round((self.local_hits + self.shared_hits) / lookups, 3) if lookups else None,
+                'invalidations': self.invalidations,
+            }
+
+
+_file_cache = FileCache()
+
+
+def get_file_cache():
+    """Возвращает общий для процесса кэш файлов"""
+    return _file_cache
@@ -0,0 +1,97 @@
+"""Генерация синтетического парка оборудования для нагрузочных замеров"""
+import datetime
+import random
+from decimal import Decimal
+
+from .aggregates import fill_aggregates
+from .changes import passports_created
+from .list_cache import invalidate_lists
+from .models import EquipmentPassport, MaintenanceWork
+from .search import get_search_backend
+from .utils import save_passport_to_file, add_passport_history_entry, durable_batch
+
+LOCATIONS = ['Цех №1', 'Цех №2', 'Котельная', 'Насосная станция', 'Склад', 'Компрессорная']
+NAMES = ['Насос', 'Компрессор', 'Электродвигатель', 'Вентилятор', 'Трансформатор', 'Задвижка']
+MANUFACTURERS = ['ABB', 'Siemens', 'Grundfos', 'Элком', 'Уралэлектро']
+
+
+def _passport_custom_fields(rng):
+    return {
+        'Напряжение': {'value': str(rng.choice([220, 380, 6000, 10000])), 'type': 'number'},
+        'Производитель': {'value': rng.choice(MANUFACTURERS), 'type': 'text'},
+        'Взрывозащита': {'value': rng.choice(['true', 'false']), 'type': 'boolean'},
+    }
+
+
+def _work_custom_fields(rng):
+    return {
+        'Наработка, ч': {'value': str(rng.randrange(100, 50000)), 'type': 'number'},
+    }
+
+
+def generate_fleet(owners, passports, works_per_passport, history_per_passport=0, with_files=False,
+                   batch_size=1000, seed=0):
+    """Создает passports паспортов с works_per_passport работами у каждого
+
+    Паспорта распределяются по владельцам из owners по кругу. С with_files
+    для каждого паспорта записывается файл и history_per_passport записей
+    истории. Возвращает список UUID созданных паспортов.
+    """
+    rng = random.Random(seed)
+    statuses = [choice for choice, _ in EquipmentPassport.STATUS_CHOICES]
+    work_types = [choice for choice, _ in MaintenanceWork.WORK_TYPES]
+    start = datetime.date(2010, 1, 1)
+    search_backend = get_search_backend()
+    passport_ids = []
+
+    for offset in range(0, passports, batch_size):
+        batch = []
+        for number in range(offset, min(offset + batch_size, passports)):
+            production_date = start + datetime.timedelta(days=rng.randrange(4000))
+            batch.append(EquipmentPassport(
+                name=f'{rng.choice(NAMES)} {number}',
+                serial_number=f'SN-{number:08d}',
+                inventory_number=f'INV-{rng.randrange(10 ** 7):07d}',
+                production_date=production_date,
+                commissioning_date=production_date + datetime.timedelta(days=rng.randrange(365)),
+                description=f'Синтетический паспорт №{number}',
+                location=rng.choice(LOCATIONS),
+                status=rng.choice(statuses),
+                created_by=owners[number % len(owners)],
+                custom_fields=_passport_custom_fields(rng),
+            ))
+
+        works = []
+        for passport in batch:
+            passport_ids.append(passport.id)
+            for _ in range(works_per_passport):
+                works.append(MaintenanceWork(
+                    passport=passport,
+                    work_type=rng.choice(work_types),
+                    work_date=passport.commissioning_date + datetime.timedelta(days=rng.randrange(3650)),
+                    responsible_person='Иванов И.И.',
+                    cost=Decimal(rng.randrange(100, 100000)) / 100,
+                    created_by=passport.created_by,
+                    custom_fields=_work_custom_fields(rng),
+                ))
+
+        # bulk_create не отправляет сигналы - сводку работ, индекс, журнал
+        # изменений и кэш списков обновляем явно
+        fill_aggregates(batch, works)
+        EquipmentPassport.objects.bulk_create(batch)
+        search_backend.index(batch)
+        MaintenanceWork.objects.bulk_create(works, batch_size=batch_size)
+        passports_created(batch, works)
+        invalidate_lists({passport.created_by_id for passport in batch})
+
+        if with_files:
+            with durable_batch():
+                for passport in batch:
+                    save_passport_to_file(passport)
+                    for number in range(history_per_passport):
+                        add_passport_history_entry(passport, passport.created_by, {
+                            'location': {'old': rng.choice(LOCATIONS), 'new': rng.choice(LOCATIONS)},
+                            'status': {'old': rng.choice(statuses), 'new': rng.choice(statuses)},
+                        })
+
+    return passport_ids
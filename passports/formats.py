@@ -0,0 +1,129 @@
+"""Форматы файла снимка паспорта.
+
+Формат записи задается настройкой PASSPORT_FILE_FORMAT, а при чтении
+определяется по первым байтам файла, поэтому в одной папке могут лежать
+снимки разных форматов - например, во время конвертации. Имя файла
+(<id>.json) от формата не зависит.
+
+zstd и msgpack требуют пакетов zstandard и msgpack; они импортируются
+только при использовании этих форматов.
+"""
+import gzip
+import json
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+# Снимок в msgpack - словарь: fixmap (0x80-0x8f), map16 (0xde) или map32 (0xdf)
+MSGPACK_MAP_MARKERS = frozenset(range(0x80, 0x90)) | {0xde, 0xdf}
+
+
+class PassportFileFormatError(ValueError):
+    """Файл снимка поврежден или записан в неподдерживаемом формате"""
+
+
+def _import_optional(module_name, file_format):
+    try:
+        return __import__(module_name)
+    except ImportError:
+        raise ImproperlyConfigured(
+            f'Для формата файлов паспортов {file_format!r} установите пакет {module_name}'
+        )
+
+
+def _json_dumps(data):
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def _json_compact_dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _json_loads(raw):
+    return json.loads(raw.decode('utf-8'))
+
+
+def _gzip_dumps(data):
+    # mtime=0 - одинаковые данные дают одинаковый файл
+    return gzip.compress(_json_compact_dumps(data), compresslevel=6, mtime=0)
+
+
+def _gzip_loads(raw):
+    return _json_loads(gzip.decompress(raw))
+
+
+def _zstd_dumps(data):
+    zstandard = _import_optional('zstandard', 'zstd')
+    return zstandard.ZstdCompressor(level=3).compress(_json_compact_dumps(data))
+
+
+def _zstd_loads(raw):
+    zstandard = _import_optional('zstandard', 'zstd')
+    return _json_loads(zstandard.ZstdDecompressor().decompress(raw))
+
+
+def _msgpack_dumps(data):
+    msgpack = _import_optional('msgpack', 'msgpack')
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def _msgpack_loads(raw):
+    msgpack = _import_optional('msgpack', 'msgpack')
+    return msgpack.unpackb(raw, raw=False)
+
+
+# Формат: (запись, чтение)
+FILE_FORMATS = {
+    'json': (_json_dumps, _json_loads),
+    'json-compact': (_json_compact_dumps, _json_loads),
+    'gzip': (_gzip_dumps, _gzip_loads),
+    'zstd': (_zstd_dumps, _zstd_loads),
+    'msgpack': (_msgpack_dumps, _msgpack_loads),
+}
+
+
+def get_file_format():
+    """Формат записи снимков из настроек"""
+    file_format = settings.PASSPORT_FILE_FORMAT
+    if file_format not in FILE_FORMATS:
+        raise ImproperlyConfigured(
+            f"Неизвестный PASSPORT_FILE_FORMAT {file_format!r}, допустимые: {', '.join(FILE_FORMATS)}"
+        )
+    return file_format
+
+
+def detect_format(raw):
+    """Определяет формат снимка по первым байтам
+
+    Компактный JSON от обычного не отличается - оба читаются как 'json'.
+    Пустой, обрезанный или чужой файл - PassportFileFormatError.
+    """
+    if raw.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if raw.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    if raw.lstrip()[:1] in (b'{', b'['):
+        return 'json'
+    if raw[:1] and raw[0] in MSGPACK_MAP_MARKERS:
+        return 'msgpack'
+    raise PassportFileFormatError('Неизвестный формат файла паспорта' if raw else 'Пустой файл паспорта')
+
+
+def dumps_passport(data, file_format=None):
+    """Кодирует снимок паспорта в байты выбранного формата"""
+    dumps, _ = FILE_FORMATS[file_format or get_file_format()]
+    return dumps(data)
+
+
+def loads_passport(raw):
+    """Декодирует снимок паспорта любого поддерживаемого формата"""
+    _, loads = FILE_FORMATS[detect_format(raw)]
+    try:
+        return loads(raw)
+    except ImproperlyConfigured:
+        raise
+    except Exception as e:
+        # Ошибки разбора у каждой библиотеки свои
+        raise PassportFileFormatError(str(e)) from e
@@ -0,0 +1,249 @@
+"""Массовый импорт паспортов с работами из JSON Lines и CSV.
+
+Формат записей совпадает с выгрузкой (export.py): паспорт со списком
+maintenance_works, тип оборудования задается названием. Записи проверяются
+и сохраняются порциями - bulk_create в отдельной транзакции на порцию,
+а файлы паспортов пишутся одной отложенной пачкой после фиксации.
+"""
+import csv
+import gzip
+import io
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+
+from .aggregates import fill_aggregates
+from .models import EquipmentPassport, MaintenanceWork, EquipmentType
+from .mirror import schedule_passports_save
+from .signals import passports_imported
+
+IMPORT_FORMATS = ('jsonl', 'csv')
+
+PASSPORT_FIELDS = (
+    'name', 'serial_number', 'inventory_number', 'production_date', 'commissioning_date',
+    'description', 'location', 'responsible_person', 'status', 'last_maintenance', 'custom_fields',
+)
+WORK_FIELDS = (
+    'work_type', 'work_date', 'responsible_person', 'description', 'cost', 'materials_used', 'custom_fields',
+)
+
+# Колонки CSV, содержащие JSON
+CSV_JSON_COLUMNS = ('custom_fields', 'maintenance_works')
+
+
+class ImportResult:
+    """Итог импорта: количество созданных объектов и ошибки по строкам"""
+
+    def __init__(self):
+        self.rows = 0
+        self.passports_created = 0
+        self.works_created = 0
+        self.equipment_types_created = 0
+        self.errors = []
+
+    def add_error(self, row, errors):
+        self.errors.append({'row': row, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'passports_created': self.passports_created,
+            'works_created': self.works_created,
+            'equipment_types_created': self.equipment_types_created,
+            'errors': self.errors,
+        }
+
+
+def open_import_file(file_obj, name=''):
+    """Открывает загруженный файл как текст, распаковывая .gz"""
+    if name.endswith('.gz'):
+        file_obj = gzip.GzipFile(fileobj=file_obj)
+    return io.TextIOWrapper(file_obj, encoding='utf-8-sig', newline='')
+
+
+def guess_import_format(name):
+    """Формат по расширению файла: .csv, .csv.gz - CSV, остальное - JSON Lines"""
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return 'csv' if name.endswith('.csv') else 'jsonl'
+
+
+def iter_jsonl_rows(lines):
+    """Отдает (номер строки, запись, ошибка) для каждой непустой строки"""
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield number, None, f'Неверный JSON: {e}'
+            continue
+        if not isinstance(record, dict):
+            yield number, None, 'Запись должна быть JSON-объектом'
+            continue
+        yield number, record, None
+
+
+def iter_csv_rows(lines):
+    """Отдает (номер записи, запись, ошибка); вложенные колонки разбираются как JSON"""
+    for number, row in enumerate(csv.DictReader(lines), start=1):
+        try:
+            for column in CSV_JSON_COLUMNS:
+                if row.get(column):
+                    row[column] = json.loads(row[column])
+        except json.JSONDecodeError as e:
+            yield number, None, f'Неверный JSON в колонке {column}: {e}'
+            continue
+        yield number, row, None
+
+
+def iter_rows(lines, import_format):
+    if import_format == 'csv':
+        return iter_csv_rows(lines)
+    return iter_jsonl_rows(lines)
+
+
+def _model_kwargs(record, field_names):
+    # Пустые значения не передаются - вместо них берутся значения по умолчанию модели
+    return {
+        field_name: record[field_name]
+        for field_name in field_names
+        if record.get(field_name) not in (None, '')
+    }
+
+
+def _build_passport(record, user):
+    """Создает несохраненный паспорт с работами и проверяет их поля"""
+    errors = {}
+
+    passport = EquipmentPassport(created_by=user, **_model_kwargs(record, PASSPORT_FIELDS))
+    try:
+        passport.full_clean(exclude=['equipment_type', 'created_by', 'photo'], validate_unique=False)
+    except ValidationError as e:
+        errors.update(e.message_dict)
+    else:
+        if passport.commissioning_date < passport.production_date:
+            errors['commissioning_date'] = [
+                'Дата ввода в эксплуатацию не может быть раньше даты производства!'
+            ]
+
+    works = []
+    work_records = record.get('maintenance_works') or []
+    if not isinstance(work_records, list):
+        errors['maintenance_works'] = ['Ожидается список работ']
+        work_records = []
+
+    for index, work_record in enumerate(work_records):
+        if not isinstance(work_record, dict):
+            errors[f'maintenance_works[{index}]'] = ['Работа должна быть объектом']
+            continue
+        work_kwargs = _model_kwargs(work_record, WORK_FIELDS)
+        # Выгрузка пишет стоимость числом JSON - переводим через строку, без двоичного хвоста float
+        if isinstance(work_kwargs.get('cost'), float):
+            work_kwargs['cost'] = str(work_kwargs['cost'])
+        work = MaintenanceWork(passport=passport, created_by=user, **work_kwargs)
+        try:
+            work.full_clean(exclude=['passport', 'created_by'], validate_unique=False)
+        except ValidationError as e:
+            for field_name, messages in e.message_dict.items():
+                errors[f'maintenance_works[{index}].{field_name}'] = messages
+            continue
+        works.append(work)
+
+    equipment_type_name = (record.get('equipment_type') or '').strip()
+    if len(equipment_type_name) > EquipmentType._meta.get_field('name').max_length:
+        errors['equipment_type'] = ['Слишком длинное название типа оборудования']
+
+    return passport, works, equipment_type_name, errors
+
+
+def _resolve_equipment_types(names, user):
+    """Находит типы оборудования по названиям, недостающие создает; один запрос на поиск
+
+    Возвращает типы по названиям и число действительно созданных типов.
+    """
+    if not names:
+        return {}, 0
+
+    types = {equipment_type.name: equipment_type for equipment_type in EquipmentType.objects.filter(name__in=names)}
+    missing = [name for name in names if name not in types]
+    created = 0
+    if missing:
+        new_types = [EquipmentType(name=name, created_by=user) for name in missing]
+        EquipmentType.objects.bulk_create(new_types, ignore_conflicts=True)
+        # bulk_create проставляет created_at и пропущенным строкам: тип, который
+        # успел создать параллельный импорт, отличается временем создания
+        created_at = {equipment_type.name: equipment_type.created_at for equipment_type in new_types}
+        # С ignore_conflicts первичные ключи не возвращаются - перечитываем созданные
+        for equipment_type in EquipmentType.objects.filter(name__in=missing):
+            types[equipment_type.name] = equipment_type
+            if equipment_type.created_at == created_at[equipment_type.name]:
+                created += 1
+    return types, created
+
+
+def _import_batch(batch, user, result, dry_run):
+    valid = []
+    for number, record, error in batch:
+        if error:
+            result.add_error(number, {'__all__': [error]})
+            continue
+
+        passport, works, equipment_type_name, errors = _build_passport(record, user)
+        if errors:
+            result.add_error(number, errors)
+            continue
+        valid.append((number, passport, works, equipment_type_name))
+
+    if not valid or dry_run:
+        return
+
+    passports = [passport for _, passport, _, _ in valid]
+    works = [work for _, _, passport_works, _ in valid for work in passport_works]
+
+    try:
+        with transaction.atomic():
+            types, types_created = _resolve_equipment_types(
+                sorted({name for _, _, _, name in valid if name}), user
+            )
+            for _, passport, _, equipment_type_name in valid:
+                passport.equipment_type = types.get(equipment_type_name)
+
+            # bulk_create не отправляет сигналы - сводку работ считаем сразу
+            fill_aggregates(passports, works)
+            EquipmentPassport.objects.bulk_create(passports)
+            MaintenanceWork.objects.bulk_create(works)
+
+            passports_imported.send(sender=EquipmentPassport, passports=passports, works=works, user=user)
+            schedule_passports_save([passport.id for passport in passports])
+    except DatabaseError as e:
+        # Порция откатилась целиком - ошибку получает каждая ее запись
+        for number, _, _, _ in valid:
+            result.add_error(number, {'__all__': [f'Ошибка сохранения: {e}']})
+        return
+
+    result.passports_created += len(passports)
+    result.works_created += len(works)
+    result.equipment_types_created += types_created
+
+
+def import_passports(rows, user, batch_size=500, dry_run=False):
+    """Импортирует записи из iter_rows() от имени user
+
+    Каждая порция из batch_size записей сохраняется в своей транзакции:
+    ошибка в одной записи не мешает импорту остальных. С dry_run записи
+    только проверяются. Возвращает ImportResult.
+    """
+    result = ImportResult()
+    batch = []
+    for row in rows:
+        result.rows += 1
+        batch.append(row)
+        if len(batch) >= batch_size:
+            _import_batch(batch, user, result, dry_run)
+            batch = []
+    _import_batch(batch, user, result, dry_run)
+
+    result.errors.sort(key=lambda error: error['row'])
+    return result
@@ -0,0 +1,96 @@
+"""Кэш таблицы списка паспортов.
+
+Готовый HTML таблицы со страницами хранится в кэше Django по области
+видимости пользователя (scope_label) и параметрам списка: статусу,
+поиску, сортировке и странице. При попадании не выполняются ни запрос
+страницы, ни COUNT для Paginator, ни отрисовка таблицы.
+
+У каждой области видимости свой номер поколения в ключе. Запись паспорта
+или работы увеличивает номер области владельца и общей области
+администраторов - сброс стоит два incr независимо от числа закэшированных
+страниц, а устаревшие записи вытесняются по времени хранения.
+"""
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .cache_utils import bump_generation, get_generation
+
+ALL_SCOPE = 'all'
+
+
+class ListCacheStats:
+    """Счетчики кэша списка в этом процессе"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+                'invalidations': self.invalidations,
+            }
+
+
+stats = ListCacheStats()
+
+
+def _cache():
+    return caches[settings.PASSPORT_LIST_CACHE_ALIAS]
+
+
+def _generation_key(scope):
+    return f'passports:list:generation:{scope}'
+
+
+def _page_key(scope, params):
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    return f'passports:list:{scope}:{get_generation(_cache(), _generation_key(scope))}:{digest}'
+
+
+def get_or_render(scope, params, render):
+    """HTML таблицы для области scope и параметров params (dict) или render()"""
+    timeout = settings.PASSPORT_LIST_CACHE_TIMEOUT
+    if not timeout:
+        return render()
+
+    key = _page_key(scope, params)
+    html = _cache().get(key)
+    if html is not None:
+        stats.count('hits')
+        return html
+
+    stats.count('misses')
+    html = render()
+    _cache().set(key, html, timeout)
+    return html
+
+
+def _bump(scopes):
+    cache = _cache()
+    for scope in scopes:
+        bump_generation(cache, _generation_key(scope))
+    stats.count('invalidations')
+
+
+def invalidate_lists(owner_ids):
+    """Сбрасывает страницы владельцев owner_ids и администраторов после фиксации транзакции"""
+    if not settings.PASSPORT_LIST_CACHE_TIMEOUT:
+        return
+    scopes = {ALL_SCOPE} | {f'user:{owner_id}' for owner_id in owner_ids if owner_id is not None}
+    transaction.on_commit(lambda: _bump(scopes))
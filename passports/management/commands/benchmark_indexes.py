@@ -0,0 +1,109 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+import statistics
+import time
+
+
+class Rollback(Exception):
+    """Откат тестовых данных после замера"""
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает планы и время запросов фильтрации паспортов и работ '
+            'без индексов и с индексами на сгенерированных данных')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--passports', type=int, default=5000, help='Количество паспортов')
+        parser.add_argument('--works', type=int, default=5, help='Работ на паспорт')
+        parser.add_argument('--owners', type=int, default=20, help='Количество владельцев')
+        parser.add_argument('--repeat', type=int, default=7, help='Повторов каждого запроса')
+
+    def handle(self, *args, **options):
+        if not connection.features.can_rollback_ddl:
+            raise CommandError('Замер требует СУБД с транзакционным DDL (SQLite, PostgreSQL)')
+
+        self.repeat = options['repeat']
+        try:
+            # Все изменения - данные и удаление индексов - откатываются в конце
+            with transaction.atomic():
+                self._seed(options)
+                results = {}
+                for label, drop_indexes in (('без индексов', True), ('с индексами', False)):
+                    self.stdout.write(self.style.MIGRATE_HEADING(f'\n=== {label} ==='))
+                    with transaction.atomic():
+                        if drop_indexes:
+                            self._drop_indexes()
+                        results[label] = self._run_queries()
+                        transaction.set_rollback(True)
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(self.style.MIGRATE_HEADING('\n=== Итог (медиана, мс) ==='))
+        for name in results['с индексами']:
+            before = results['без индексов'][name]
+            after = results['с индексами'][name]
+            speedup = before / after if after else float('inf')
+            self.stdout.write(f'{name:<40} {before:>9.2f} {after:>9.2f}  x{speedup:.1f}')
+
+    def _seed(self, options):
+        from passports.fleet import generate_fleet
+
+        owners = [
+            User.objects.create(username=f'benchmark_owner_{number}')
+            for number in range(options['owners'])
+        ]
+        started = time.perf_counter()
+        generate_fleet(owners, options['passports'], options['works'])
+        self.stdout.write(
+            f"Сгенерировано {options['passports']} паспортов и "
+            f"{options['passports'] * options['works']} работ за {time.perf_counter() - started:.1f} с"
+        )
+        self.owner = owners[0]
+
+    def _drop_indexes(self):
+        from passports.models import EquipmentPassport, MaintenanceWork
+
+        with connection.cursor() as cursor:
+            for model in (EquipmentPassport, MaintenanceWork):
+                for index in model._meta.indexes:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+
+    def _queries(self):
+        from passports.models import EquipmentPassport, MaintenanceWork
+        from passports.search import filter_by_number
+
+        sample = EquipmentPassport.objects.order_by('id').first()
+        passports = EquipmentPassport.objects.all()
+        works = MaintenanceWork.objects.all()
+
+        return {
+            'passport_list: статус': passports.filter(status='repair').order_by('-created_at')[:10],
+            'passport_list: владелец + статус': passports.filter(
+                created_by=self.owner, status='in_operation').order_by('-created_at')[:10],
+            'passport_search: заводской номер': filter_by_number(passports, 'serial_number', sample.serial_number),
+            'passport_search: инвентарный номер': filter_by_number(
+                passports, 'inventory_number', sample.inventory_number),
+            'passport_search: дата ввода': passports.filter(commissioning_date=sample.commissioning_date),
+            'API: курсор по created_at': passports.filter(
+                created_at__gt=sample.created_at).order_by('created_at', 'id')[:50],
+            'maintenance_works: паспорт + даты': works.filter(
+                passport=sample, work_date__gte='2015-01-01', work_date__lte='2020-12-31'),
+            'maintenance_works: тип работы': works.filter(work_type='calibration').order_by('-work_date')[:50],
+            'API: курсор по work_date': works.filter(work_date__gt='2018-01-01').order_by('work_date', 'id')[:50],
+        }
+
+    def _run_queries(self):
+        results = {}
+        for name, queryset in self._queries().items():
+            timings = []
+            for _ in range(self.repeat):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = statistics.median(timings)
+
+            self.stdout.write(self.style.SQL_FIELD(f'\n{name}: {results[name]:.2f} мс'))
+            self.stdout.write(queryset.explain())
+        return results
@@ -1,50 +1,43 @@
 from django.core.management.base import BaseCommand
-from django.conf import settings
-import os
 import json
 
 
 class Command(BaseCommand):
-    help = 'Очищает файлы паспортов, для которых нет записей в базе данных'
+    help = 'Очищает файлы паспортов, для которых нет записей в базе данных, и оставшиеся после сбоя временные файлы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет удалено')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько паспортов проверять в базе одним запросом')
+        parser.add_argument('--workers', type=int, default=8, help='Потоков для удаления файлов')
+        parser.add_argument('--json', action='store_true', help='Вывести отчет в JSON')
 
     def handle(self, *args, **options):
-        from passports.models import EquipmentPassport
-
-        existing_passport_ids = set(str(passport.id) for passport in EquipmentPassport.objects.all())
-        files_in_directory = set()
-        deleted_count = 0
-
-        if os.path.exists(settings.PASSPORTS_DIR):
-            for filename in os.listdir(settings.PASSPORTS_DIR):
-                if filename.endswith('.json'):
-                    # Извлекаем UUID из имени файла
-                    file_id = filename.split('.')[0]
-                    if '_history' in file_id:
-                        file_id = file_id.replace('_history', '')
-                    files_in_directory.add(file_id)
-
-        orphaned_files = files_in_directory - existing_passport_ids
-
-        for orphan_id in orphaned_files:
-            file_path = os.path.join(settings.PASSPORTS_DIR, f"{orphan_id}.json")
-            history_file = os.path.join(settings.PASSPORTS_DIR, f"{orphan_id}_history.json")
-
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                if os.path.exists(history_file):
-                    os.remove(history_file)
-                deleted_count += 1
-            except OSError as e:
-                self.stdout.write(
-                    self.style.ERROR(f'Ошибка при удалении файла {orphan_id}: {e}')
-                )
-
-        if deleted_count > 0:
-            self.stdout.write(
-                self.style.SUCCESS(f'Удалено {deleted_count} orphaned файлов')
-            )
+        from passports.cleanup import find_and_remove_orphaned_files
+
+        report = find_and_remove_orphaned_files(
+            dry_run=options['dry_run'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+        )
+
+        if options['json']:
+            self.stdout.write(json.dumps(report.as_dict(), indent=2, ensure_ascii=False))
+            return
+
+        for error in report.errors:
+            self.stdout.write(self.style.ERROR(f'Ошибка при удалении файла {error}'))
+
+        action = 'Будет удалено' if report.dry_run else 'Удалено'
+        if report.temp_files_deleted > 0:
+            self.stdout.write(self.style.SUCCESS(f'{action} временных файлов записи: {report.temp_files_deleted}'))
+
+        if report.orphaned_passports > 0:
+            self.stdout.write(self.style.SUCCESS(
+                f'{action} {report.deleted_files} orphaned файлов {report.orphaned_passports} паспортов, '
+                f'{report.reclaimed_bytes / 1024 / 1024:.2f} МБ (просмотрено файлов: {report.scanned_files})'
+            ))
         else:
             self.stdout.write(
                 self.style.SUCCESS('Orphaned файлы не найдены')
-            )
\ No newline at end of file
+            )
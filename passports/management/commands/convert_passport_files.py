@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.exceptions import ImproperlyConfigured
+from django.conf import settings
+import os
+
+
+class Command(BaseCommand):
+    help = 'Перекодирует файлы снимков паспортов в формат PASSPORT_FILE_FORMAT или указанный в --format'
+
+    def add_arguments(self, parser):
+        from passports.formats import FILE_FORMATS
+
+        parser.add_argument('--format', choices=sorted(FILE_FORMATS),
+                            help='Целевой формат (по умолчанию - из настроек)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только подсчитать размеры, не перезаписывая файлы')
+        parser.add_argument('--progress', type=int, default=10000, help='Сообщать о ходе каждые N файлов')
+
+    def handle(self, *args, **options):
+        from passports.formats import PassportFileFormatError, dumps_passport, get_file_format
+        from passports.utils import convert_passport_file, iter_mirror_files
+
+        try:
+            file_format = options['format'] or get_file_format()
+            # Проверяем, что библиотека формата установлена, до обхода папки
+            dumps_passport({}, file_format)
+        except ImproperlyConfigured as e:
+            raise CommandError(e)
+        if file_format != settings.PASSPORT_FILE_FORMAT:
+            self.stderr.write(self.style.WARNING(
+                f'PASSPORT_FILE_FORMAT = {settings.PASSPORT_FILE_FORMAT!r}: '
+                f'новые записи будут идти в нем, а не в {file_format!r}'
+            ))
+
+        scanned = converted = errors = 0
+        size_before = size_after = 0
+        for passport_id, path in iter_mirror_files():
+            # Журналы работ и истории остаются в JSON Lines
+            if os.path.basename(path) != f'{passport_id}.json':
+                continue
+
+            scanned += 1
+            try:
+                sizes = convert_passport_file(path, file_format, dry_run=options['dry_run'])
+            except FileNotFoundError:
+                continue
+            except PassportFileFormatError as e:
+                errors += 1
+                self.stderr.write(self.style.ERROR(f'{path}: {e}'))
+                continue
+
+            if sizes:
+                converted += 1
+                size_before += sizes[0]
+                size_after += sizes[1]
+            if scanned % options['progress'] == 0:
+                self.stdout.write(f'Просмотрено {scanned} файлов')
+
+        action = 'Нужно перекодировать' if options['dry_run'] else 'Перекодировано'
+        ratio = f' ({size_after / size_before:.0%} от исходного)' if size_before else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {converted} из {scanned} снимков в {file_format}: '
+            f'{size_before / 1024 / 1024:.2f} МБ -> {size_after / 1024 / 1024:.2f} МБ{ratio}, ошибок: {errors}'
+        ))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+import csv
+import json
+import time
+
+
+class Command(BaseCommand):
+    help = 'Массовый импорт паспортов с работами из JSON Lines или CSV (формат выгрузки, можно .gz)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл для импорта')
+        parser.add_argument('--user', required=True, help='Пользователь, от имени которого создаются паспорта')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help='Формат файла (по умолчанию - по расширению)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Записей в одной транзакции')
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить записи, ничего не создавая')
+
+    def handle(self, *args, **options):
+        from passports.importer import guess_import_format, import_passports, iter_rows, open_import_file
+        from passports.mirror import get_writer
+
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"Пользователь {options['user']} не найден")
+
+        import_format = options['format'] or guess_import_format(options['path'])
+        started = time.perf_counter()
+        try:
+            with open(options['path'], 'rb') as f:
+                lines = open_import_file(f, options['path'])
+                result = import_passports(
+                    iter_rows(lines, import_format), user,
+                    batch_size=options['batch_size'], dry_run=options['dry_run']
+                )
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            raise CommandError(f'Не удалось прочитать файл: {e}')
+
+        # Дописываем файлы паспортов до выхода из команды
+        get_writer().flush()
+
+        for error in result.errors:
+            self.stderr.write(self.style.ERROR(
+                f"Строка {error['row']}: {json.dumps(error['errors'], ensure_ascii=False)}"
+            ))
+
+        action = 'Проверено' if options['dry_run'] else 'Импортировано'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} записей: {result.rows}, создано паспортов: {result.passports_created}, '
+            f'работ: {result.works_created}, типов оборудования: {result.equipment_types_created}, '
+            f'ошибок: {len(result.errors)} за {time.perf_counter() - started:.1f} с'
+        ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+import json
+import uuid
+
+
+class Command(BaseCommand):
+    help = 'Перезаписывает файлы паспортов через фоновую очередь и дожидается ее опустошения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('passport_ids', nargs='*', help='UUID паспортов (по умолчанию - все)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько паспортов ставить в очередь между сбросами')
+
+    def handle(self, *args, **options):
+        from passports.models import EquipmentPassport
+        from passports.mirror import get_writer
+
+        writer = get_writer()
+
+        try:
+            passport_ids = [uuid.UUID(passport_id) for passport_id in options['passport_ids']]
+        except ValueError as e:
+            raise CommandError(f'Неверный UUID паспорта: {e}')
+
+        if not passport_ids:
+            passport_ids = EquipmentPassport.objects.values_list('id', flat=True).iterator()
+
+        queued = 0
+        for passport_id in passport_ids:
+            writer.mark_passport(passport_id)
+            queued += 1
+            if queued % options['batch_size'] == 0:
+                writer.flush()
+                self.stdout.write(f'Записано {queued} паспортов')
+
+        writer.flush()
+
+        self.stdout.write(json.dumps(writer.stats(), indent=2, ensure_ascii=False))
+        self.stdout.write(self.style.SUCCESS(f'Файлы {queued} паспортов перезаписаны'))
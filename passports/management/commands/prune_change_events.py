@@ -0,0 +1,23 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = ('Удаляет из журнала изменений события старше PASSPORT_CHANGES_RETENTION_DAYS дней. '
+            'Клиентам с более старой меткой понадобится полная синхронизация')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Срок хранения событий в днях')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Событий в одной порции')
+
+    def handle(self, *args, **options):
+        from passports.changes import prune_events
+
+        days = options['days'] if options['days'] is not None else settings.PASSPORT_CHANGES_RETENTION_DAYS
+        before = timezone.now() - datetime.timedelta(days=days)
+        deleted = prune_events(before, batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Удалено событий журнала изменений: {deleted}'))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает сводку работ паспортов (число, стоимость, даты последних работ). '
+            'Нужна после изменения работ в обход ORM, например прямым SQL')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Паспортов в одной порции')
+
+    def handle(self, *args, **options):
+        from passports.aggregates import refresh_aggregates
+        from passports.list_cache import invalidate_lists
+        from passports.models import EquipmentPassport
+
+        batch_size = options['batch_size']
+        passport_ids = EquipmentPassport.objects.order_by('pk').values_list('pk', flat=True)
+        total = 0
+        last_id = None
+
+        # Порции по первичному ключу - без OFFSET и без всех id в памяти
+        while True:
+            batch = passport_ids.filter(pk__gt=last_id) if last_id is not None else passport_ids
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            refresh_aggregates(batch)
+            # Список паспортов показывает дату последней работы
+            invalidate_lists(set(
+                EquipmentPassport.objects.filter(pk__in=batch).values_list('created_by_id', flat=True)
+            ))
+            total += len(batch)
+            last_id = batch[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Сводка работ пересчитана для {total} паспортов'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает поисковый индекс паспортов'
+
+    def handle(self, *args, **options):
+        from passports.search import get_search_backend
+
+        backend = get_search_backend()
+        backend.rebuild()
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Поисковый индекс перестроен ({backend.__class__.__name__})')
+        )
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+import os
+
+
+class Command(BaseCommand):
+    help = ('Переносит файлы паспортов в подпапки согласно PASSPORT_SHARD_LEVELS. '
+            'Можно запускать на работающем сервисе, если прежнее число уровней указано '
+            'в PASSPORT_SHARD_PREVIOUS_LEVELS: тогда чтение находит файл и на старом месте, '
+            'а запись сама переносит файлы паспорта')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только подсчитать файлы для переноса')
+        parser.add_argument('--progress', type=int, default=10000, help='Сообщать о ходе каждые N файлов')
+
+    def handle(self, *args, **options):
+        from passports.utils import get_passport_dir, iter_mirror_files, move_passport_file
+
+        scanned = moved = 0
+
+        # Список файлов берется потоково: перенесенные файлы могут попасться
+        # повторно, но тогда они уже на своем месте
+        for passport_id, path in iter_mirror_files():
+            scanned += 1
+            target_path = os.path.join(get_passport_dir(passport_id), os.path.basename(path))
+            if path == target_path:
+                continue
+
+            if not options['dry_run']:
+                move_passport_file(path, target_path)
+            moved += 1
+            if moved % options['progress'] == 0:
+                self.stdout.write(f'Перенесено {moved} файлов')
+
+        if not options['dry_run']:
+            self._remove_empty_dirs(settings.PASSPORTS_DIR)
+
+        action = 'Нужно перенести' if options['dry_run'] else 'Перенесено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {moved} файлов из {scanned} (уровней подпапок: {settings.PASSPORT_SHARD_LEVELS})'
+        ))
+
+    def _remove_empty_dirs(self, directory, depth=0):
+        """Удаляет опустевшие подпапки уровней глубже текущего разбиения
+
+        Пустые подпапки текущих уровней не трогаем - в них может писать сервис.
+        """
+        from passports.utils import is_shard_dir
+
+        with os.scandir(directory) as entries:
+            subdirs = [entry.path for entry in entries
+                       if is_shard_dir(entry.name) and entry.is_dir(follow_symlinks=False)]
+        for subdir in subdirs:
+            self._remove_empty_dirs(subdir, depth + 1)
+            if depth + 1 > settings.PASSPORT_SHARD_LEVELS:
+                try:
+                    os.rmdir(subdir)
+                except OSError:
+                    # В папке остались файлы
+                    pass
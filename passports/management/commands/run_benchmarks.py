@@ -0,0 +1,119 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+import datetime
+import json
+import shutil
+import subprocess
+import tempfile
+
+
+class Rollback(Exception):
+    """Откат тестовых данных после замера"""
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержки и пропускную способность основных сценариев на синтетическом парке '
+            'и выводит результат в JSON для сравнения между коммитами')
+
+    def add_arguments(self, parser):
+        from passports.benchmarks import SUITES
+
+        parser.add_argument('--suite', action='append', choices=sorted(SUITES),
+                            help='Набор сценариев (можно указать несколько раз, по умолчанию - все)')
+        parser.add_argument('--passports', type=int, default=2000, help='Количество паспортов')
+        parser.add_argument('--works', type=int, default=10, help='Работ на паспорт')
+        parser.add_argument('--history', type=int, default=5, help='Записей истории на паспорт')
+        parser.add_argument('--owners', type=int, default=10, help='Количество владельцев')
+        parser.add_argument('--iterations', type=int, default=20, help='Повторов каждого сценария')
+        parser.add_argument('--output', help='Файл для результатов (по умолчанию - stdout)')
+        parser.add_argument('--compare', help='JSON с результатами предыдущего прогона для сравнения')
+
+    def handle(self, *args, **options):
+        from passports.benchmarks import SUITES
+
+        suites = options['suite'] or sorted(SUITES)
+        passports_dir = tempfile.mkdtemp(prefix='passport-benchmark-')
+
+        # Данные создаются в транзакции, которая откатывается, а файлы - во временной папке
+        try:
+            with override_settings(PASSPORTS_DIR=passports_dir, PASSPORT_MIRROR_ASYNC=False, ALLOWED_HOSTS=['*']):
+                with transaction.atomic():
+                    results = self._run(suites, options)
+                    raise Rollback
+        except Rollback:
+            pass
+        finally:
+            shutil.rmtree(passports_dir, ignore_errors=True)
+
+        report = {
+            'commit': self._git_commit(),
+            'timestamp': datetime.datetime.now().isoformat(),
+            'database': connection.vendor,
+            'parameters': {key: options[key] for key in ('passports', 'works', 'history', 'owners', 'iterations')},
+            'results': results,
+        }
+
+        if options['compare']:
+            self._compare(report, options['compare'])
+
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+            self.stderr.write(self.style.SUCCESS(f"Результаты сохранены в {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def _run(self, suites, options):
+        from passports.benchmarks import BenchmarkContext, create_benchmark_users, run_suites
+        from passports.fleet import generate_fleet
+
+        staff_user, owners = create_benchmark_users(options['owners'])
+        passport_ids = generate_fleet(
+            owners, options['passports'], options['works'],
+            history_per_passport=options['history'], with_files=True
+        )
+        if not passport_ids:
+            raise CommandError('Нужен хотя бы один паспорт')
+
+        ctx = BenchmarkContext(passport_ids, staff_user, owners[0])
+        return run_suites(ctx, suites, options['iterations'], on_result=self._print_result)
+
+    def _print_result(self, result):
+        if 'skipped' in result:
+            self.stderr.write(self.style.WARNING(
+                f"{result['suite']:<10} {result['name']:<45} пропущен: {result['skipped']}"
+            ))
+            return
+
+        metrics = ''.join(f'  {key}={value}' for key, value in result.get('metrics', {}).items())
+        self.stderr.write(
+            f"{result['suite']:<10} {result['name']:<45} "
+            f"p50 {result['p50_ms']:>9.2f} мс  p95 {result['p95_ms']:>9.2f} мс  "
+            f"{result['throughput_rps']:>8} rps{metrics}"
+        )
+
+    def _compare(self, report, path):
+        with open(path, encoding='utf-8') as f:
+            previous = {(item['suite'], item['name']): item for item in json.load(f)['results']}
+
+        self.stderr.write(self.style.MIGRATE_HEADING(f'\nСравнение p50 с {path}:'))
+        for result in report['results']:
+            before = previous.get((result['suite'], result['name']))
+            if not before or not before.get('p50_ms') or 'skipped' in result:
+                continue
+            change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100
+            style = self.style.ERROR if change > 10 else self.style.SUCCESS
+            self.stderr.write(style(
+                f"{result['suite']:<10} {result['name']:<45} {before['p50_ms']:>9.2f} -> "
+                f"{result['p50_ms']:>9.2f} мс ({change:+.1f}%)"
+            ))
+
+    def _git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+import time
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическим парком оборудования: паспорта, работы, файлы и история'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--passports', type=int, default=1000, help='Количество паспортов')
+        parser.add_argument('--works', type=int, default=10, help='Работ на паспорт')
+        parser.add_argument('--history', type=int, default=5, help='Записей истории на паспорт')
+        parser.add_argument('--owners', type=int, default=10, help='Количество пользователей-владельцев')
+        parser.add_argument('--no-files', action='store_true', help='Не создавать файлы паспортов и истории')
+        parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора')
+
+    def handle(self, *args, **options):
+        from passports.fleet import generate_fleet
+
+        owners = [
+            User.objects.get_or_create(username=f'fleet_owner_{number}')[0]
+            for number in range(options['owners'])
+        ]
+
+        started = time.perf_counter()
+        passport_ids = generate_fleet(
+            owners,
+            options['passports'],
+            options['works'],
+            history_per_passport=options['history'],
+            with_files=not options['no_files'],
+            seed=options['seed'],
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано {len(passport_ids)} паспортов и {len(passport_ids) * options['works']} работ "
+            f"за {time.perf_counter() - started:.1f} с"
+        ))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = ('Создает индексы по пользовательским полям из PASSPORT_CUSTOM_FIELD_INDEXES '
+            'и удаляет индексы полей, убранных из настройки')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать изменения')
+
+    def handle(self, *args, **options):
+        from passports.custom_fields import INDEX_PREFIX, MODELS, CustomFieldFilterError, declared_indexes
+
+        try:
+            declared = declared_indexes(connection.vendor, connection.ops.quote_name)
+        except CustomFieldFilterError as e:
+            raise CommandError(str(e))
+
+        existing = set()
+        with connection.cursor() as cursor:
+            for model in MODELS.values():
+                table = model._meta.db_table
+                for name in connection.introspection.get_constraints(cursor, table):
+                    if name.startswith(INDEX_PREFIX):
+                        existing.add((table, name))
+
+        # PostgreSQL строит индекс без блокировки записи в таблицу
+        concurrently = ' CONCURRENTLY' if connection.vendor == 'postgresql' else ''
+        quote_name = connection.ops.quote_name
+        statements = [
+            f'CREATE INDEX{concurrently} {quote_name(name)} ON {quote_name(table)} (({expression_sql}))'
+            for (table, name), expression_sql in sorted(declared.items())
+            if (table, name) not in existing
+        ] + [
+            f'DROP INDEX{concurrently} {quote_name(name)}'
+            for table, name in sorted(existing - set(declared))
+        ]
+
+        for sql in statements:
+            self.stdout.write(sql)
+            if not options['dry_run']:
+                with connection.cursor() as cursor:
+                    cursor.execute(sql)
+
+        action = 'Нужно выполнить' if options['dry_run'] else 'Выполнено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} изменений индексов: {len(statements)} (объявлено {len(declared)})'
+        ))
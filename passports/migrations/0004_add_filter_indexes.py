@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:13
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passports', '0003_alter_equipmentpassport_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='equipmentpassport',
+            index=models.Index(fields=['status', '-created_at'], name='passport_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='equipmentpassport',
+            index=models.Index(django.db.models.functions.text.Upper('serial_number'), name='passport_serial_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='equipmentpassport',
+            index=models.Index(django.db.models.functions.text.Upper('inventory_number'), name='passport_inventory_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='equipmentpassport',
+            index=models.Index(fields=['commissioning_date'], name='passport_commissioning_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='equipmentpassport',
+            index=models.Index(fields=['created_at', 'id'], name='passport_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='equipmentpassport',
+            index=models.Index(fields=['created_by', 'status', '-created_at'], name='passport_owner_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='maintenancework',
+            index=models.Index(fields=['work_type', '-work_date'], name='work_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='maintenancework',
+            index=models.Index(fields=['work_date', 'id'], name='work_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='maintenancework',
+            index=models.Index(fields=['passport', 'work_date'], name='work_passport_date_idx'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+from django.db import migrations
+
+SEARCH_FIELDS = ('name', 'serial_number', 'inventory_number', 'description', 'location')
+FTS_TABLE = 'passports_search_index'
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    EquipmentPassport = apps.get_model('passports', 'EquipmentPassport')
+
+    if vendor == 'sqlite':
+        columns = ', '.join(SEARCH_FIELDS)
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"passport_id UNINDEXED, {columns}, "
+            f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        placeholders = ', '.join(['%s'] * (len(SEARCH_FIELDS) + 2))
+        rows = [
+            [passport.id.int >> 65, passport.id.hex]
+            + [getattr(passport, field_name) or '' for field_name in SEARCH_FIELDS]
+            for passport in EquipmentPassport.objects.only('id', *SEARCH_FIELDS).iterator()
+        ]
+        if rows:
+            with schema_editor.connection.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO {FTS_TABLE} (rowid, passport_id, {columns}) VALUES ({placeholders})',
+                    rows
+                )
+
+    elif vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex, OpClass
+        from django.contrib.postgres.search import SearchVector
+        from django.db.models import TextField
+        from django.db.models.functions import Cast, Upper
+
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        indexes = [
+            GinIndex(SearchVector(*SEARCH_FIELDS, config='russian'), name='passport_search_vector_idx'),
+            GinIndex(OpClass(Upper(Cast('serial_number', TextField())), name='gin_trgm_ops'),
+                     name='passport_serial_trgm_idx'),
+            GinIndex(OpClass(Upper(Cast('inventory_number', TextField())), name='gin_trgm_ops'),
+                     name='passport_inventory_trgm_idx'),
+        ]
+        for index in indexes:
+            schema_editor.add_index(EquipmentPassport, index)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif vendor == 'postgresql':
+        for name in ('passport_search_vector_idx', 'passport_serial_trgm_idx', 'passport_inventory_trgm_idx'):
+            schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(name)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passports', '0004_add_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:32
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def fill_work_aggregates(apps, schema_editor):
+    EquipmentPassport = apps.get_model('passports', 'EquipmentPassport')
+    MaintenanceWork = apps.get_model('passports', 'MaintenanceWork')
+
+    aggregates = {}
+    rows = (
+        MaintenanceWork.objects.order_by()
+        .values('passport_id', 'work_type')
+        .annotate(count=Count('id'), total_cost=Sum('cost'), last_date=Max('work_date'))
+    )
+    for row in rows.iterator():
+        passport = aggregates.setdefault(
+            row['passport_id'], {'works_count': 0, 'works_total_cost': 0, 'last_work_dates': {}}
+        )
+        passport['works_count'] += row['count']
+        passport['works_total_cost'] += row['total_cost'] or 0
+        passport['last_work_dates'][row['work_type']] = row['last_date'].isoformat()
+
+    for passport_id, values in aggregates.items():
+        values['last_work_date'] = max(values['last_work_dates'].values())
+        EquipmentPassport.objects.filter(pk=passport_id).update(**values)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passports', '0005_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='equipmentpassport',
+            name='last_work_date',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='Дата последней работы'),
+        ),
+        migrations.AddField(
+            model_name='equipmentpassport',
+            name='last_work_dates',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Даты последних работ по типам'),
+        ),
+        migrations.AddField(
+            model_name='equipmentpassport',
+            name='works_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество работ'),
+        ),
+        migrations.AddField(
+            model_name='equipmentpassport',
+            name='works_total_cost',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14, verbose_name='Общая стоимость работ'),
+        ),
+        migrations.AddIndex(
+            model_name='equipmentpassport',
+            index=models.Index(fields=['last_work_date'], name='passport_last_work_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='equipmentpassport',
+            index=models.Index(fields=['works_total_cost'], name='passport_works_cost_idx'),
+        ),
+        migrations.RunPython(fill_work_aggregates, migrations.RunPython.noop),
+    ]
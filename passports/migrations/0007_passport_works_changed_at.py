@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passports', '0006_passport_work_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='equipmentpassport',
+            name='works_changed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Последнее изменение работ'),
+        ),
+    ]
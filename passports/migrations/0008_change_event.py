@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passports', '0007_passport_works_changed_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('object_type', models.CharField(choices=[('passport', 'Паспорт'), ('work', 'Работа')], max_length=10, verbose_name='Тип объекта')),
+                ('object_id', models.UUIDField(verbose_name='Объект')),
+                ('passport_id', models.UUIDField(verbose_name='Паспорт')),
+                ('action', models.CharField(choices=[('created', 'Создан'), ('updated', 'Изменен'), ('deleted', 'Удален')], max_length=10, verbose_name='Действие')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['owner', 'id'], name='change_owner_idx'), models.Index(fields=['created_at'], name='change_created_idx')],
+            },
+        ),
+    ]
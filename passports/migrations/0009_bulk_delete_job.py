@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:05
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('passports', '0008_change_event'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkDeleteJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('running', 'Выполняется'), ('done', 'Завершено'), ('failed', 'Ошибка')], default='running', max_length=10, verbose_name='Состояние')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Паспортов в выборке')),
+                ('passports_deleted', models.PositiveIntegerField(default=0, verbose_name='Удалено паспортов')),
+                ('works_deleted', models.PositiveIntegerField(default=0, verbose_name='Удалено работ')),
+                ('files_deleted', models.PositiveIntegerField(default=0, verbose_name='Удалено файлов')),
+                ('file_errors', models.PositiveIntegerField(default=0, verbose_name='Ошибок удаления файлов')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,254 @@
+"""Фоновая запись файлового зеркала паспортов.
+
+Запросы только отмечают паспорт как измененный после фиксации транзакции,
+а файлы переписывает отдельный поток. Несколько отметок одного паспорта,
+пришедших до записи, объединяются в одну запись. Записи истории изменений
+тоже ждут в очереди и дописываются в журнал вместе с файлами паспорта.
+Чтение файлов очередь не ждет: пока запись не выполнена, файл отстает
+от базы данных на время до PASSPORT_MIRROR_BATCH_DELAY.
+
+Очередь хранится в памяти процесса. При штатной остановке ее дописывает
+обработчик atexit, а при аварийном завершении (сбой, kill -9) ожидавшие
+изменения теряются: файлы паспортов восстанавливает из базы данных
+python manage.py mirror_passports, записи истории восстановить нельзя.
+Если такая потеря недопустима, задайте PASSPORT_MIRROR_ASYNC = False.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+
+from .utils import save_passport_to_file, append_work_to_file, remove_work_from_file, durable_batch, \
+    append_history_entries, make_history_entry
+
+logger = logging.getLogger(__name__)
+
+
+class MirrorWriter:
+    """Очередь паспортов, файлы которых нужно переписать"""
+
+    def __init__(self):
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+
+        # Метрики
+        self.marked = 0
+        self.coalesced = 0
+        self.written = 0
+        self.errors = 0
+        self.last_batch_size = 0
+        self.last_batch_seconds = 0.0
+        self.last_write_lag = 0.0
+
+    def mark_passport(self, passport_id):
+        """Отмечает, что паспорт нужно записать целиком"""
+        self._mark(passport_id, full=True)
+
+    def mark_work(self, passport_id, work_id):
+        """Отмечает изменение или удаление одной работы паспорта"""
+        self._mark(passport_id, work_id=work_id)
+
+    def add_history(self, passport_id, history_entry):
+        """Ставит в очередь запись истории изменений паспорта"""
+        self._mark(passport_id, history_entry=history_entry)
+
+    def _mark(self, passport_id, full=False, work_id=None, history_entry=None):
+        with self._condition:
+            self.marked += 1
+            entry = self._pending.get(passport_id)
+            if entry is None:
+                entry = self._pending[passport_id] = {
+                    'full': False,
+                    'works': set(),
+                    'history': [],
+                    'since': time.monotonic()
+                }
+            else:
+                self.coalesced += 1
+
+            entry['full'] = entry['full'] or full
+            if work_id is not None:
+                entry['works'].add(work_id)
+            if history_entry is not None:
+                entry['history'].append(history_entry)
+
+            self._ensure_started()
+            self._condition.notify()
+
+    def discard(self, passport_id):
+        """Снимает отметки удаленного паспорта"""
+        with self._condition:
+            self._pending.pop(passport_id, None)
+
+    def flush(self):
+        """Синхронно записывает все накопленные паспорта"""
+        with self._write_lock:
+            with self._condition:
+                batch, self._pending = self._pending, {}
+            self._write_batch(batch)
+
+    def flush_passport(self, passport_id):
+        """Синхронно записывает один паспорт, если он ожидает записи"""
+        with self._write_lock:
+            with self._condition:
+                entry = self._pending.pop(passport_id, None)
+            if entry is not None:
+                self._write_batch({passport_id: entry})
+
+    def stats(self):
+        """Метрики очереди: глубина, задержка и счетчики"""
+        with self._condition:
+            now = time.monotonic()
+            oldest = min((entry['since'] for entry in self._pending.values()), default=None)
+            return {
+                'queue_depth': len(self._pending),
+                'lag_seconds': round(now - oldest, 3) if oldest is not None else 0.0,
+                'marked': self.marked,
+                'coalesced': self.coalesced,
+                'written': self.written,
+                'errors': self.errors,
+                'last_batch_size': self.last_batch_size,
+                'last_batch_seconds': round(self.last_batch_seconds, 3),
+                'last_write_lag': round(self.last_write_lag, 3),
+                'worker_alive': bool(self._thread and self._thread.is_alive()),
+            }
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='passport-mirror-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+
+            # Даем время накопиться отметкам, чтобы объединить их в одну запись
+            time.sleep(settings.PASSPORT_MIRROR_BATCH_DELAY)
+
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def _write_batch(self, batch):
+        if not batch:
+            return
+
+        started = time.monotonic()
+        # Файлы всей пачки сбрасываются на диск одним проходом в конце
+        with durable_batch():
+            for passport_id, entry in batch.items():
+                try:
+                    self._write_passport(passport_id, entry)
+                    self.written += 1
+                except Exception:
+                    self.errors += 1
+                    logger.exception('Не удалось записать файл паспорта %s', passport_id)
+                self.last_write_lag = time.monotonic() - entry['since']
+
+        self.last_batch_size = len(batch)
+        self.last_batch_seconds = time.monotonic() - started
+
+    def _write_passport(self, passport_id, entry):
+        from .models import EquipmentPassport, MaintenanceWork
+
+        try:
+            passport = EquipmentPassport.objects.select_related('equipment_type', 'created_by').get(pk=passport_id)
+        except EquipmentPassport.DoesNotExist:
+            # Паспорт удален - его файлы убирает удаление
+            return
+
+        if entry['history']:
+            append_history_entries(passport_id, entry['history'])
+
+        if entry['full']:
+            save_passport_to_file(passport)
+            return
+
+        # Данные работ берутся из БД в момент записи, поэтому повторные
+        # изменения одной работы дают одну запись в журнале
+        works = MaintenanceWork.objects.filter(
+            passport_id=passport_id, id__in=entry['works']
+        ).select_related('created_by')
+        works_by_id = {work.id: work for work in works}
+
+        for work_id in entry['works']:
+            work = works_by_id.get(work_id)
+            if work is None:
+                remove_work_from_file(passport, work_id)
+            else:
+                work.passport = passport
+                append_work_to_file(work)
+
+
+_writer = MirrorWriter()
+# Очередь дописывается при штатном завершении процесса
+atexit.register(_writer.flush)
+
+
+def get_writer():
+    """Возвращает общий для процесса объект записи зеркала"""
+    return _writer
+
+
+def _dispatch(passport_id, work_id=None, full=False, history_entry=None):
+    if history_entry is not None:
+        _writer.add_history(passport_id, history_entry)
+    elif full:
+        _writer.mark_passport(passport_id)
+    else:
+        _writer.mark_work(passport_id, work_id)
+
+    if not settings.PASSPORT_MIRROR_ASYNC:
+        _writer.flush_passport(passport_id)
+
+
+def schedule_passport_save(passport):
+    """Планирует запись паспорта целиком после фиксации транзакции"""
+    passport_id = passport.pk
+    transaction.on_commit(lambda: _dispatch(passport_id, full=True))
+
+
+def schedule_passports_save(passport_ids):
+    """Планирует запись пачки паспортов целиком одной отметкой после фиксации"""
+    passport_ids = list(passport_ids)
+
+    def dispatch():
+        for passport_id in passport_ids:
+            _writer.mark_passport(passport_id)
+        if not settings.PASSPORT_MIRROR_ASYNC:
+            _writer.flush()
+
+    transaction.on_commit(dispatch)
+
+
+def schedule_work_save(work):
+    """Планирует дозапись работы в файл паспорта после фиксации транзакции"""
+    passport_id, work_id = work.passport_id, work.pk
+    transaction.on_commit(lambda: _dispatch(passport_id, work_id))
+
+
+def schedule_work_delete(passport_id, work_id):
+    """Планирует удаление работы из файла паспорта после фиксации транзакции"""
+    transaction.on_commit(lambda: _dispatch(passport_id, work_id))
+
+
+def schedule_history_entry(passport, user, changed_fields):
+    """Планирует запись в историю изменений паспорта после фиксации транзакции
+
+    Время записи - момент вызова, а не момент записи в файл.
+    """
+    passport_id, history_entry = passport.pk, make_history_entry(user, changed_fields)
+    transaction.on_commit(lambda: _dispatch(passport_id, history_entry=history_entry))
+
+
+def discard_passport(passport_id):
+    """Отменяет ожидающую запись удаляемого паспорта"""
+    _writer.discard(passport_id)
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import Upper
 from django.contrib.auth.models import User
 import uuid
 import os
@@ -43,15 +44,52 @@ class EquipmentPassport(models.Model):
     )
     custom_fields = models.JSONField('Пользовательские поля', default=dict, blank=True)
 
+    # Сводка по работам, поддерживается passports.aggregates
+    works_count = models.PositiveIntegerField('Количество работ', default=0, editable=False)
+    works_total_cost = models.DecimalField(
+        'Общая стоимость работ', max_digits=14, decimal_places=2, default=0, editable=False
+    )
+    last_work_date = models.DateField('Дата последней работы', null=True, blank=True, editable=False)
+    last_work_dates = models.JSONField('Даты последних работ по типам', default=dict, blank=True, editable=False)
+    works_changed_at = models.DateTimeField('Последнее изменение работ', null=True, blank=True, editable=False)
+
+    # Поля, которые пишет только passports.aggregates (через update())
+    WORKS_SUMMARY_FIELDS = ('works_count', 'works_total_cost', 'last_work_date', 'last_work_dates', 'works_changed_at')
+
     def __str__(self):
         return f"{self.name} ({self.serial_number})"
 
+    def save(self, *args, **kwargs):
+        # Экземпляр из формы, API или админки мог быть загружен до
+        # изменения работ - полное сохранение не должно возвращать
+        # устаревшую сводку. Новый паспорт сохраняется целиком
+        if not self._state.adding and not kwargs.get('force_insert'):
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+            kwargs['update_fields'] = [name for name in update_fields if name not in self.WORKS_SUMMARY_FIELDS]
+        super().save(*args, **kwargs)
+
     def get_passport_file_path(self):
-        from django.conf import settings
-        return os.path.join(settings.PASSPORTS_DIR, f"{self.id}.json")
+        from .utils import get_passport_file_path
+        return get_passport_file_path(self.id)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', '-created_at'], name='passport_status_idx'),
+            # Поиск номера целиком без учета регистра (search.filter_by_number)
+            models.Index(Upper('serial_number'), name='passport_serial_upper_idx'),
+            models.Index(Upper('inventory_number'), name='passport_inventory_upper_idx'),
+            models.Index(fields=['commissioning_date'], name='passport_commissioning_idx'),
+            # Сортировка списков и курсорная пагинация API
+            models.Index(fields=['created_at', 'id'], name='passport_created_idx'),
+            # Список паспортов пользователя с фильтром по статусу
+            models.Index(fields=['created_by', 'status', '-created_at'], name='passport_owner_status_idx'),
+            # Сортировка и фильтр по сводке работ
+            models.Index(fields=['last_work_date'], name='passport_last_work_idx'),
+            models.Index(fields=['works_total_cost'], name='passport_works_cost_idx'),
+        ]
 
 class MaintenanceWork(models.Model):
     WORK_TYPES = [
@@ -78,4 +116,94 @@ class MaintenanceWork(models.Model):
         return f"{self.get_work_type_display()} - {self.passport.name}"
 
     class Meta:
-        ordering = ['-work_date']
\ No newline at end of file
+        ordering = ['-work_date']
+        indexes = [
+            models.Index(fields=['work_type', '-work_date'], name='work_type_idx'),
+            # Сортировка и курсорная пагинация API
+            models.Index(fields=['work_date', 'id'], name='work_date_idx'),
+            # Работы паспорта с фильтром по дате
+            models.Index(fields=['passport', 'work_date'], name='work_passport_date_idx'),
+        ]
+
+class ChangeEvent(models.Model):
+    """Событие журнала изменений; номер события - метка синхронизации клиентов"""
+    PASSPORT = 'passport'
+    WORK = 'work'
+    OBJECT_TYPES = [
+        (PASSPORT, 'Паспорт'),
+        (WORK, 'Работа'),
+    ]
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTIONS = [
+        (CREATED, 'Создан'),
+        (UPDATED, 'Изменен'),
+        (DELETED, 'Удален'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    object_type = models.CharField('Тип объекта', max_length=10, choices=OBJECT_TYPES)
+    object_id = models.UUIDField('Объект')
+    # Без внешних ключей: событие удаления переживает сам объект
+    passport_id = models.UUIDField('Паспорт')
+    owner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    action = models.CharField('Действие', max_length=10, choices=ACTIONS)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.id}: {self.object_type} {self.object_id} {self.action}"
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # События пользователя после метки
+            models.Index(fields=['owner', 'id'], name='change_owner_idx'),
+            # Очистка старых событий
+            models.Index(fields=['created_at'], name='change_created_idx'),
+        ]
+
+
+class BulkDeleteJob(models.Model):
+    """Фоновое массовое удаление паспортов; ход хранится в БД и виден всем процессам"""
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Завершено'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField('Состояние', max_length=10, choices=STATUSES, default=RUNNING)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    total = models.PositiveIntegerField('Паспортов в выборке', default=0)
+    passports_deleted = models.PositiveIntegerField('Удалено паспортов', default=0)
+    works_deleted = models.PositiveIntegerField('Удалено работ', default=0)
+    files_deleted = models.PositiveIntegerField('Удалено файлов', default=0)
+    file_errors = models.PositiveIntegerField('Ошибок удаления файлов', default=0)
+    error = models.TextField('Ошибка', blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.id.hex}: {self.status}"
+
+    def as_dict(self):
+        return {
+            'id': self.id.hex,
+            'status': self.status,
+            'user': self.created_by.username if self.created_by else None,
+            'started_at': self.started_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'error': self.error or None,
+            'total': self.total,
+            'passports_deleted': self.passports_deleted,
+            'works_deleted': self.works_deleted,
+            'files_deleted': self.files_deleted,
+            'file_errors': self.file_errors,
+        }
+
+    class Meta:
+        ordering = ['-started_at']
@@ -0,0 +1,169 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class StandardResultsSetPagination(PageNumberPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class KeysetPagination(BasePagination):
+    """Постраничный вывод по ключу сортировки с непрозрачным курсором
+
+    Порядок задается атрибутом keyset_ordering представления, например
+    ('created_at', 'id'). Следующая страница выбирается условием "ключ больше
+    последнего отданного", поэтому стоимость страницы не зависит от ее номера,
+    а COUNT(*) не выполняется.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    invalid_cursor_message = 'Неверный курсор'
+
+    @classmethod
+    def is_requested(cls, request):
+        """Клиент выбрал курсорную пагинацию"""
+        return (
+            cls.cursor_query_param in request.query_params
+            or request.query_params.get('pagination') == 'cursor'
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = view.keyset_ordering
+        self.page_size = self.get_page_size(request)
+        model = queryset.model
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, model)
+        if position is not None:
+            queryset = queryset.filter(self._after_position(position))
+
+        # Одна лишняя строка показывает, есть ли следующая страница
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        self.next_position = None
+        if self.has_next:
+            last = results[-1]
+            self.next_position = [
+                model._meta.get_field(field_name).value_to_string(last)
+                for field_name in self.ordering
+            ]
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def _after_position(self, position):
+        """Условие (a, b, ...) > (va, vb, ...) для ключа сортировки"""
+        condition = Q()
+        for index, field_name in enumerate(self.ordering):
+            step = Q(**{f'{field_name}__gt': position[index]})
+            for previous_name, previous_value in zip(self.ordering[:index], position[:index]):
+                step &= Q(**{previous_name: previous_value})
+            condition |= step
+        return condition
+
+    def encode_cursor(self, position):
+        data = json.dumps(position, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                model._meta.get_field(field_name).to_python(value)
+                for field_name, value in zip(self.ordering, values)
+            ]
+        except (ValueError, TypeError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class SelectablePagination(BasePagination):
+    """Постраничная пагинация по умолчанию, курсорная - по ?pagination=cursor"""
+
+    def __init__(self):
+        self.page_number_paginator = StandardResultsSetPagination()
+        self.keyset_paginator = KeysetPagination()
+        self.active_paginator = self.page_number_paginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if KeysetPagination.is_requested(request):
+            self.active_paginator = self.keyset_paginator
+        else:
+            self.active_paginator = self.page_number_paginator
+        return self.active_paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.active_paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.page_number_paginator.get_paginated_response_schema(schema)
+
+    def get_schema_fields(self, view):
+        return self.page_number_paginator.get_schema_fields(view)
+
+    def get_schema_operation_parameters(self, view):
+        return self.page_number_paginator.get_schema_operation_parameters(view) + [
+            {
+                'name': 'pagination',
+                'required': False,
+                'in': 'query',
+                'description': 'cursor - курсорная пагинация по ключу сортировки',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': KeysetPagination.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Курсор следующей страницы',
+                'schema': {'type': 'string'},
+            },
+        ]
@@ -0,0 +1,125 @@
+"""Права доступа к паспортам и работам.
+
+Администратор (is_staff, is_superuser или член группы «Администраторы»)
+видит и изменяет все паспорта, остальные пользователи - только свои и
+работы своих паспортов. Видимость задается фильтром queryset, проверка
+объекта нужна там, где объект загружается без него.
+
+Членство в группе проверяется не чаще раза за запрос: результат хранится
+на объекте пользователя и в кэше Django. Изменение групп пользователя
+сбрасывает его запись, переименование или удаление групп - все записи
+(через номер поколения в ключе). Как и кэш списка и аналитики, роли
+кэшируются в любом кэше Django; с кэшем в памяти процесса сброс виден
+только своему процессу, и в других снятая роль действует до истечения
+PASSPORT_ROLE_CACHE_TIMEOUT (предупреждение passports.W001 в check --deploy).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.permissions import BasePermission
+
+from .cache_utils import bump_generation, get_generation
+from .models import EquipmentPassport, MaintenanceWork
+
+ADMIN_GROUP = 'Администраторы'
+
+GENERATION_KEY = 'passports:roles:generation'
+
+
+def _role_key(user_id):
+    return f'passports:role:{get_generation(cache, GENERATION_KEY)}:{user_id}'
+
+
+def _role_cache_enabled():
+    return bool(settings.PASSPORT_ROLE_CACHE_TIMEOUT)
+
+
+def _load_role(user):
+    if not _role_cache_enabled():
+        return user.groups.filter(name=ADMIN_GROUP).exists()
+    key = _role_key(user.pk)
+    admin = cache.get(key)
+    if admin is None:
+        admin = user.groups.filter(name=ADMIN_GROUP).exists()
+        cache.set(key, admin, settings.PASSPORT_ROLE_CACHE_TIMEOUT)
+    return admin
+
+
+def is_admin(user):
+    """Видит ли пользователь все паспорта"""
+    if not user.is_authenticated:
+        return False
+    if user.is_staff or user.is_superuser:
+        return True
+
+    admin = getattr(user, '_passports_is_admin', None)
+    if admin is None:
+        admin = _load_role(user)
+        # request.user - один объект на запрос
+        user._passports_is_admin = admin
+    return admin
+
+
+def invalidate_roles(user_ids):
+    """Сбрасывает роли пользователей после фиксации текущей транзакции"""
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: cache.delete_many([_role_key(user_id) for user_id in user_ids]))
+
+
+def invalidate_all_roles():
+    """Сбрасывает роли всех пользователей после фиксации текущей транзакции"""
+    transaction.on_commit(lambda: bump_generation(cache, GENERATION_KEY))
+
+
+def scope_passports(user, queryset=None):
+    """Паспорта из queryset, видимые пользователю"""
+    if queryset is None:
+        queryset = EquipmentPassport.objects.all()
+    if is_admin(user):
+        return queryset
+    if not user.is_authenticated:
+        return queryset.none()
+    return queryset.filter(created_by=user)
+
+
+def scope_works(user, queryset=None):
+    """Работы из queryset, видимые пользователю, - работы его паспортов"""
+    if queryset is None:
+        queryset = MaintenanceWork.objects.all()
+    if is_admin(user):
+        return queryset
+    if not user.is_authenticated:
+        return queryset.none()
+    return queryset.filter(passport__created_by=user)
+
+
+def scope_label(user):
+    """Метка области видимости для ключей кэша: 'all' или 'user:<id>'"""
+    return 'all' if is_admin(user) else f'user:{user.pk}'
+
+
+def can_access_passport(user, passport):
+    """Может ли пользователь просматривать и изменять паспорт"""
+    if is_admin(user):
+        return True
+    return user.is_authenticated and passport.created_by_id == user.pk
+
+
+class CanAccessPassport(BasePermission):
+    """Вход обязателен; объект - паспорт или работа паспорта, доступного пользователю"""
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_authenticated)
+
+    def has_object_permission(self, request, view, obj):
+        if is_admin(request.user):
+            return True
+        passport = obj.passport if isinstance(obj, MaintenanceWork) else obj
+        return can_access_passport(request.user, passport)
+
+
+class IsPassportAdmin(BasePermission):
+    """Только администраторы паспортов"""
+
+    def has_permission(self, request, view):
+        return bool(request.user and is_admin(request.user))
@@ -0,0 +1,209 @@
+"""Полнотекстовый поиск паспортов.
+
+Бэкенд выбирается настройкой PASSPORT_SEARCH_BACKEND: 'auto' берет FTS5 для
+SQLite и tsvector/триграммы для PostgreSQL, для остальных СУБД - поиск
+подстрокой. Можно указать и путь к собственному классу бэкенда.
+"""
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.functions import Upper
+from django.utils.module_loading import import_string
+
+from .models import EquipmentPassport
+
+# Поля паспорта, по которым идет поиск
+SEARCH_FIELDS = ('name', 'serial_number', 'inventory_number', 'description', 'location')
+
+_TERM_RE = re.compile(r'[\w-]+')
+
+
+def filter_by_number(queryset, field_name, number):
+    """Паспорта, у которых номер field_name равен number без учета регистра
+
+    Сравнение UPPER(поле) = UPPER(номер) обслуживает функциональный индекс
+    по Upper(поле) и в SQLite, и в PostgreSQL - в отличие от icontains
+    и iexact, которые просматривают всю таблицу.
+    """
+    alias = f'{field_name}_upper'
+    return queryset.alias(**{alias: Upper(field_name)}).filter(**{alias: Upper(Value(number.strip()))})
+
+
+def split_terms(query):
+    """Разбивает поисковую строку на слова, отбрасывая служебные символы"""
+    return _TERM_RE.findall(query)
+
+
+class BaseSearchBackend:
+    """Интерфейс бэкенда поиска
+
+    search() фильтрует queryset паспортов и добавляет атрибут search_rank:
+    чем он больше, тем лучше совпадение.
+    """
+
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+    def index(self, passports):
+        """Обновляет индекс для сохраненных паспортов"""
+
+    def remove(self, passport_ids):
+        """Удаляет паспорта из индекса"""
+
+    def rebuild(self):
+        """Перестраивает индекс целиком"""
+
+
+class BasicSearchBackend(BaseSearchBackend):
+    """Поиск подстрокой (icontains) - работает на любой СУБД"""
+
+    def search(self, queryset, query):
+        condition = Q()
+        for field_name in SEARCH_FIELDS:
+            condition |= Q(**{f'{field_name}__icontains': query})
+        return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class SQLiteFTS5Backend(BaseSearchBackend):
+    """Виртуальная таблица FTS5, синхронизируемая сигналами модели
+
+    rowid записи индекса вычисляется из UUID паспорта, поэтому обновление
+    и удаление записи не требуют просмотра таблицы.
+    """
+    table = 'passports_search_index'
+
+    @classmethod
+    def create_table(cls, cursor):
+        columns = ', '.join(SEARCH_FIELDS)
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {cls.table} USING fts5("
+            f"passport_id UNINDEXED, {columns}, "
+            f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+
+    @staticmethod
+    def _rowid(passport_id):
+        # Старшие 63 бита UUID - rowid должен быть знаковым 64-битным числом
+        return passport_id.int >> 65
+
+    @staticmethod
+    def match_expression(query):
+        """Запрос FTS5: каждое слово ищется по префиксу, все слова обязательны"""
+        return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in split_terms(query))
+
+    def search(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+
+        passport_table = EquipmentPassport._meta.db_table
+        return queryset.extra(
+            tables=[self.table],
+            where=[
+                f'{self.table}.passport_id = {passport_table}.id',
+                f'{self.table} MATCH %s',
+            ],
+            params=[expression],
+            # rank в FTS5 отрицательный: чем меньше, тем лучше совпадение
+            select={'search_rank': f'-{self.table}.rank'},
+        )
+
+    def index(self, passports):
+        rows = [
+            [self._rowid(passport.id), passport.id.hex]
+            + [getattr(passport, field_name) or '' for field_name in SEARCH_FIELDS]
+            for passport in passports
+        ]
+        if not rows:
+            return
+
+        columns = ', '.join(SEARCH_FIELDS)
+        placeholders = ', '.join(['%s'] * (len(SEARCH_FIELDS) + 2))
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [[row[0]] for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, passport_id, {columns}) VALUES ({placeholders})',
+                rows
+            )
+
+    def remove(self, passport_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {self.table} WHERE rowid = %s',
+                [[self._rowid(passport_id)] for passport_id in passport_ids]
+            )
+
+    def rebuild(self, batch_size=1000):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+        batch = []
+        for passport in EquipmentPassport.objects.only('id', *SEARCH_FIELDS).iterator(chunk_size=batch_size):
+            batch.append(passport)
+            if len(batch) >= batch_size:
+                self.index(batch)
+                batch = []
+        self.index(batch)
+
+    @classmethod
+    def is_available(cls):
+        return cls.table in connection.introspection.table_names()
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """tsvector с ранжированием и триграммный поиск по префиксу номеров
+
+    Вектор вычисляется выражением, для которого миграция создает GIN-индекс,
+    поэтому отдельная синхронизация индекса не нужна.
+    """
+    config = 'russian'
+
+    @classmethod
+    def search_vector(cls):
+        from django.contrib.postgres.search import SearchVector
+        return SearchVector(*SEARCH_FIELDS, config=cls.config)
+
+    def search(self, queryset, query):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        terms = split_terms(query)
+        if not terms:
+            return queryset.none()
+
+        # Префиксный поиск по каждому слову: "нас & sn:*"
+        raw_query = ' & '.join(f"'{term}':*" for term in terms)
+        search_query = SearchQuery(raw_query, search_type='raw', config=self.config)
+        vector = self.search_vector()
+
+        return queryset.annotate(
+            search_vector=vector,
+            search_rank=SearchRank(vector, search_query),
+        ).filter(
+            Q(search_vector=search_query)
+            | Q(serial_number__istartswith=query)
+            | Q(inventory_number__istartswith=query)
+        )
+
+
+@lru_cache(maxsize=None)
+def _load_backend(path, vendor):
+    if path != 'auto':
+        return import_string(path)()
+    if vendor == 'sqlite' and SQLiteFTS5Backend.is_available():
+        return SQLiteFTS5Backend()
+    if vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return BasicSearchBackend()
+
+
+def get_search_backend():
+    """Возвращает бэкенд поиска согласно настройкам и текущей СУБД"""
+    return _load_backend(settings.PASSPORT_SEARCH_BACKEND, connection.vendor)
+
+
+def search_passports(queryset, query):
+    """Фильтрует паспорта по поисковой строке с ранжированием"""
+    return get_search_backend().search(queryset, query)
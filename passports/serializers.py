@@ -1,19 +1,74 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from .models import EquipmentPassport, MaintenanceWork
+from .thumbnails import thumbnail_sizes, thumbnail_url
 
 
-class MaintenanceWorkSerializer(serializers.ModelSerializer):
+def _query_param_set(request, name):
+    """Разбирает параметр запроса вида ?name=a,b в множество"""
+    value = request.query_params.get(name, '')
+    return {item.strip() for item in value.split(',') if item.strip()}
+
+
+class DynamicFieldsMixin:
+    """Отбор полей по ?fields= и раскрытие вложенных данных по ?expand=
+
+    Поля из expandable_fields отдаются, только если они перечислены в ?expand=
+    или представление передало в контекст expand_by_default=True. Отбор
+    действует только для чтения (GET, HEAD, OPTIONS): при создании и
+    изменении убранное поле не принималось бы на запись.
+    """
+    expandable_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or not hasattr(request, 'query_params'):
+            return
+
+        expand_by_default = self.context.get('expand_by_default', True)
+        for field_name in list(self.fields):
+            if not self.includes_field(request, field_name, expand_by_default):
+                self.fields.pop(field_name)
+
+    @classmethod
+    def includes_field(cls, request, field_name, expand_by_default=True):
+        """Будет ли поле сериализовано для данного запроса"""
+        if request.method not in SAFE_METHODS:
+            return True
+        if field_name in cls.expandable_fields and not expand_by_default:
+            if field_name not in _query_param_set(request, 'expand'):
+                return False
+
+        requested = _query_param_set(request, 'fields')
+        return not requested or field_name in requested
+
+
+class MaintenanceWorkSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = MaintenanceWork
         fields = '__all__'
         read_only_fields = ['id', 'created_by', 'created_at']
 
 
-class EquipmentPassportSerializer(serializers.ModelSerializer):
+class EquipmentPassportSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     maintenance_works = MaintenanceWorkSerializer(many=True, read_only=True)
     created_by_username = serializers.CharField(source='created_by.username', read_only=True)
+    thumbnails = serializers.SerializerMethodField()
+
+    expandable_fields = ('maintenance_works',)
+
+    def get_thumbnails(self, passport):
+        """Адреса уменьшенных копий фото по размерам или None, если фото нет"""
+        if not passport.photo:
+            return None
+        request = self.context.get('request')
+        urls = {size: thumbnail_url(passport, size) for size in thumbnail_sizes()}
+        if request is not None:
+            urls = {size: request.build_absolute_uri(url) for size, url in urls.items()}
+        return urls
 
     class Meta:
         model = EquipmentPassport
         fields = '__all__'
-        read_only_fields = ['id', 'created_by', 'created_at', 'updated_at']
\ No newline at end of file
+        read_only_fields = ['id', 'created_by', 'created_at', 'updated_at']
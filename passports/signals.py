@@ -0,0 +1,239 @@
+from django.contrib.auth.models import Group, User
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, pre_save, post_save, post_delete
+from django.dispatch import receiver, Signal
+
+from .models import EquipmentPassport, MaintenanceWork
+from .search import get_search_backend
+from . import aggregates, changes, permissions
+from .analytics import invalidate_reports
+from .list_cache import invalidate_lists
+from .thumbnails import schedule_thumbnails
+
+# Паспорта созданы массово через bulk_create, минуя post_save.
+# Аргументы: passports, works, user. Отправляется внутри транзакции импорта
+passports_imported = Signal()
+
+# Паспорта удалены массово без загрузки объектов, post_delete не отправлялся.
+# Аргументы: passport_ids, owners ({UUID паспорта: id владельца}).
+# Отправляется внутри транзакции удаления
+passports_bulk_deleted = Signal()
+
+
+@receiver(post_save, sender=EquipmentPassport)
+def index_passport(sender, instance, raw=False, **kwargs):
+    """Обновляет поисковый индекс после сохранения паспорта"""
+    if raw:
+        return
+    get_search_backend().index([instance])
+
+
+@receiver(post_delete, sender=EquipmentPassport)
+def unindex_passport(sender, instance, **kwargs):
+    """Удаляет паспорт из поискового индекса"""
+    get_search_backend().remove([instance.pk])
+
+
+@receiver(passports_imported)
+def index_imported_passports(sender, passports, **kwargs):
+    """Индексирует паспорта, созданные массовым импортом"""
+    get_search_backend().index(passports)
+
+
+@receiver(passports_bulk_deleted)
+def unindex_deleted_passports(sender, passport_ids, **kwargs):
+    """Удаляет из поискового индекса паспорта, удаленные массово"""
+    get_search_backend().remove(passport_ids)
+
+
+def _deleted_with_passport(origin):
+    """Работа удаляется каскадом вместе с паспортом"""
+    return isinstance(origin, EquipmentPassport) or (
+        isinstance(origin, QuerySet) and origin.model is EquipmentPassport
+    )
+
+
+@receiver(post_save, sender=EquipmentPassport)
+def log_passport_save(sender, instance, created, raw=False, **kwargs):
+    """Записывает создание или изменение паспорта в журнал изменений"""
+    if raw:
+        return
+    changes.passport_saved(instance, created)
+
+
+@receiver(post_delete, sender=EquipmentPassport)
+def log_passport_delete(sender, instance, **kwargs):
+    """Записывает удаление паспорта в журнал изменений"""
+    changes.passport_deleted(instance)
+
+
+@receiver(passports_imported)
+def log_imported_passports(sender, passports, works, **kwargs):
+    """Записывает в журнал изменений паспорта и работы, созданные импортом"""
+    changes.passports_created(passports, works)
+
+
+@receiver(passports_bulk_deleted)
+def log_deleted_passports(sender, owners, **kwargs):
+    """Записывает в журнал изменений паспорта, удаленные массово"""
+    changes.passports_deleted(owners)
+
+
+@receiver(pre_save, sender=MaintenanceWork)
+def remember_work_state(sender, instance, raw=False, **kwargs):
+    """Запоминает прежние поля работы для пересчета сводки паспорта"""
+    instance._aggregate_state = None
+    if raw or instance._state.adding:
+        return
+    old = (
+        MaintenanceWork.objects.filter(pk=instance.pk)
+        .values_list('passport_id', 'work_type', 'work_date', 'cost')
+        .first()
+    )
+    if old is not None:
+        instance._aggregate_state = (old[0], old[1:])
+
+
+@receiver(post_save, sender=MaintenanceWork)
+def update_aggregates_on_work_save(sender, instance, raw=False, **kwargs):
+    """Обновляет сводку работ паспорта после создания или изменения работы"""
+    if raw:
+        return
+    aggregates.work_saved(getattr(instance, '_aggregate_state', None), instance)
+
+
+@receiver(post_save, sender=MaintenanceWork)
+def log_work_save(sender, instance, created, raw=False, **kwargs):
+    """Записывает создание или изменение работы в журнал изменений"""
+    if raw:
+        return
+    old_state = getattr(instance, '_aggregate_state', None)
+    changes.work_saved(instance, created, old_passport_id=old_state[0] if old_state else None)
+
+
+@receiver(post_delete, sender=MaintenanceWork)
+def update_aggregates_on_work_delete(sender, instance, origin=None, **kwargs):
+    """Обновляет сводку работ паспорта после удаления работы"""
+    # Работы удаляются каскадом вместе с паспортом - обновлять нечего
+    if _deleted_with_passport(origin):
+        return
+    aggregates.work_deleted(instance)
+
+
+@receiver(post_delete, sender=MaintenanceWork)
+def log_work_delete(sender, instance, origin=None, **kwargs):
+    """Записывает удаление работы в журнал изменений"""
+    # Удаление паспорта означает для клиента и удаление его работ
+    if _deleted_with_passport(origin):
+        return
+    changes.work_deleted(instance)
+
+
+@receiver(post_save, sender=EquipmentPassport)
+@receiver(post_delete, sender=EquipmentPassport)
+@receiver(post_save, sender=MaintenanceWork)
+@receiver(post_delete, sender=MaintenanceWork)
+@receiver(passports_imported)
+@receiver(passports_bulk_deleted)
+def invalidate_analytics(sender, raw=False, **kwargs):
+    """Сбрасывает кэш отчетов по работам"""
+    if raw:
+        return
+    invalidate_reports()
+
+
+@receiver(pre_save, sender=EquipmentPassport)
+def remember_passport_owner(sender, instance, raw=False, **kwargs):
+    """Запоминает прежнего владельца: паспорт пропадает из его списка"""
+    instance._previous_owner_id = None
+    if raw or instance._state.adding:
+        return
+    instance._previous_owner_id = (
+        EquipmentPassport.objects.filter(pk=instance.pk).values_list('created_by_id', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=EquipmentPassport)
+@receiver(post_delete, sender=EquipmentPassport)
+def invalidate_passport_lists(sender, instance, raw=False, **kwargs):
+    """Сбрасывает кэш списка паспортов владельца, а при смене владельца - и прежнего"""
+    if raw:
+        return
+    owner_ids = {instance.created_by_id}
+    previous_owner_id = getattr(instance, '_previous_owner_id', None)
+    if previous_owner_id is not None:
+        owner_ids.add(previous_owner_id)
+    invalidate_lists(owner_ids)
+
+
+@receiver(post_save, sender=MaintenanceWork)
+@receiver(post_delete, sender=MaintenanceWork)
+def invalidate_work_lists(sender, instance, raw=False, origin=None, **kwargs):
+    """Сбрасывает кэш списка паспортов: в нем показана дата последней работы"""
+    if raw or _deleted_with_passport(origin):
+        return
+    owner_ids, passport_ids = set(), set()
+    # Представления обычно уже загрузили паспорт работы
+    if MaintenanceWork.passport.is_cached(instance):
+        owner_ids.add(instance.passport.created_by_id)
+    else:
+        passport_ids.add(instance.passport_id)
+    old_state = getattr(instance, '_aggregate_state', None)
+    if old_state and old_state[0] != instance.passport_id:
+        # Работа перенесена из другого паспорта
+        passport_ids.add(old_state[0])
+    if passport_ids:
+        owner_ids.update(
+            EquipmentPassport.objects.filter(pk__in=passport_ids).values_list('created_by_id', flat=True)
+        )
+    invalidate_lists(owner_ids)
+
+
+@receiver(passports_imported)
+def invalidate_imported_lists(sender, passports, **kwargs):
+    """Сбрасывает кэш списков владельцев импортированных паспортов"""
+    invalidate_lists({passport.created_by_id for passport in passports})
+
+
+@receiver(passports_bulk_deleted)
+def invalidate_deleted_lists(sender, owners, **kwargs):
+    """Сбрасывает кэш списков владельцев удаленных паспортов"""
+    invalidate_lists(set(owners.values()))
+
+
+@receiver(pre_save, sender=EquipmentPassport)
+def remember_photo_upload(sender, instance, raw=False, **kwargs):
+    """Отмечает, что с паспортом загружено новое фото"""
+    # Поле сохраняет загруженный файл в хранилище уже после pre_save
+    instance._photo_uploaded = not raw and bool(instance.photo) and not instance.photo._committed
+
+
+@receiver(post_save, sender=EquipmentPassport)
+def create_photo_thumbnails(sender, instance, **kwargs):
+    """Создает уменьшенные копии нового фото после фиксации транзакции"""
+    if getattr(instance, '_photo_uploaded', False):
+        instance._photo_uploaded = False
+        schedule_thumbnails(instance)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_user_roles(sender, instance, action, reverse, pk_set, **kwargs):
+    """Сбрасывает кэш ролей пользователей, у которых изменились группы"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        permissions.invalidate_roles([instance.pk])
+    elif pk_set:
+        permissions.invalidate_roles(pk_set)
+    else:
+        # Группа очищена целиком - ее участники уже неизвестны
+        permissions.invalidate_all_roles()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_roles_on_group_change(sender, raw=False, **kwargs):
+    """Сбрасывает кэш ролей при переименовании или удалении группы"""
+    if raw:
+        return
+    permissions.invalidate_all_roles()
@@ -1,3 +1,1448 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+from PIL import Image
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from . import changes, list_cache, mirror, utils, views
+from .analytics import repair_intervals
+from .cleanup import find_and_remove_orphaned_files
+from .custom_fields import CustomFieldFilterError, filter_custom_fields, index_name
+from .deletion import bulk_delete_passports, delete_passport_with_files
+from .file_cache import get_file_cache
+from .fleet import generate_fleet
+from .formats import PassportFileFormatError, detect_format, dumps_passport, loads_passport
+from .importer import import_passports, iter_rows
+from .models import BulkDeleteJob, EquipmentPassport, EquipmentType, MaintenanceWork
+from .permissions import ADMIN_GROUP, is_admin, scope_passports, scope_works
+from .search import BasicSearchBackend, SQLiteFTS5Backend, _load_backend, get_search_backend, search_passports
+from .thumbnails import generate_thumbnails, thumbnail_name
+from .utils import add_passport_history_entry, append_work_to_file, convert_passport_file, delete_passport_file, \
+    get_history_file_path, get_legacy_history_file_path, get_passport_file_path, get_passport_history, \
+    get_works_log_path, load_passport_from_file, remove_work_from_file, resolve_passport_paths, save_passport_to_file
+
+PASSPORTS_DIR = tempfile.mkdtemp(prefix='passports-tests-')
+
+
+def tearDownModule():
+    shutil.rmtree(PASSPORTS_DIR, ignore_errors=True)
+
+
+def create_passport(owner, **fields):
+    """Паспорт с заполненными обязательными полями"""
+    values = {
+        'name': 'Насос', 'serial_number': 'SN-1', 'inventory_number': 'INV-1', 'location': 'Цех 1',
+        'production_date': datetime.date(2020, 1, 1), 'commissioning_date': datetime.date(2020, 6, 1),
+        'created_by': owner,
+    }
+    values.update(fields)
+    return EquipmentPassport.objects.create(**values)
+
+
+def create_work(passport, **fields):
+    """Работа по обслуживанию с заполненными обязательными полями"""
+    values = {
+        'passport': passport, 'work_type': 'repair', 'work_date': datetime.date(2024, 1, 1),
+        'responsible_person': 'Иванов', 'created_by': passport.created_by,
+    }
+    values.update(fields)
+    return MaintenanceWork.objects.create(**values)
+
+
+@override_settings(PASSPORTS_DIR=PASSPORTS_DIR, PASSPORT_MIRROR_ASYNC=False)
+class PassportTestCase(TestCase):
+    """Файлы паспортов пишутся во временную папку, зеркало - синхронно"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('user', password='pass')
+        cls.other = User.objects.create_user('other', password='pass')
+        cls.admin = User.objects.create_user('admin', password='pass', is_staff=True)
+
+
+class WorksLogTests(PassportTestCase):
+    def setUp(self):
+        self.passport = EquipmentPassport.objects.get(pk=generate_fleet([self.user], 1, 0)[0])
+        save_passport_to_file(self.passport)
+        self.log_path = get_works_log_path(self.passport.pk)
+
+    def add_work(self, work_date, cost):
+        return MaintenanceWork.objects.create(
+            passport=self.passport, work_type='repair', work_date=work_date,
+            responsible_person='Иванов', cost=cost, created_by=self.user,
+        )
+
+    def file_works(self):
+        return {work['id']: work for work in load_passport_from_file(self.passport.pk)['maintenance_works']}
+
+    def test_log_is_merged_into_snapshot(self):
+        first = self.add_work(datetime.date(2024, 1, 1), Decimal('10'))
+        second = self.add_work(datetime.date(2024, 2, 1), Decimal('20'))
+        append_work_to_file(first)
+        append_work_to_file(second)
+        first.cost = Decimal('15')
+        append_work_to_file(first)
+        remove_work_from_file(self.passport, second.pk)
+
+        self.assertTrue(os.path.exists(self.log_path))
+        self.assertEqual(list(self.file_works()), [str(first.pk)])
+        self.assertEqual(self.file_works()[str(first.pk)]['cost'], 15.0)
+
+    def test_partial_line_is_skipped(self):
+        work = self.add_work(datetime.date(2024, 1, 1), None)
+        with open(self.log_path, 'wb') as f:
+            f.write(b'{"op": "upsert", "work": {"id"')
+        append_work_to_file(work)
+        self.assertEqual(list(self.file_works()), [str(work.pk)])
+
+    @override_settings(PASSPORT_WORKS_LOG_COMPACT_SIZE=1024)
+    def test_compaction(self):
+        works = [self.add_work(datetime.date(2024, 1, day), Decimal(day)) for day in range(1, 11)]
+        for work in works:
+            append_work_to_file(work)
+
+        self.assertLess(os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0, 1024)
+        self.assertEqual(set(self.file_works()), {str(work.pk) for work in works})
+
+    def test_append_during_compaction_is_kept(self):
+        self.add_work(datetime.date(2024, 1, 1), None)
+        append_work_to_file(self.passport.maintenance_works.get())
+        record = {'op': 'upsert', 'work': {'id': 'parallel', 'work_date': '2024-03-01'}}
+        appender = threading.Thread(target=utils._append_to_works_log, args=(self.passport, record))
+        real_serialize = utils.serialize_passport
+
+        def serialize_while_appending(passport):
+            data = real_serialize(passport)
+            # Другой поток дописывает журнал, пока снимок еще не записан
+            appender.start()
+            appender.join(0.5)
+            return data
+
+        with mock.patch.object(utils, 'serialize_passport', serialize_while_appending):
+            save_passport_to_file(self.passport)
+        appender.join()
+
+        self.assertIn('parallel', self.file_works())
+
+
+class HistoryLogTests(PassportTestCase):
+    def setUp(self):
+        self.passport = create_passport(self.user)
+
+    def add_entries(self, count):
+        for number in range(count):
+            add_passport_history_entry(self.passport, self.user, [f'field{number}'])
+
+    def fields(self, entries):
+        return [entry['changed_fields'][0] for entry in entries]
+
+    def test_entries_are_appended_as_lines(self):
+        self.add_entries(3)
+        with open(get_history_file_path(self.passport.id), encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[2])['user'], 'user')
+        self.assertEqual(self.fields(get_passport_history(self.passport.id)), ['field0', 'field1', 'field2'])
+
+    def test_page_is_counted_from_newest(self):
+        self.add_entries(5)
+        self.assertEqual(self.fields(get_passport_history(self.passport.id, limit=2)), ['field3', 'field4'])
+        self.assertEqual(self.fields(get_passport_history(self.passport.id, limit=2, offset=2)), ['field1', 'field2'])
+        self.assertEqual(self.fields(get_passport_history(self.passport.id, limit=2, offset=4)), ['field0'])
+
+    def test_legacy_history_is_moved_into_log(self):
+        legacy = [{'timestamp': '2020-01-01T00:00:00', 'user': 'old', 'changed_fields': ['legacy']}]
+        legacy_path = get_legacy_history_file_path(self.passport.id)
+        os.makedirs(os.path.dirname(legacy_path), exist_ok=True)
+        with open(legacy_path, 'w', encoding='utf-8') as f:
+            json.dump(legacy, f)
+        self.assertEqual(self.fields(get_passport_history(self.passport.id)), ['legacy'])
+
+        self.add_entries(1)
+        self.assertFalse(os.path.exists(legacy_path))
+        self.assertEqual(self.fields(get_passport_history(self.passport.id)), ['legacy', 'field0'])
+
+    @override_settings(PASSPORT_HISTORY_PAGE_SIZE=2)
+    def test_history_view_pages(self):
+        self.add_entries(3)
+        self.client.force_login(self.user)
+
+        response = self.client.get(f'/passports/history/{self.passport.id}/')
+        self.assertEqual(self.fields(response.context['history']), ['field1', 'field2'])
+        self.assertTrue(response.context['has_older'])
+
+        response = self.client.get(f'/passports/history/{self.passport.id}/?page=2')
+        self.assertEqual(self.fields(response.context['history']), ['field0'])
+        self.assertFalse(response.context['has_older'])
+        self.assertTrue(response.context['has_newer'])
+
+
+class DeletePassportTests(PassportTestCase):
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def saved_passport(self):
+        passport = EquipmentPassport.objects.get(pk=generate_fleet([self.user], 1, 1)[0])
+        save_passport_to_file(passport)
+        return passport.pk, get_passport_file_path(passport.pk)
+
+    def test_files_removed_after_commit(self):
+        for url in ('/passports/api/passports/{}/', '/passports/delete/{}/'):
+            with self.subTest(url=url):
+                passport_id, path = self.saved_passport()
+                with self.captureOnCommitCallbacks() as callbacks:
+                    response = self.client.delete(url.format(passport_id))
+                self.assertIn(response.status_code, (200, 204), response.content)
+                self.assertFalse(EquipmentPassport.objects.filter(pk=passport_id).exists())
+                self.assertTrue(os.path.exists(path))
+
+                for callback in callbacks:
+                    callback()
+                self.assertFalse(os.path.exists(path))
+
+    def test_files_kept_when_delete_rolls_back(self):
+        passport_id, path = self.saved_passport()
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                delete_passport_with_files(EquipmentPassport.objects.get(pk=passport_id))
+                raise RuntimeError()
+        self.assertTrue(EquipmentPassport.objects.filter(pk=passport_id).exists())
+        self.assertTrue(os.path.exists(path))
+
+
+class MirrorWriterTests(PassportTestCase):
+    def setUp(self):
+        self.passport = create_passport(self.user)
+        save_passport_to_file(self.passport)
+        self.client.force_login(self.user)
+        # Поток записи не запускается: очередь дописывает сам тест
+        self.writer = mirror.get_writer()
+        patcher = mock.patch.object(self.writer, '_ensure_started')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.writer.flush)
+
+    def edit(self, **changes):
+        data = {
+            'name': 'Насос', 'serial_number': 'SN-1', 'inventory_number': 'INV-1', 'location': 'Цех 1',
+            'production_date': '2020-01-01', 'commissioning_date': '2020-06-01', 'status': 'in_operation',
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/passports/edit/{self.passport.pk}/', {**data, **changes})
+
+    @override_settings(PASSPORT_MIRROR_ASYNC=True)
+    def test_history_is_queued_with_the_passport(self):
+        self.assertEqual(self.edit(name='Насос после ремонта').status_code, 302)
+        self.assertEqual(get_passport_history(self.passport.pk), [])
+
+        # Чтение не ждет очередь - файл отстает до записи
+        with mock.patch.object(self.writer, 'flush_passport') as flush_passport:
+            self.assertEqual(self.client.get(f'/passports/view/{self.passport.pk}/').status_code, 200)
+        flush_passport.assert_not_called()
+        self.assertEqual(load_passport_from_file(self.passport.pk)['name'], 'Насос')
+
+        self.writer.flush()
+        self.assertEqual(load_passport_from_file(self.passport.pk)['name'], 'Насос после ремонта')
+        [entry] = get_passport_history(self.passport.pk)
+        self.assertEqual(entry['changed_fields'], {'name': {'old': 'Насос', 'new': 'Насос после ремонта'}})
+
+    def test_synchronous_mode_writes_history_after_commit(self):
+        self.edit(location='Цех 2')
+        self.assertEqual(self.writer.stats()['queue_depth'], 0)
+        self.assertEqual([list(entry['changed_fields']) for entry in get_passport_history(self.passport.pk)],
+                         [['location']])
+
+
+class DynamicFieldsTests(PassportTestCase):
+    def setUp(self):
+        for number in range(3):
+            create_work(create_passport(self.user, serial_number=f'SN-{number}'))
+        self.client.force_login(self.user)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_list_expands_works_on_request(self):
+        item = self.get('/passports/api/passports/')['results'][0]
+        self.assertNotIn('maintenance_works', item)
+        self.assertEqual(item['created_by_username'], 'user')
+
+        item = self.get('/passports/api/passports/?expand=maintenance_works')['results'][0]
+        self.assertEqual(len(item['maintenance_works']), 1)
+
+    def test_fields_trim_list_and_detail(self):
+        item = self.get('/passports/api/passports/?fields=id,name')['results'][0]
+        self.assertEqual(set(item), {'id', 'name'})
+
+        detail = self.get(f'/passports/api/passports/{item["id"]}/')
+        self.assertEqual(len(detail['maintenance_works']), 1)
+        detail = self.get(f'/passports/api/passports/{item["id"]}/?fields=id,serial_number')
+        self.assertEqual(set(detail), {'id', 'serial_number'})
+
+    def test_fields_do_not_limit_writes(self):
+        data = {
+            'name': 'Компрессор', 'serial_number': 'SN-new', 'inventory_number': 'INV-new', 'location': 'Цех 2',
+            'production_date': '2020-01-01', 'commissioning_date': '2020-06-01',
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/passports/api/passports/?fields=id', data)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['location'], 'Цех 2')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/passports/api/passports/{response.json()["id"]}/?fields=id',
+                                         {'name': 'Компрессор 2'}, content_type='application/json')
+        self.assertEqual(response.json()['name'], 'Компрессор 2')
+        self.assertEqual(EquipmentPassport.objects.get(serial_number='SN-new').name, 'Компрессор 2')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.get(url)
+        return len(queries)
+
+    def test_list_query_count_does_not_grow_with_rows(self):
+        url = '/passports/api/passports/?expand=maintenance_works'
+        queries = self.count_queries(url)
+        for number in range(3, 6):
+            create_work(create_passport(self.user, serial_number=f'SN-{number}'))
+        self.assertEqual(self.count_queries(url), queries)
+        # Без работ и имени владельца не нужны ни prefetch, ни join
+        self.assertEqual(self.count_queries('/passports/api/passports/?fields=id,name'), queries - 1)
+
+
+class KeysetPaginationTests(PassportTestCase):
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            data = response.json()
+            self.assertNotIn('count', data)
+            ids.extend(item['id'] for item in data['results'])
+            url = data['next']
+        return ids
+
+    def test_walks_all_rows_with_ties(self):
+        for number in range(7):
+            passport = create_passport(self.user, serial_number=f'SN-{number}')
+            create_work(passport)
+            create_work(passport)
+        # Одинаковые значения ключа различаются по id
+        same_time = timezone.now() - datetime.timedelta(days=1)
+        EquipmentPassport.objects.filter(pk__in=EquipmentPassport.objects.values('pk')[:4]).update(created_at=same_time)
+        self.client.force_login(self.user)
+
+        passports = self.walk('/passports/api/passports/?pagination=cursor&page_size=3&fields=id')
+        expected = [str(pk) for pk in EquipmentPassport.objects.order_by('created_at', 'id').values_list('pk', flat=True)]
+        self.assertEqual(passports, expected)
+
+        works = self.walk('/passports/api/maintenance-works/?pagination=cursor&page_size=4')
+        expected = [str(pk) for pk in MaintenanceWork.objects.order_by('work_date', 'id').values_list('pk', flat=True)]
+        self.assertEqual(works, expected)
+
+    def test_invalid_cursor(self):
+        self.client.force_login(self.user)
+        for cursor in ('garbage', 'WyJ4Il0', 'WzEsMiwzXQ'):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(f'/passports/api/passports/?cursor={cursor}')
+                self.assertEqual(response.status_code, 404)
+
+
+class NumberSearchTests(PassportTestCase):
+    def setUp(self):
+        generate_fleet([self.user], 3, 0)
+        self.passport = EquipmentPassport.objects.first()
+        self.client.force_login(self.user)
+
+    def found(self, **params):
+        return list(self.client.get('/passports/search/', params).context['passports'])
+
+    def test_part_of_number(self):
+        self.assertEqual(self.found(serial_number=self.passport.serial_number[2:].lower()), [self.passport])
+        self.assertEqual(self.found(inventory_number=self.passport.inventory_number[1:]), [self.passport])
+
+    def test_whole_number_without_case(self):
+        for query in (self.passport.serial_number, f' {self.passport.serial_number.lower()} '):
+            with self.subTest(query=query):
+                self.assertEqual(self.found(serial_number=query, exact_numbers='1'), [self.passport])
+        self.assertEqual(self.found(inventory_number=self.passport.inventory_number.lower(), exact_numbers='1'),
+                         [self.passport])
+        self.assertEqual(self.found(serial_number=self.passport.serial_number[:-1], exact_numbers='1'), [])
+
+
+class SearchBackendTests(PassportTestCase):
+    def setUp(self):
+        self.pump = create_passport(self.user, name='Насос центробежный', serial_number='AB-1234')
+        self.fan = create_passport(self.user, name='Вентилятор вытяжной', serial_number='CD-5678',
+                                   location='Склад')
+
+    def found(self, query):
+        return set(search_passports(EquipmentPassport.objects.all(), query).values_list('pk', flat=True))
+
+    def test_fts5_is_used_on_sqlite(self):
+        self.assertIsInstance(get_search_backend(), SQLiteFTS5Backend)
+
+    def test_terms_match_by_prefix_and_all_are_required(self):
+        self.assertEqual(self.found('насо'), {self.pump.pk})
+        self.assertEqual(self.found('AB-12'), {self.pump.pk})
+        self.assertEqual(self.found('вентилятор склад'), {self.fan.pk})
+        self.assertEqual(self.found('насос склад'), set())
+        self.assertEqual(self.found('"*'), set())
+
+    def test_index_follows_saves_and_deletes(self):
+        self.pump.name = 'Компрессор'
+        self.pump.save()
+        self.assertEqual(self.found('насос'), set())
+        self.assertEqual(self.found('компрессор'), {self.pump.pk})
+
+        self.fan.delete()
+        self.assertEqual(self.found('вентилятор'), set())
+
+    def test_rebuild_restores_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLiteFTS5Backend.table}')
+        self.assertEqual(self.found('насос'), set())
+        SQLiteFTS5Backend().rebuild()
+        self.assertEqual(self.found('насос'), {self.pump.pk})
+
+    def test_fallback_to_substring_search(self):
+        with override_settings(PASSPORT_SEARCH_BACKEND='passports.search.BasicSearchBackend'):
+            self.assertIsInstance(get_search_backend(), BasicSearchBackend)
+            # Подстрока из середины слова - FTS5 ее не находит
+            self.assertEqual(self.found('бежн'), {self.pump.pk})
+
+        with mock.patch.object(SQLiteFTS5Backend, 'is_available', return_value=False):
+            _load_backend.cache_clear()
+            try:
+                self.assertIsInstance(get_search_backend(), BasicSearchBackend)
+            finally:
+                _load_backend.cache_clear()
+
+    def test_search_view_uses_backend(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/passports/search/?keywords=вытяж')
+        self.assertEqual([passport.pk for passport in response.context['passports']], [self.fan.pk])
+
+
+class ExportTests(PassportTestCase):
+    def setUp(self):
+        for number in range(3):
+            passport = create_passport(self.user, serial_number=f'SN-{number}', custom_fields={'Напряжение': 220})
+            create_work(passport, cost=Decimal('10.50'))
+        create_passport(self.other, serial_number='SN-other')
+        self.client.force_login(self.user)
+
+    def export(self, query=''):
+        response = self.client.get(f'/passports/api/passports/export/{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_jsonl_holds_own_passports_with_works(self):
+        response, content = self.export()
+        self.assertTrue(response['Content-Type'].startswith('application/x-ndjson'))
+        self.assertIn('passports_export.jsonl', response['Content-Disposition'])
+
+        records = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual(sorted(record['serial_number'] for record in records), ['SN-0', 'SN-1', 'SN-2'])
+        self.assertEqual(len(records[0]['maintenance_works']), 1)
+        self.assertEqual(records[0]['custom_fields'], {'Напряжение': 220})
+
+    def test_csv_and_json_array(self):
+        _, content = self.export('?export_format=csv')
+        rows = list(csv.DictReader(io.StringIO(content.decode())))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(len(json.loads(rows[0]['maintenance_works'])), 1)
+
+        _, content = self.export('?export_format=json')
+        self.assertEqual(len(json.loads(content)), 3)
+
+    def test_gzip(self):
+        response, content = self.export('?export_format=json&gzip=1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('passports_export.json.gz', response['Content-Disposition'])
+        self.assertEqual(len(json.loads(gzip.decompress(content))), 3)
+
+    def test_unknown_format(self):
+        response = self.client.get('/passports/api/passports/export/?export_format=xml')
+        self.assertEqual(response.status_code, 400)
+
+    def test_short_list_is_rendered_by_drf(self):
+        request = APIRequestFactory().get('/', HTTP_ACCEPT='application/json')
+        force_authenticate(request, self.user)
+        response = views.api_passport_list(request)
+        self.assertFalse(response.streaming)
+        self.assertEqual(sorted(row['serial_number'] for row in response.data), ['SN-0', 'SN-1', 'SN-2'])
+
+    def test_response_is_produced_in_chunks(self):
+        with mock.patch('passports.export.STREAM_BUFFER_SIZE', 1):
+            response = self.client.get('/passports/api/passports/export/')
+            self.assertEqual(len(list(response.streaming_content)), 3)
+
+
+class ImportTests(PassportTestCase):
+    passport = {
+        'name': 'Насос', 'serial_number': 'SN-1', 'inventory_number': 'INV-1', 'location': 'Цех 1',
+        'production_date': '2020-01-01', 'commissioning_date': '2020-06-01', 'equipment_type': 'Насосы',
+        'maintenance_works': [
+            {'work_type': 'repair', 'work_date': '2024-01-10', 'responsible_person': 'Иванов', 'cost': 120.5},
+        ],
+    }
+
+    def run_import(self, lines, import_format='jsonl', **kwargs):
+        return import_passports(iter_rows(lines, import_format), self.user, **kwargs)
+
+    def test_valid_rows_are_created_and_invalid_reported(self):
+        lines = [
+            json.dumps(self.passport, ensure_ascii=False),
+            '',
+            '{"name": ',
+            '[1, 2]',
+            json.dumps({**self.passport, 'status': 'broken', 'commissioning_date': 'вчера'}, ensure_ascii=False),
+            json.dumps({**self.passport, 'commissioning_date': '2019-01-01'}, ensure_ascii=False),
+            json.dumps({**self.passport, 'maintenance_works': [{'work_type': 'repair'}, 'x']}, ensure_ascii=False),
+            json.dumps({**self.passport, 'maintenance_works': {'work_type': 'repair'}}, ensure_ascii=False),
+        ]
+        result = self.run_import(lines, batch_size=2)
+
+        self.assertEqual(result.passports_created, 1)
+        self.assertEqual(result.works_created, 1)
+        self.assertEqual(result.equipment_types_created, 1)
+        errors = {error['row']: error['errors'] for error in result.errors}
+        self.assertEqual(sorted(errors), [3, 4, 5, 6, 7, 8])
+        self.assertIn('Неверный JSON', errors[3]['__all__'][0])
+        self.assertIn('status', errors[5])
+        self.assertIn('commissioning_date', errors[5])
+        self.assertIn('commissioning_date', errors[6])
+        self.assertIn('maintenance_works[0].work_date', errors[7])
+        self.assertIn('maintenance_works[1]', errors[7])
+        self.assertIn('maintenance_works', errors[8])
+
+    def test_types_created_by_a_parallel_import_are_not_counted(self):
+        real_bulk_create = EquipmentType.objects.bulk_create
+
+        def bulk_create_after_parallel_import(objs, **kwargs):
+            # Параллельный импорт создал тот же тип между поиском и вставкой
+            EquipmentType.objects.create(name=objs[0].name)
+            return real_bulk_create(objs, **kwargs)
+
+        with mock.patch.object(EquipmentType.objects, 'bulk_create', bulk_create_after_parallel_import):
+            result = self.run_import([json.dumps(self.passport, ensure_ascii=False)])
+        self.assertEqual(result.passports_created, 1)
+        self.assertEqual(result.equipment_types_created, 0)
+        self.assertEqual(EquipmentPassport.objects.get().equipment_type.name, 'Насосы')
+
+        passport = EquipmentPassport.objects.get()
+        self.assertEqual(passport.equipment_type.name, 'Насосы')
+        self.assertEqual(passport.maintenance_works.get().cost, Decimal('120.50'))
+
+    def test_csv_and_dry_run(self):
+        columns = ['name', 'serial_number', 'inventory_number', 'location', 'production_date',
+                   'commissioning_date', 'maintenance_works']
+        lines = [
+            ','.join(columns),
+            'Насос,SN-1,INV-1,Цех 1,2020-01-01,2020-06-01,"[{""work_type"": ""repair"", '
+            '""work_date"": ""2024-01-10"", ""responsible_person"": ""Иванов""}]"',
+            'Насос,SN-2,INV-2,Цех 1,2020-01-01,2020-06-01,"{не json"',
+        ]
+        result = self.run_import(lines, 'csv', dry_run=True)
+        self.assertEqual(result.passports_created, 0)
+        self.assertEqual([error['row'] for error in result.errors], [2])
+        self.assertFalse(EquipmentPassport.objects.exists())
+
+        result = self.run_import(lines, 'csv')
+        self.assertEqual((result.passports_created, result.works_created), (1, 1))
+
+
+class CleanupTests(PassportTestCase):
+    def setUp(self):
+        # Отдельная папка: файлы других тестов здесь были бы сиротами
+        self.directory = tempfile.mkdtemp(prefix='passports-cleanup-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.enterContext(override_settings(PASSPORTS_DIR=self.directory))
+
+    def write_file(self, path, content=b'{}'):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def temp_file(self, directory, name, age):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as f:
+            f.write(b'{"id"')
+        modified = time.time() - age
+        os.utime(path, (modified, modified))
+        return path
+
+    def test_orphaned_files_are_removed(self):
+        passport = create_passport(self.user)
+        save_passport_to_file(passport)
+        orphan_id = uuid.uuid4()
+        orphans = [
+            self.write_file(os.path.join(self.directory, f'{orphan_id}.json'), b'{"id": 1}'),
+            self.write_file(os.path.join(self.directory, f'{orphan_id}_history.jsonl'), b'{}\n'),
+        ]
+        foreign = self.write_file(os.path.join(self.directory, 'notes.json'))
+
+        report = find_and_remove_orphaned_files(dry_run=True)
+        self.assertEqual((report.orphaned_passports, report.deleted_files, report.reclaimed_bytes), (1, 2, 12))
+        self.assertTrue(all(os.path.exists(path) for path in orphans))
+
+        report = find_and_remove_orphaned_files(batch_size=1, workers=2)
+        self.assertEqual((report.deleted_files, report.errors), (2, []))
+        self.assertFalse(any(os.path.exists(path) for path in orphans))
+        self.assertTrue(os.path.exists(foreign))
+        self.assertIsNotNone(load_passport_from_file(passport.pk))
+
+    def test_command_json_report(self):
+        self.write_file(os.path.join(self.directory, f'{uuid.uuid4()}.json'))
+        out = io.StringIO()
+        call_command('cleanup_orphaned_files', '--json', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual((report['orphaned_passports'], report['deleted_files']), (1, 1))
+
+    def test_stale_temp_files_are_removed(self):
+        passport = EquipmentPassport.objects.get(pk=generate_fleet([self.user], 1, 0)[0])
+        save_passport_to_file(passport)
+        directory = os.path.dirname(get_passport_file_path(passport.pk))
+        stale = self.temp_file(directory, f'.{passport.pk}.json.0a1b.tmp', 2 * 60 * 60)
+        fresh = self.temp_file(directory, f'.{passport.pk}.json.2c3d.tmp', 0)
+
+        report = find_and_remove_orphaned_files(dry_run=True)
+        self.assertEqual(report.temp_files_deleted, 1)
+        self.assertTrue(os.path.exists(stale))
+
+        report = find_and_remove_orphaned_files()
+        self.assertEqual(report.temp_files_deleted, 1)
+        self.assertEqual(report.orphaned_passports, 0)
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertIsNotNone(load_passport_from_file(passport.pk))
+
+
+class ShardingTests(PassportTestCase):
+    def setUp(self):
+        self.passport = EquipmentPassport.objects.get(pk=generate_fleet([self.user], 1, 0)[0])
+
+    def test_files_found_after_levels_change(self):
+        for written, current in ((2, 1), (2, 0), (0, 2), (1, 3)):
+            with self.subTest(written=written, current=current):
+                with self.settings(PASSPORT_SHARD_LEVELS=written):
+                    old_path = save_passport_to_file(self.passport)
+
+                with self.settings(PASSPORT_SHARD_LEVELS=current, PASSPORT_SHARD_PREVIOUS_LEVELS=(written,)):
+                    self.assertEqual(get_passport_file_path(self.passport.pk), old_path)
+                    self.assertEqual(load_passport_from_file(self.passport.pk)['id'], str(self.passport.pk))
+
+                    # Запись переносит файлы в папку текущего разбиения
+                    new_path = save_passport_to_file(self.passport)
+                    self.assertNotEqual(new_path, old_path)
+                    self.assertFalse(os.path.exists(old_path))
+
+                    self.assertTrue(delete_passport_file(self.passport.pk))
+                    self.assertFalse(os.path.exists(new_path))
+
+    def test_other_levels_are_not_checked_outside_reshard(self):
+        with self.settings(PASSPORT_SHARD_LEVELS=2):
+            old_path = save_passport_to_file(self.passport)
+
+        with self.settings(PASSPORT_SHARD_LEVELS=1):
+            with mock.patch('passports.utils.os.path.exists', wraps=os.path.exists) as exists:
+                paths = resolve_passport_paths(self.passport.pk)
+            exists.assert_not_called()
+            self.assertNotEqual(paths.snapshot, old_path)
+            self.assertIsNone(load_passport_from_file(self.passport.pk, paths))
+
+    def test_views_resolve_paths_once(self):
+        self.client.force_login(self.user)
+        with mock.patch('passports.views.resolve_passport_paths', wraps=resolve_passport_paths) as resolve:
+            response = self.client.get(f'/passports/view/{self.passport.pk}/')
+        self.assertEqual(response.status_code, 200)
+        resolve.assert_called_once_with(self.passport.pk)
+
+
+class FileCacheTests(PassportTestCase):
+    def setUp(self):
+        self.file_cache = get_file_cache()
+        self.file_cache.clear()
+        self.passport = create_passport(self.user)
+        save_passport_to_file(self.passport)
+
+    def test_repeated_reads_hit_local_cache(self):
+        data = load_passport_from_file(self.passport.pk)
+        hits = self.file_cache.local_hits
+        with mock.patch('passports.utils._read_passport_file') as read:
+            self.assertEqual(load_passport_from_file(self.passport.pk), data)
+        read.assert_not_called()
+        self.assertEqual(self.file_cache.local_hits, hits + 1)
+
+    def test_writes_in_this_process_invalidate(self):
+        load_passport_from_file(self.passport.pk)
+        append_work_to_file(create_work(self.passport))
+        self.assertEqual(len(load_passport_from_file(self.passport.pk)['maintenance_works']), 1)
+
+        get_passport_history(self.passport.pk, limit=10)
+        add_passport_history_entry(self.passport, self.user, ['name'])
+        self.assertEqual(len(get_passport_history(self.passport.pk, limit=10)), 1)
+
+        delete_passport_file(self.passport.pk)
+        self.assertIsNone(load_passport_from_file(self.passport.pk))
+
+    def test_changes_from_other_processes_are_seen(self):
+        load_passport_from_file(self.passport.pk)
+        # Другой процесс переписал файл: кэш этого процесса о записи не знает
+        self.passport.name = 'Насос после ремонта'
+        with mock.patch.object(self.file_cache, 'invalidate'):
+            save_passport_to_file(self.passport)
+        self.assertEqual(load_passport_from_file(self.passport.pk)['name'], 'Насос после ремонта')
+
+    def test_shared_tier_is_off_by_default(self):
+        with mock.patch.object(cache, 'set') as cache_set:
+            load_passport_from_file(self.passport.pk)
+        cache_set.assert_not_called()
+
+        # Кэш в памяти процесса не годится для общего уровня
+        with self.settings(PASSPORT_FILE_CACHE_ALIAS='default'):
+            self.assertIsNone(self.file_cache._shared_cache())
+
+    def test_history_pages_are_cached_separately(self):
+        for number in range(3):
+            add_passport_history_entry(self.passport, self.user, [f'field{number}'])
+        self.assertEqual(len(get_passport_history(self.passport.pk, limit=2)), 2)
+        self.assertEqual(len(get_passport_history(self.passport.pk, limit=2, offset=2)), 1)
+        hits = self.file_cache.local_hits
+        self.assertEqual(len(get_passport_history(self.passport.pk, limit=2)), 2)
+        self.assertEqual(self.file_cache.local_hits, hits + 1)
+
+    @override_settings(
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'files': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': os.path.join(PASSPORTS_DIR, 'file-cache'),
+            },
+        },
+        PASSPORT_FILE_CACHE_ALIAS='files',
+    )
+    def test_shared_tier_serves_other_processes(self):
+        data = load_passport_from_file(self.passport.pk)
+        # Новый процесс: локальный уровень пуст
+        self.file_cache.clear()
+        hits = self.file_cache.shared_hits
+        self.assertEqual(load_passport_from_file(self.passport.pk), data)
+        self.assertEqual(self.file_cache.shared_hits, hits + 1)
+
+
+class FileFormatTests(SimpleTestCase):
+    data = {'id': 'a1', 'name': 'Насос', 'maintenance_works': []}
+
+    def test_round_trip(self):
+        for file_format in ('json', 'json-compact', 'gzip'):
+            with self.subTest(file_format=file_format):
+                raw = dumps_passport(self.data, file_format)
+                self.assertEqual(loads_passport(raw), self.data)
+
+    def test_detect_format(self):
+        self.assertEqual(detect_format(b'  {"id": 1}'), 'json')
+        self.assertEqual(detect_format(dumps_passport(self.data, 'gzip')), 'gzip')
+        self.assertEqual(detect_format(b'\x28\xb5\x2f\xfd...'), 'zstd')
+        self.assertEqual(detect_format(b'\x83\xa2id'), 'msgpack')
+        self.assertEqual(detect_format(b'\xde\x00\x10'), 'msgpack')
+
+    def test_empty_and_garbage(self):
+        for raw in (b'', b'garbage', b'\x00\x01', b'   '):
+            with self.subTest(raw=raw):
+                with self.assertRaises(PassportFileFormatError):
+                    loads_passport(raw)
+
+    def test_truncated(self):
+        raw = dumps_passport(self.data, 'gzip')
+        with self.assertRaises(PassportFileFormatError):
+            loads_passport(raw[:len(raw) // 2])
+
+
+class DamagedFileTests(PassportTestCase):
+    def test_garbage_file_reads_as_missing(self):
+        passport_id = generate_fleet([self.user], 1, 0)[0]
+        path = get_passport_file_path(passport_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for raw in (b'', b'garbage'):
+            with self.subTest(raw=raw):
+                with open(path, 'wb') as f:
+                    f.write(raw)
+                self.assertIsNone(load_passport_from_file(passport_id))
+
+
+class ConvertFileTests(PassportTestCase):
+    def setUp(self):
+        self.passport = create_passport(self.user)
+        self.path = save_passport_to_file(self.passport)
+        self.log_path = get_works_log_path(self.passport.pk)
+
+    def test_works_log_is_kept(self):
+        append_work_to_file(create_work(self.passport))
+        sizes = convert_passport_file(self.path, 'gzip')
+        self.assertLess(sizes[1], sizes[0])
+        self.assertIsNone(convert_passport_file(self.path, 'gzip'))
+        with open(self.path, 'rb') as f:
+            self.assertEqual(detect_format(f.read()), 'gzip')
+        self.assertEqual(len(load_passport_from_file(self.passport.pk)['maintenance_works']), 1)
+
+    @skipIf(utils.fcntl is None, 'блокировка проверяется через fcntl')
+    def test_snapshot_is_replaced_under_the_log_lock(self):
+        real_write = utils._write_file_atomic
+
+        def write_checking_lock(path, data):
+            with open(self.log_path, 'a+b') as f:
+                with self.assertRaises(BlockingIOError):
+                    utils.fcntl.flock(f.fileno(), utils.fcntl.LOCK_EX | utils.fcntl.LOCK_NB)
+            real_write(path, data)
+
+        with mock.patch.object(utils, '_write_file_atomic', write_checking_lock):
+            self.assertIsNotNone(convert_passport_file(self.path, 'json-compact'))
+        # Журнал, созданный для блокировки, не остается
+        self.assertFalse(os.path.exists(self.log_path))
+
+
+class BulkDeleteTests(PassportTestCase):
+    def setUp(self):
+        self.passports = []
+        for number in range(5):
+            passport = create_passport(self.user, name=f'Насос {number}', serial_number=f'SN-{number}')
+            create_work(passport)
+            save_passport_to_file(passport)
+            self.passports.append(passport)
+        self.kept = create_passport(self.other, name='Насос оставшийся')
+
+    def selection(self):
+        return EquipmentPassport.objects.filter(created_by=self.user)
+
+    def test_chunks_rows_files_and_index(self):
+        progress = mock.Mock()
+        with self.captureOnCommitCallbacks(execute=True):
+            report = bulk_delete_passports(self.selection(), chunk_size=2, progress=progress)
+
+        self.assertEqual(progress.call_count, 3)
+        self.assertEqual(report.as_dict(), {
+            'total': 5, 'passports_deleted': 5, 'works_deleted': 5, 'files_deleted': 5, 'file_errors': 0,
+        })
+        self.assertEqual(list(EquipmentPassport.objects.values_list('pk', flat=True)), [self.kept.pk])
+        self.assertFalse(MaintenanceWork.objects.exists())
+        self.assertIsNone(load_passport_from_file(self.passports[0].pk))
+        found = search_passports(EquipmentPassport.objects.all(), 'насос').values_list('pk', flat=True)
+        self.assertEqual(list(found), [self.kept.pk])
+
+    def test_files_stay_until_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            bulk_delete_passports(self.selection())
+        self.assertIsNotNone(load_passport_from_file(self.passports[0].pk))
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(load_passport_from_file(self.passports[0].pk))
+
+    @override_settings(MEDIA_ROOT=PASSPORTS_DIR, PASSPORT_THUMBNAIL_SIZES={'small': (64, 64)})
+    def test_photos_and_thumbnails_removed_after_commit(self):
+        photo = self.passports[0].photo
+        photo.save('pump.png', _image('PNG', (255, 0, 0)), save=False)
+        EquipmentPassport.objects.filter(pk=self.passports[0].pk).update(photo=photo.name)
+        generate_thumbnails(photo)
+        names = [photo.name, thumbnail_name(photo.name, 'small')]
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            bulk_delete_passports(self.selection())
+        self.assertTrue(all(photo.storage.exists(name) for name in names))
+        for callback in callbacks:
+            callback()
+        self.assertFalse(any(photo.storage.exists(name) for name in names))
+
+    def test_api_is_staff_only(self):
+        ids = [str(passport.pk) for passport in self.passports[:2]] + ['не uuid']
+        self.client.force_login(self.user)
+        response = self.client.post('/passports/api/passports/bulk_delete/', {'passport_ids': ids},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_login(self.admin)
+        response = self.client.post('/passports/api/passports/bulk_delete/', {'passport_ids': []},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/passports/api/passports/bulk_delete/', {'passport_ids': ids},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['passports_deleted'], 2)
+        self.assertEqual(self.selection().count(), 3)
+
+
+@override_settings(PASSPORTS_DIR=PASSPORTS_DIR, PASSPORT_MIRROR_ASYNC=False)
+class BulkDeleteJobTests(TransactionTestCase):
+    """Фоновому заданию нужны зафиксированные данные - без общей транзакции теста"""
+
+    def test_background_job_status(self):
+        admin = User.objects.create_user('admin', password='pass', is_staff=True)
+        ids = [str(create_passport(admin, serial_number=f'SN-{number}').pk) for number in range(5)]
+        self.client.force_login(admin)
+        with override_settings(PASSPORT_BULK_DELETE_SYNC_LIMIT=2):
+            response = self.client.post('/passports/api/passports/bulk_delete/', {'passport_ids': ids},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertEqual((job['status'], job['total']), ('running', 5))
+
+        # Задание идет в своем потоке со своим соединением с БД
+        for thread in threading.enumerate():
+            if thread.name == f'passport-bulk-delete-{job["id"]}':
+                thread.join()
+        job = self.client.get(job['status_url']).json()
+        self.assertEqual((job['status'], job['passports_deleted']), ('done', 5))
+        self.assertEqual(BulkDeleteJob.objects.get(pk=job['id']).created_by, admin)
+        self.assertEqual(self.client.get(f'/passports/api/passports/bulk_delete/{"0" * 32}/').status_code, 404)
+
+
+class AggregateTests(PassportTestCase):
+    def setUp(self):
+        first, second = generate_fleet([self.user], 2, 0)
+        self.passport = EquipmentPassport.objects.get(pk=first)
+        self.target = EquipmentPassport.objects.get(pk=second)
+
+    def add_work(self, passport, work_type, work_date, cost):
+        return MaintenanceWork.objects.create(
+            passport=passport, work_type=work_type, work_date=work_date,
+            responsible_person='Иванов', cost=cost, created_by=self.user,
+        )
+
+    def assertSummary(self, passport, count, total, last_date, last_dates):
+        passport.refresh_from_db()
+        self.assertEqual(passport.works_count, count)
+        self.assertEqual(passport.works_total_cost, Decimal(total))
+        self.assertEqual(passport.last_work_date, last_date)
+        self.assertEqual(passport.last_work_dates, last_dates)
+
+    def test_save_and_delete(self):
+        self.add_work(self.passport, 'repair', datetime.date(2024, 1, 10), Decimal('100'))
+        latest = self.add_work(self.passport, 'repair', datetime.date(2024, 3, 1), Decimal('50'))
+        self.add_work(self.passport, 'inspection', datetime.date(2024, 2, 1), None)
+        self.assertSummary(self.passport, 3, '150', datetime.date(2024, 3, 1),
+                           {'repair': '2024-03-01', 'inspection': '2024-02-01'})
+
+        latest.cost = Decimal('70')
+        latest.save()
+        self.assertSummary(self.passport, 3, '170', datetime.date(2024, 3, 1),
+                           {'repair': '2024-03-01', 'inspection': '2024-02-01'})
+
+        latest.delete()
+        self.assertSummary(self.passport, 2, '100', datetime.date(2024, 2, 1),
+                           {'repair': '2024-01-10', 'inspection': '2024-02-01'})
+
+    def test_move_to_other_passport(self):
+        work = self.add_work(self.passport, 'diagnostic', datetime.date(2024, 5, 5), Decimal('30'))
+        work.passport = self.target
+        work.save()
+        self.assertSummary(self.passport, 0, '0', None, {})
+        self.assertSummary(self.target, 1, '30', datetime.date(2024, 5, 5), {'diagnostic': '2024-05-05'})
+
+    def test_full_save_of_stale_passport_keeps_summary(self):
+        stale = EquipmentPassport.objects.get(pk=self.passport.pk)
+        self.add_work(self.passport, 'repair', datetime.date(2024, 1, 10), Decimal('100'))
+
+        stale.location = 'Цех 2'
+        stale.save()
+        self.assertSummary(stale, 1, '100', datetime.date(2024, 1, 10), {'repair': '2024-01-10'})
+        self.assertEqual(stale.location, 'Цех 2')
+        self.assertIsNotNone(stale.works_changed_at)
+
+    def test_api_update_of_stale_passport_keeps_summary(self):
+        self.client.force_login(self.user)
+        url = f'/passports/api/passports/{self.passport.pk}/'
+        data = self.client.get(url).json()
+        self.add_work(self.passport, 'repair', datetime.date(2024, 1, 10), Decimal('100'))
+
+        response = self.client.patch(url, {'location': 'Цех 2'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertSummary(self.passport, 1, '100', datetime.date(2024, 1, 10), {'repair': '2024-01-10'})
+        self.assertNotEqual(data['location'], 'Цех 2')
+
+
+class AnalyticsTests(PassportTestCase):
+    def setUp(self):
+        pump_type = EquipmentType.objects.create(name='Насос')
+        motor_type = EquipmentType.objects.create(name='Двигатель')
+        self.pump = create_passport(self.user, equipment_type=pump_type)
+        for day in (1, 11, 31):
+            create_work(self.pump, work_date=datetime.date(2024, 1, day), cost=Decimal('100'))
+        create_work(self.pump, work_type='inspection', work_date=datetime.date(2024, 1, 5))
+
+        second_pump = create_passport(self.user, serial_number='SN-2', equipment_type=pump_type)
+        create_work(second_pump, work_date=datetime.date(2024, 2, 1))
+        create_work(second_pump, work_date=datetime.date(2024, 2, 5))
+
+        # Один ремонт - интервала нет
+        motor = create_passport(self.other, serial_number='SN-3', equipment_type=motor_type)
+        create_work(motor, work_date=datetime.date(2024, 3, 1))
+
+    def test_repair_intervals(self):
+        # Типы оборудования и все агрегаты - два запроса при любом числе паспортов
+        with self.assertNumQueries(2):
+            result = repair_intervals(MaintenanceWork.objects.all())
+        self.assertEqual(result, {
+            'work_type': 'repair', 'passports': 2, 'intervals': 3, 'mean_interval_days': 11.3,
+            'by_equipment_type': [
+                {'equipment_type': 'Насос', 'passports': 2, 'intervals': 3, 'mean_interval_days': 11.3},
+            ],
+        })
+        result = repair_intervals(MaintenanceWork.objects.filter(work_date__lt=datetime.date(2024, 2, 1)))
+        self.assertEqual((result['intervals'], result['mean_interval_days']), (2, 15.0))
+
+        result = repair_intervals(MaintenanceWork.objects.all(), 'inspection')
+        self.assertEqual((result['passports'], result['mean_interval_days'], result['by_equipment_type']),
+                         (0, None, []))
+
+    @override_settings(PASSPORT_ANALYTICS_CACHE_TIMEOUT=300)
+    def test_reports_are_cached_until_works_change(self):
+        self.client.force_login(self.user)
+        url = '/passports/api/analytics/repair-intervals/'
+        self.assertEqual(self.client.get(url).json()['results']['intervals'], 3)
+        with mock.patch('passports.analytics.repair_intervals') as report:
+            self.assertEqual(self.client.get(url).json()['results']['intervals'], 3)
+        report.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_work(self.pump, work_date=datetime.date(2024, 2, 10))
+        self.assertEqual(self.client.get(url).json()['results']['intervals'], 4)
+
+        response = self.client.get('/passports/api/analytics/by-work-type/?date_from=2024-01-01')
+        self.assertEqual(response.json()['results'][0]['total_cost'], 300)
+        self.assertEqual(self.client.get('/passports/api/analytics/by-work-type/?date_from=вчера').status_code, 400)
+
+
+class CustomFieldTests(PassportTestCase):
+    def setUp(self):
+        self.motor = create_passport(self.user, serial_number='SN-1', custom_fields={
+            'Напряжение': {'value': 380, 'type': 'number'}, 'Производитель': {'value': 'ABB'},
+        })
+        self.pump = create_passport(self.user, serial_number='SN-2', custom_fields={
+            'Напряжение': '220', 'Производитель': 'Siemens',
+        })
+        self.fan = create_passport(self.user, serial_number='SN-3', custom_fields={'Напряжение': 'нет данных'})
+
+    def found(self, query, model=EquipmentPassport):
+        return set(filter_custom_fields(model.objects.all(), QueryDict(query)).values_list('pk', flat=True))
+
+    def test_text_lookups(self):
+        self.assertEqual(self.found('cf.Производитель=ABB'), {self.motor.pk})
+        self.assertEqual(self.found('cf.Производитель__icontains=siem'), {self.pump.pk})
+        self.assertEqual(self.found('cf.Производитель__in=ABB,Siemens'), {self.motor.pk, self.pump.pk})
+        self.assertEqual(self.found('cf.Производитель__isnull=true'), {self.fan.pk})
+
+    def test_range_lookups_compare_numbers(self):
+        # Текст 220 и число 380 сравниваются как числа, нечисловой текст не подходит
+        self.assertEqual(self.found('cf.Напряжение__gte=300'), {self.motor.pk})
+        self.assertEqual(self.found('cf.Напряжение__lt=1000'), {self.motor.pk, self.pump.pk})
+        self.assertEqual(self.found('cf.Напряжение__gt=30&cf.Производитель=Siemens'), {self.pump.pk})
+
+    def test_exact_and_in_match_numbers_and_strings(self):
+        number = create_passport(self.user, serial_number='SN-4', custom_fields={'Напряжение': 220})
+        self.assertEqual(self.found('cf.Напряжение=220'), {self.pump.pk, number.pk})
+        self.assertEqual(self.found('cf.Напряжение=380'), {self.motor.pk})
+        self.assertEqual(self.found('cf.Напряжение__in=220,380'), {self.motor.pk, self.pump.pk, number.pk})
+
+    def test_only_real_numbers_compare_as_numbers(self):
+        for number, value in enumerate(['-', 'e', '+', '1-2', '.5', '1e', '-1.5e3']):
+            create_passport(self.user, serial_number=f'SN-x{number}', custom_fields={'Ток': value})
+        found = filter_custom_fields(EquipmentPassport.objects.all(), QueryDict('cf.Ток__gte=-10000'))
+        self.assertEqual([passport.custom_fields['Ток'] for passport in found], ['-1.5e3'])
+
+    @override_settings(PASSPORT_CUSTOM_FIELD_INDEXES={'passport': {'Напряжение': 'number'}})
+    def test_declared_number_field(self):
+        self.assertEqual(self.found('cf.Напряжение__in=220,380'), {self.motor.pk, self.pump.pk})
+        with self.assertRaises(CustomFieldFilterError):
+            self.found('cf.Напряжение=много')
+
+    def test_invalid_key(self):
+        with self.assertRaises(CustomFieldFilterError):
+            self.found("cf.x')--=1")
+
+    @override_settings(PASSPORT_CUSTOM_FIELD_INDEXES={'passport': {'Напряжение': 'number'}})
+    def test_declared_index_is_used(self):
+        call_command('sync_custom_field_indexes', stdout=io.StringIO())
+        queryset = filter_custom_fields(EquipmentPassport.objects.order_by(), QueryDict('cf.Напряжение__gte=1'))
+        self.assertIn(index_name('passport', 'Напряжение', 'number'), queryset.explain())
+
+        out = io.StringIO()
+        with override_settings(PASSPORT_CUSTOM_FIELD_INDEXES={}):
+            call_command('sync_custom_field_indexes', stdout=out)
+        self.assertIn(f'DROP INDEX "{index_name("passport", "Напряжение", "number")}"', out.getvalue())
+
+    def test_api_lists(self):
+        create_work(self.motor, custom_fields={'Исполнитель': 'Подрядчик'})
+        create_work(self.pump)
+        self.client.force_login(self.user)
+
+        response = self.client.get('/passports/api/passports/?cf.Производитель=ABB')
+        self.assertEqual([item['id'] for item in response.json()['results']], [str(self.motor.pk)])
+        response = self.client.get('/passports/api/maintenance-works/?cf.Исполнитель__startswith=Подр')
+        self.assertEqual([item['passport'] for item in response.json()['results']], [str(self.motor.pk)])
+        response = self.client.get('/passports/api/passports/?cf.Напряжение__gte=abc&cf.x;=1')
+        self.assertEqual(response.status_code, 400)
+
+
+def _image(file_format, color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (800, 600), color).save(buffer, file_format)
+    return ContentFile(buffer.getvalue())
+
+
+@override_settings(MEDIA_ROOT=PASSPORTS_DIR, PASSPORT_THUMBNAIL_ASYNC=False)
+class ThumbnailTests(PassportTestCase):
+    def test_names_do_not_collide(self):
+        names = {
+            thumbnail_name('equipment_photos/pump.png', 'small'),
+            thumbnail_name('equipment_photos/pump.jpg', 'small'),
+            thumbnail_name('equipment_photos/pump.small.jpg', 'small'),
+            'equipment_photos/pump.small.jpg',
+        }
+        self.assertEqual(len(names), 4)
+
+    def test_each_photo_gets_its_own_thumbnail(self):
+        passports = EquipmentPassport.objects.filter(pk__in=generate_fleet([self.user, self.other], 2, 0))
+        red, blue = passports
+        red.photo.save('pump.png', _image('PNG', (255, 0, 0)), save=False)
+        blue.photo.save('pump.jpg', _image('JPEG', (0, 0, 255)), save=False)
+
+        for passport, expected in ((red, (255, 0, 0)), (blue, (0, 0, 255))):
+            generate_thumbnails(passport.photo)
+            with passport.photo.storage.open(thumbnail_name(passport.photo.name, 'small'), 'rb') as f:
+                pixel = Image.open(f).convert('RGB').getpixel((10, 10))
+            self.assertTrue(all(abs(a - b) < 16 for a, b in zip(pixel, expected)), (passport.photo.name, pixel))
+
+    @override_settings(PASSPORT_THUMBNAIL_SIZES={'preview': (320, 320)})
+    def test_page_uses_configured_size(self):
+        passport = EquipmentPassport.objects.get(pk=generate_fleet([self.user], 1, 0)[0])
+        passport.photo.save('pump.png', _image('PNG', (0, 255, 0)))
+        self.client.force_login(self.user)
+        response = self.client.get(f'/passports/view/{passport.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/preview/', response.context['photo_thumbnail_url'])
+
+
+class AsyncViewTests(PassportTestCase):
+    def setUp(self):
+        self.passport = create_passport(self.user)
+        create_work(self.passport)
+        save_passport_to_file(self.passport)
+        self.foreign = create_passport(self.other, serial_number='SN-2')
+
+    async def get(self, url, user=None):
+        if user is not None:
+            await self.async_client.aforce_login(user)
+        return await self.async_client.get(f'/passports/api/async/passports/{url}')
+
+    async def test_list_streams_visible_passports(self):
+        response = await self.get('', self.user)
+        self.assertTrue(response.streaming)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual([row['id'] for row in json.loads(content)], [str(self.passport.pk)])
+
+        response = await self.get('', self.admin)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(json.loads(content)), 2)
+
+    async def test_detail_and_file_data(self):
+        response = await self.get(f'{self.passport.pk}/', self.user)
+        self.assertEqual(len(response.json()['maintenance_works']), 1)
+
+        response = await self.get(f'{self.passport.pk}/file_data/')
+        self.assertEqual(response.json()['id'], str(self.passport.pk))
+
+        response = await self.get(f'{self.foreign.pk}/file_data/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_history_pages(self):
+        for number in range(3):
+            await sync_to_async(add_passport_history_entry)(self.passport, self.user, [f'field{number}'])
+
+        with override_settings(PASSPORT_HISTORY_PAGE_SIZE=2):
+            data = (await self.get(f'{self.passport.pk}/history/', self.user)).json()
+            self.assertEqual(len(data['results']), 2)
+            self.assertTrue(data['has_older'])
+            data = (await self.get(f'{self.passport.pk}/history/?page=2')).json()
+            self.assertEqual([entry['changed_fields'] for entry in data['results']], [['field0']])
+
+    async def test_anonymous_is_rejected(self):
+        response = await self.get('')
+        self.assertEqual(response.status_code, 401)
+
+
+class ConditionalGetTests(PassportTestCase):
+    def setUp(self):
+        self.passport_id = generate_fleet([self.user], 1, 1)[0]
+        # Изменение в прошлом - Last-Modified отдается
+        EquipmentPassport.objects.filter(pk=self.passport_id).update(
+            updated_at=timezone.now() - datetime.timedelta(days=1),
+            works_changed_at=timezone.now() - datetime.timedelta(days=1),
+        )
+        self.client.force_login(self.user)
+        self.url = f'/passports/api/passports/{self.passport_id}/'
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_work_change_invalidates(self):
+        etag = self.client.get(self.url)['ETag']
+        MaintenanceWork.objects.create(
+            passport_id=self.passport_id, work_type='repair', work_date=datetime.date(2024, 1, 1),
+            responsible_person='Иванов', created_by=self.user,
+        )
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_query_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url + '?fields=id,name', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_no_last_modified_for_change_in_current_second(self):
+        EquipmentPassport.objects.filter(pk=self.passport_id).update(updated_at=timezone.now())
+        response = self.client.get(self.url)
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+        last_second = http_date(time.time())
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_second)
+        self.assertEqual(response.status_code, 200)
+
+
+class ChangeFeedTests(PassportTestCase):
+    def changes(self, since=None):
+        url = '/passports/api/changes/' if since is None else f'/passports/api/changes/?since={since}'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_created_passports_and_works(self):
+        generate_fleet([self.other], 1, 0)
+        self.client.force_login(self.user)
+        token = self.changes()['token']
+
+        generate_fleet([self.user, self.other], 4, 2)
+        result = self.changes(token)
+
+        self.assertEqual(len(result['passports']['created']), 2)
+        self.assertEqual(len(result['works']['created']), 4)
+        self.assertFalse(result['has_more'])
+        self.assertEqual(self.changes(result['token'])['passports']['created'], [])
+
+    def test_event_committed_during_request_is_not_skipped(self):
+        generate_fleet([self.user], 1, 0)
+        self.client.force_login(self.user)
+        token = self.changes()['token']
+        real_current_token = changes.current_token
+        created = []
+
+        def write_then_current_token():
+            # Запись фиксируется, пока запрос работает с журналом
+            created.extend(generate_fleet([self.user], 1, 0, seed=1))
+            return real_current_token()
+
+        with mock.patch.object(changes, 'current_token', write_then_current_token):
+            first = self.changes(token)
+        second = self.changes(first['token'])
+
+        seen = [passport['id'] for passport in first['passports']['created'] + second['passports']['created']]
+        self.assertEqual(seen, [str(created[0])])
+
+    def test_expired_token(self):
+        generate_fleet([self.user], 1, 0)
+        self.client.force_login(self.user)
+        latest = self.changes()['token']
+        self.assertEqual(self.client.get(f'/passports/api/changes/?since={latest + 100}').status_code, 410)
+        self.assertEqual(self.client.get('/passports/api/changes/?since=abc').status_code, 400)
+
+    def test_deleted_passport_tombstone(self):
+        generate_fleet([self.user], 2, 1)
+        self.client.force_login(self.user)
+        token = self.changes()['token']
+        passport = EquipmentPassport.objects.filter(created_by=self.user).first()
+        passport_id = str(passport.id)
+        passport.delete()
+
+        result = self.changes(token)
+        self.assertEqual(result['passports']['deleted'], [passport_id])
+        self.assertEqual(result['works']['deleted'], [])
+
+
+class ScopingTests(PassportTestCase):
+    def setUp(self):
+        generate_fleet([self.user, self.other], 4, 1)
+        self.mine = EquipmentPassport.objects.filter(created_by=self.user).first()
+        self.foreign = EquipmentPassport.objects.filter(created_by=self.other).first()
+        self.group = Group.objects.create(name=ADMIN_GROUP)
+        # Роли кэшируются и в памяти процесса - записи прежних тестов не нужны
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def reload(self, user):
+        # Новый объект, как request.user в следующем запросе
+        return User.objects.get(pk=user.pk)
+
+    def test_owner_sees_only_own_passports(self):
+        self.assertEqual(set(scope_passports(self.user).values_list('created_by', flat=True)), {self.user.pk})
+        self.assertEqual(scope_works(self.user).exclude(passport__created_by=self.user).count(), 0)
+        self.assertEqual(scope_passports(self.admin).count(), 4)
+        self.assertEqual(scope_passports(AnonymousUser()).count(), 0)
+
+    def test_foreign_passport_is_hidden(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(f'/passports/view/{self.foreign.pk}/').status_code, 403)
+        self.assertEqual(self.client.get(f'/passports/api/passports/{self.foreign.pk}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/passports/api/passports/{self.mine.pk}/').status_code, 200)
+
+        data = {'work_type': 'repair', 'work_date': '2024-01-01', 'responsible_person': 'Иванов'}
+        response = self.client.post('/passports/api/maintenance-works/', {'passport': str(self.foreign.pk), **data})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post('/passports/api/maintenance-works/', {'passport': str(self.mine.pk), **data})
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_admin_group(self):
+        self.assertFalse(is_admin(self.reload(self.user)))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group)
+        self.assertTrue(is_admin(self.reload(self.user)))
+        self.assertEqual(scope_passports(self.reload(self.user)).count(), 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.name = 'Другие'
+            self.group.save()
+        self.assertFalse(is_admin(self.reload(self.user)))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                           'LOCATION': os.path.join(PASSPORTS_DIR, 'cache')}})
+    def test_role_cache_is_shared_and_reset(self):
+        is_admin(self.reload(self.user))
+        user = self.reload(self.user)
+        with self.assertNumQueries(0):
+            self.assertFalse(is_admin(user))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group)
+        self.assertTrue(is_admin(self.reload(self.user)))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.user_set.remove(self.user)
+        self.assertFalse(is_admin(self.reload(self.user)))
+
+    def test_role_is_cached_in_process_memory_too(self):
+        is_admin(self.reload(self.user))
+        user = self.reload(self.user)
+        with self.assertNumQueries(0):
+            self.assertFalse(is_admin(user))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group)
+        self.assertTrue(is_admin(self.reload(self.user)))
+
+
+class ListCacheTests(PassportTestCase):
+    def setUp(self):
+        cache.clear()
+        generate_fleet([self.user, self.other], 4, 0)
+        self.passport = EquipmentPassport.objects.filter(created_by=self.user).first()
+
+    def page(self, user):
+        """(HTML страницы, взята ли таблица из кэша)"""
+        self.client.force_login(user)
+        hits = list_cache.stats.hits
+        response = self.client.get('/passports/list/')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode(), list_cache.stats.hits > hits
+
+    def test_repeated_page_is_cached(self):
+        self.assertFalse(self.page(self.user)[1])
+        self.assertTrue(self.page(self.user)[1])
+        with override_settings(PASSPORT_LIST_CACHE_TIMEOUT=0):
+            self.assertFalse(self.page(self.user)[1])
+
+    def test_owner_change_resets_owner_and_admin_pages(self):
+        for user in (self.user, self.other, self.admin):
+            self.page(user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.passport.name = 'Переименованный насос'
+            self.passport.save()
+
+        html, cached = self.page(self.user)
+        self.assertFalse(cached)
+        self.assertIn('Переименованный насос', html)
+        html, cached = self.page(self.admin)
+        self.assertFalse(cached)
+        self.assertIn('Переименованный насос', html)
+        self.assertTrue(self.page(self.other)[1])
+
+    def test_owner_transfer_resets_both_owners(self):
+        self.assertIn(str(self.passport.pk), self.page(self.user)[0])
+        self.page(self.other)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.passport.created_by = self.other
+            self.passport.save()
+
+        html, cached = self.page(self.user)
+        self.assertFalse(cached)
+        self.assertNotIn(str(self.passport.pk), html)
+        html, cached = self.page(self.other)
+        self.assertFalse(cached)
+        self.assertIn(str(self.passport.pk), html)
+
+    def test_work_change_resets_pages(self):
+        self.page(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            MaintenanceWork.objects.create(
+                passport=self.passport, work_type='repair', work_date=datetime.date(2024, 1, 1),
+                responsible_person='Иванов', created_by=self.user,
+            )
+        self.assertFalse(self.page(self.user)[1])
+
+    def test_bulk_delete_resets_pages(self):
+        self.assertIn(str(self.passport.pk), self.page(self.user)[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_delete_passports(EquipmentPassport.objects.filter(pk=self.passport.pk))
+        html, cached = self.page(self.user)
+        self.assertFalse(cached)
+        self.assertNotIn(str(self.passport.pk), html)
@@ -0,0 +1,178 @@
+"""Уменьшенные копии фото оборудования.
+
+Размеры задаются настройкой PASSPORT_THUMBNAIL_SIZES. Копии в JPEG хранятся
+в том же хранилище в отдельной папке, а имя копии содержит полное имя
+оригинала: equipment_photos/pump.png -> thumbnails/equipment_photos/pump.png.small.jpg.
+Поэтому копии разных фото и загруженные файлы не совпадают по имени, даже
+если фото отличаются только расширением. Копии создаются в пуле потоков после
+фиксации транзакции, в которой загружено фото, а если их еще нет - при
+первом запросе. Имя загруженного файла Django делает уникальным, поэтому
+копия не меняется и может долго храниться в кэше браузера.
+"""
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.urls import reverse
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+# Фото, копии которых создаются сейчас: {имя фото: Future}
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def thumbnail_sizes():
+    return settings.PASSPORT_THUMBNAIL_SIZES
+
+
+THUMBNAIL_DIR = 'thumbnails'
+
+
+def largest_size():
+    """Наибольший из настроенных размеров копий или None, если копии отключены"""
+    dimensions = thumbnail_sizes()
+    if not dimensions:
+        return None
+    return max(dimensions, key=lambda size: dimensions[size][0] * dimensions[size][1])
+
+
+def thumbnail_name(photo_name, size):
+    """Имя копии размера size для файла фото photo_name"""
+    # Фото загружаются в upload_to поля, копии - в свою папку
+    return f'{THUMBNAIL_DIR}/{photo_name}.{size}.jpg'
+
+
+def photo_version(photo_name):
+    """Короткий хэш имени фото - меняется вместе с фото"""
+    return hashlib.sha1(photo_name.encode()).hexdigest()[:12]
+
+
+def thumbnail_url(passport, size):
+    """Адрес копии фото паспорта; содержит версию фото для кэша браузера"""
+    url = reverse('passports:passport_thumbnail', args=[passport.pk, size])
+    return f'{url}?v={photo_version(passport.photo.name)}'
+
+
+def _to_rgb(image):
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # Прозрачный фон - белый, как на странице
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def generate_thumbnails(photo, sizes=None):
+    """Создает недостающие копии фото photo (FieldFile); возвращает созданные имена
+
+    Оригинал декодируется один раз: копии уменьшаются от большей к меньшей.
+    Ошибки чтения изображения записываются в журнал, копии тогда не создаются.
+    """
+    storage = photo.storage
+    dimensions = thumbnail_sizes()
+    missing = [size for size in (sizes or dimensions) if not storage.exists(thumbnail_name(photo.name, size))]
+    if not missing:
+        return []
+    missing.sort(key=lambda size: dimensions[size][0] * dimensions[size][1], reverse=True)
+
+    try:
+        with storage.open(photo.name, 'rb') as source:
+            image = Image.open(source)
+            # JPEG декодируется сразу в уменьшенном масштабе, не меньше
+            # наибольшей копии при любом повороте по EXIF
+            largest = max(dimensions[missing[0]])
+            image.draft('RGB', (largest, largest))
+            image = _to_rgb(ImageOps.exif_transpose(image))
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+        logger.warning('Не удалось прочитать фото %s: %s', photo.name, e)
+        return []
+
+    created = []
+    for size in missing:
+        image.thumbnail(dimensions[size], Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=settings.PASSPORT_THUMBNAIL_QUALITY, optimize=True, progressive=True)
+        name = thumbnail_name(photo.name, size)
+        # Копию мог успеть создать параллельный запрос - не плодим дубликаты
+        if not storage.exists(name):
+            created.append(storage.save(name, ContentFile(buffer.getvalue())))
+    return created
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PASSPORT_THUMBNAIL_WORKERS, thread_name_prefix='passport-thumbnails'
+            )
+        return _executor
+
+
+def _run(photo):
+    try:
+        return generate_thumbnails(photo)
+    finally:
+        with _pending_lock:
+            _pending.pop(photo.name, None)
+
+
+def submit_thumbnails(photo):
+    """Ставит создание копий фото в пул потоков; одно фото - одна задача"""
+    executor = _get_executor()
+    with _pending_lock:
+        future = _pending.get(photo.name)
+        if future is None:
+            # Задача уберет себя из _pending только после выхода из блокировки
+            future = _pending[photo.name] = executor.submit(_run, photo)
+    return future
+
+
+def schedule_thumbnails(passport):
+    """Планирует создание копий фото паспорта после фиксации транзакции"""
+    photo = passport.photo
+
+    def dispatch():
+        future = submit_thumbnails(photo)
+        if not settings.PASSPORT_THUMBNAIL_ASYNC:
+            future.result()
+
+    transaction.on_commit(dispatch)
+
+
+def get_thumbnail(photo, size, timeout=None):
+    """Имя копии размера size; создает ее при необходимости
+
+    Возвращает None, если копию создать не удалось.
+    """
+    name = thumbnail_name(photo.name, size)
+    if photo.storage.exists(name):
+        return name
+
+    submit_thumbnails(photo).result(timeout=timeout)
+    return name if photo.storage.exists(name) else None
+
+
+def delete_photos(storage, photo_names):
+    """Удаляет фото photo_names и их копии; возвращает (удалено файлов, ошибок)"""
+    deleted = errors = 0
+    for photo_name in photo_names:
+        for name in [photo_name] + [thumbnail_name(photo_name, size) for size in thumbnail_sizes()]:
+            try:
+                if storage.exists(name):
+                    storage.delete(name)
+                    deleted += 1
+            except OSError as e:
+                errors += 1
+                logger.warning('Не удалось удалить файл фото %s: %s', name, e)
+    return deleted, errors
@@ -1,7 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
-from .api_views import EquipmentPassportViewSet, MaintenanceWorkViewSet
+from . import views, async_views
+from .api_views import EquipmentPassportViewSet, MaintenanceWorkViewSet, service_metrics, analytics_index, \
+    analytics_report, changes_feed
 
 app_name = 'passports'
 
@@ -20,5 +21,15 @@ urlpatterns = [
     path('add-work/<uuid:pk>/', views.add_maintenance_work, name='add_work'),
     path('works/<uuid:pk>/', views.maintenance_work_list, name='work_list'),
     path('history/<uuid:pk>/', views.passport_history, name='passport_history'),
+    path('thumbnail/<uuid:pk>/<slug:size>/', views.passport_thumbnail, name='passport_thumbnail'),
+    path('api/metrics/', service_metrics, name='service_metrics'),
+    # Асинхронные представления чтения для ASGI
+    path('api/async/passports/', async_views.passport_list, name='async_passport_list'),
+    path('api/async/passports/<uuid:pk>/', async_views.passport_detail, name='async_passport_detail'),
+    path('api/async/passports/<uuid:pk>/file_data/', async_views.passport_file_data, name='async_passport_file_data'),
+    path('api/async/passports/<uuid:pk>/history/', async_views.passport_history, name='async_passport_history'),
+    path('api/analytics/', analytics_index, name='analytics_index'),
+    path('api/analytics/<slug:report>/', analytics_report, name='analytics_report'),
+    path('api/changes/', changes_feed, name='changes_feed'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -2,14 +2,353 @@ import json
 import yaml
 import os
 import shutil
+import threading
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from django.conf import settings
 from datetime import datetime
 
+from .file_cache import get_file_cache
+from .formats import dumps_passport, loads_passport, PassportFileFormatError
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# Суффиксы файлов зеркала паспорта: снимок, журнал работ, история и история старого формата
+PASSPORT_FILE_SUFFIXES = ('_works.jsonl', '_history.jsonl', '_history.json', '.json')
+
+# Временные файлы атомарной записи: .<имя файла>.<случайная часть>.tmp
+TEMP_FILE_SUFFIX = '.tmp'
+
+
+# Наибольшее число уровней разбиения: пары символов UUID до первого дефиса
+MAX_SHARD_LEVELS = 4
+
+
+def _shard_dir(passport_id, levels):
+    passport_id = str(passport_id)
+    return os.path.join(settings.PASSPORTS_DIR, *(passport_id[level * 2:level * 2 + 2] for level in range(levels)))
+
+
+def get_passport_dir(passport_id):
+    """Возвращает папку файлов паспорта с учетом разбиения на подпапки
+
+    При PASSPORT_SHARD_LEVELS = N файлы лежат в N вложенных подпапках
+    по парам первых символов UUID: 3f/2a/3f2a....json.
+    """
+    return _shard_dir(passport_id, settings.PASSPORT_SHARD_LEVELS)
+
+
+def _other_shard_dirs(passport_id):
+    """Папки паспорта при прежних значениях PASSPORT_SHARD_LEVELS
+
+    Пока идет перенос, там лежат еще не перенесенные файлы. Вне переноса
+    список пуст, и поиск файла обходится без лишних обращений к диску.
+    """
+    levels = settings.PASSPORT_SHARD_LEVELS
+    return [_shard_dir(passport_id, depth) for depth in settings.PASSPORT_SHARD_PREVIOUS_LEVELS
+            if depth != levels and 0 <= depth <= MAX_SHARD_LEVELS]
+
+
+def _resolve_path(passport_id, suffix):
+    """Путь к файлу в папке текущего разбиения, а во время переноса - в папке прежнего, где он есть"""
+    filename = f"{passport_id}{suffix}"
+    path = os.path.join(get_passport_dir(passport_id), filename)
+    other_dirs = _other_shard_dirs(passport_id)
+    if other_dirs and not os.path.exists(path):
+        for directory in other_dirs:
+            old_path = os.path.join(directory, filename)
+            if os.path.exists(old_path):
+                return old_path
+    return path
+
+
+def get_passport_file_path(passport_id):
+    """Возвращает путь к файлу снимка паспорта"""
+    return _resolve_path(passport_id, '.json')
+
+
+def get_works_log_path(passport_id):
+    """Возвращает путь к журналу работ паспорта"""
+    return _resolve_path(passport_id, '_works.jsonl')
+
+
+def get_history_file_path(passport_id):
+    """Возвращает путь к журналу истории паспорта (JSON Lines)"""
+    return _resolve_path(passport_id, '_history.jsonl')
+
+
+def get_legacy_history_file_path(passport_id):
+    """Возвращает путь к файлу истории в старом формате (JSON-массив)"""
+    return _resolve_path(passport_id, '_history.json')
+
+
+# Пути ко всем файлам паспорта, найденные один раз на запрос
+PassportPaths = namedtuple('PassportPaths', ['snapshot', 'works_log', 'history', 'legacy_history'])
+
+
+def resolve_passport_paths(passport_id):
+    """Находит пути к файлам паспорта
+
+    Представление вызывает ее один раз и передает результат в проверку
+    валидаторов и в чтение файлов, чтобы не искать файлы повторно.
+    """
+    return PassportPaths(
+        get_passport_file_path(passport_id),
+        get_works_log_path(passport_id),
+        get_history_file_path(passport_id),
+        get_legacy_history_file_path(passport_id),
+    )
+
+
+def passport_id_from_filename(filename):
+    """Извлекает UUID паспорта из имени файла зеркала"""
+    for suffix in PASSPORT_FILE_SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return None
+
+
+def is_shard_dir(name):
+    """Имя подпапки разбиения: две шестнадцатеричные цифры"""
+    return len(name) == 2 and all(char in '0123456789abcdef' for char in name)
+
+
+def _iter_mirror_entries(directory):
+    """Отдает записи (os.DirEntry) папки зеркала, обходя подпапки разбиения потоково"""
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return
+
+    with entries:
+        for entry in entries:
+            if is_shard_dir(entry.name) and entry.is_dir(follow_symlinks=False):
+                yield from _iter_mirror_entries(entry.path)
+            else:
+                yield entry
+
+
+def iter_mirror_files(directory=None):
+    """Отдает (UUID паспорта, путь) для файлов зеркала, обходя подпапки потоково"""
+    for entry in _iter_mirror_entries(directory or settings.PASSPORTS_DIR):
+        file_id = passport_id_from_filename(entry.name)
+        if not file_id or not entry.is_file(follow_symlinks=False):
+            continue
+        try:
+            passport_id = uuid.UUID(file_id)
+        except ValueError:
+            # Посторонний файл с подходящим суффиксом
+            continue
+        yield passport_id, entry.path
+
+
+def is_temp_file(name):
+    """Временный файл атомарной записи (_write_file_atomic)"""
+    return name.startswith('.') and name.endswith(TEMP_FILE_SUFFIX)
 
-def save_passport_to_file(passport_instance):
-    """Сохраняет паспорт в файл"""
-    file_path = passport_instance.get_passport_file_path()
 
+def iter_temp_files(directory=None):
+    """Отдает os.DirEntry временных файлов записи, оставшихся в папке зеркала"""
+    for entry in _iter_mirror_entries(directory or settings.PASSPORTS_DIR):
+        if is_temp_file(entry.name) and entry.is_file(follow_symlinks=False):
+            yield entry
+
+
+def move_passport_file(path, target_path):
+    """Переносит файл, не затирая существующий
+
+    Если файл на новом месте уже есть, он записан позже переносимого,
+    поэтому старая копия просто удаляется. Возвращает True, если файл перенесен.
+    """
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    moved = False
+    try:
+        os.link(path, target_path)
+        moved = True
+    except FileExistsError:
+        pass
+    except FileNotFoundError:
+        # Файл уже перенес другой процесс
+        return False
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    return moved
+
+
+def _migrate_shard_files(passport_id):
+    """Переносит файлы паспорта из папок прежнего разбиения в текущую перед записью"""
+    passport_dir = get_passport_dir(passport_id)
+    for directory in _other_shard_dirs(passport_id):
+        if not os.path.isdir(directory):
+            continue
+        for suffix in PASSPORT_FILE_SUFFIXES:
+            filename = f"{passport_id}{suffix}"
+            old_path = os.path.join(directory, filename)
+            if os.path.exists(old_path):
+                move_passport_file(old_path, os.path.join(passport_dir, filename))
+
+
+# Файлы, fsync которых отложен до конца текущей пачки записи (режим 'batch')
+_durable_batch = threading.local()
+
+
+@contextmanager
+def durable_batch():
+    """Пачка записей: при PASSPORT_FILE_DURABILITY = 'batch' fsync выполняется один раз в конце
+
+    Вне пачки режим 'batch' синхронизирует каждую запись сразу, как 'always'.
+    """
+    if getattr(_durable_batch, 'paths', None) is not None:
+        # Вложенная пачка сливается с внешней
+        yield
+        return
+
+    _durable_batch.paths = set()
+    try:
+        yield
+    finally:
+        paths, _durable_batch.paths = _durable_batch.paths, None
+        _fsync_paths(paths)
+
+
+def _sync_mode():
+    """'now' - fsync сразу, 'defer' - в конце пачки, None - без fsync"""
+    durability = settings.PASSPORT_FILE_DURABILITY
+    if durability == 'none':
+        return None
+    if durability == 'batch' and getattr(_durable_batch, 'paths', None) is not None:
+        return 'defer'
+    return 'now'
+
+
+def _fsync_dir(directory):
+    """Сохраняет на диск запись каталога (создание и переименование файлов)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        # Windows не позволяет открыть каталог
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _fsync_paths(paths):
+    directories = set()
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            # Файл удален или заменен после записи
+            continue
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        directories.add(os.path.dirname(path))
+
+    for directory in directories:
+        _fsync_dir(directory)
+
+
+def _sync_written_file(f, path, created):
+    """fsync записанного файла согласно PASSPORT_FILE_DURABILITY"""
+    f.flush()
+    mode = _sync_mode()
+    if mode == 'now':
+        os.fsync(f.fileno())
+        if created:
+            _fsync_dir(os.path.dirname(path))
+    elif mode == 'defer':
+        _durable_batch.paths.add(path)
+
+
+def _write_file_atomic(path, data):
+    """Записывает байты data в файл через временный файл и os.replace
+
+    Читатель всегда видит либо прежнее, либо новое содержимое целиком,
+    а сбой во время записи оставляет только временный файл - его удаляет
+    очистка зеркала (cleanup_orphaned_files).
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, f".{os.path.basename(path)}.{uuid.uuid4().hex}{TEMP_FILE_SUFFIX}")
+    mode = _sync_mode()
+
+    try:
+        with open(temp_path, 'xb') as f:
+            f.write(data)
+            if mode == 'now':
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+    if mode == 'now':
+        _fsync_dir(directory)
+    elif mode == 'defer':
+        _durable_batch.paths.add(path)
+
+
+def _open_log_for_append(path):
+    """Открывает журнал (JSON Lines) на дозапись в двоичном режиме"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open(path, 'a+b')
+
+
+def _terminate_partial_line(f):
+    """Закрывает строку, недописанную при сбое, чтобы новая запись не склеилась с ней
+
+    Вызывается под блокировкой файла. Возвращает True, если файл был пуст.
+    """
+    size = f.seek(0, os.SEEK_END)
+    if size == 0:
+        return True
+    f.seek(size - 1)
+    if f.read(1) != b'\n':
+        f.write(b'\n')
+    return False
+
+
+def _jsonl(record):
+    return (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def serialize_maintenance_work(work):
+    """Преобразует работу по обслуживанию в словарь для файла"""
+    return {
+        'id': str(work.id),
+        'work_type': work.work_type,
+        'work_date': work.work_date.isoformat(),
+        'responsible_person': work.responsible_person,
+        'description': work.description,
+        'cost': float(work.cost) if work.cost else None,
+        'materials_used': work.materials_used,
+        'created_by': work.created_by.username if work.created_by else None,
+        'created_at': work.created_at.isoformat(),
+        'custom_fields': work.custom_fields
+    }
+
+
+def serialize_passport(passport_instance):
+    """Преобразует паспорт вместе с работами в словарь для файла"""
     passport_data = {
         'id': str(passport_instance.id),
         'name': passport_instance.name,
@@ -30,97 +369,358 @@ def save_passport_to_file(passport_instance):
         'maintenance_works': []
     }
 
-    # Добавляем работы по обслуживанию
-    for work in passport_instance.maintenance_works.all():
-        work_data = {
-            'id': str(work.id),
-            'work_type': work.work_type,
-            'work_date': work.work_date.isoformat(),
-            'responsible_person': work.responsible_person,
-            'description': work.description,
-            'cost': float(work.cost) if work.cost else None,
-            'materials_used': work.materials_used,
-            'created_by': work.created_by.username if work.created_by else None,
-            'created_at': work.created_at.isoformat(),
-            'custom_fields': work.custom_fields
-        }
-        passport_data['maintenance_works'].append(work_data)
-
-    # Создаем директорию, если она не существует
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-
-    # Сохраняем в JSON
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(passport_data, f, ensure_ascii=False, indent=2)
+    # Добавляем работы по обслуживанию (используем prefetch_related, если он был)
+    if 'maintenance_works' in getattr(passport_instance, '_prefetched_objects_cache', {}):
+        works = passport_instance.maintenance_works.all()
+    else:
+        works = passport_instance.maintenance_works.select_related('created_by')
+    for work in works:
+        passport_data['maintenance_works'].append(serialize_maintenance_work(work))
+
+    return passport_data
+
+
+def _write_snapshot(passport_instance, file_path):
+    # Сохраняем в формате PASSPORT_FILE_FORMAT: новый снимок подменяет старый целиком
+    _write_file_atomic(file_path, dumps_passport(serialize_passport(passport_instance)))
+
+
+def save_passport_to_file(passport_instance):
+    """Сохраняет полный снимок паспорта в файл и сбрасывает журнал работ
+
+    Снимок собирается и записывается под блокировкой журнала (ее же берут
+    уплотнение и перекодирование): работа, которую другой поток или процесс
+    дописывает в это время, попадет в новый журнал после удаления старого,
+    а не в удаляемый файл.
+    """
+    _migrate_shard_files(passport_instance.id)
+    file_path = passport_instance.get_passport_file_path()
+    log_path = get_works_log_path(passport_instance.id)
+
+    with _locked_log(log_path):
+        _write_snapshot(passport_instance, file_path)
+        # Снимок уже содержит все работы, журнал больше не нужен
+        os.remove(log_path)
+    get_file_cache().invalidate('passport', passport_instance.id)
 
     return file_path
 
 
-def load_passport_from_file(passport_id):
-    """Загружает паспорт из файла"""
-    file_path = os.path.join(settings.PASSPORTS_DIR, f"{passport_id}.json")
+def _append_to_works_log(passport_instance, record):
+    """Дописывает запись в журнал работ, при необходимости уплотняя его в снимок"""
+    _migrate_shard_files(passport_instance.id)
+    file_path = passport_instance.get_passport_file_path()
+
+    # Без снимка журналу не к чему применяться - пишем паспорт целиком
+    if not os.path.exists(file_path):
+        return save_passport_to_file(passport_instance)
+
+    log_path = get_works_log_path(passport_instance.id)
+    with _locked_log(log_path) as f:
+        created = _terminate_partial_line(f)
+        f.write(_jsonl(record))
+        _sync_written_file(f, log_path, created)
+    get_file_cache().invalidate('passport', passport_instance.id)
+
+    # Периодическое уплотнение: журнал переписывается в снимок
+    try:
+        size = os.path.getsize(log_path)
+    except FileNotFoundError:
+        # Журнал уже уплотнен параллельно
+        size = 0
+    if size > settings.PASSPORT_WORKS_LOG_COMPACT_SIZE:
+        save_passport_to_file(passport_instance)
+
+    return file_path
+
+
+def append_work_to_file(work):
+    """Добавляет или обновляет работу в файле паспорта без перезаписи снимка"""
+    return _append_to_works_log(work.passport, {
+        'op': 'upsert',
+        'work': serialize_maintenance_work(work)
+    })
+
+
+def remove_work_from_file(passport_instance, work_id):
+    """Отмечает удаление работы в файле паспорта без перезаписи снимка"""
+    return _append_to_works_log(passport_instance, {
+        'op': 'delete',
+        'id': str(work_id)
+    })
+
+
+def _apply_works_log(passport_data, log_path):
+    """Накладывает журнал работ на снимок паспорта"""
+    works = {work['id']: work for work in passport_data.get('maintenance_works', [])}
+
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Недописанная последняя строка после сбоя
+                continue
+            if record.get('op') == 'upsert':
+                works[record['work']['id']] = record['work']
+            elif record.get('op') == 'delete':
+                works.pop(record['id'], None)
+
+    # Тот же порядок, что и в снимке: по убыванию даты выполнения
+    passport_data['maintenance_works'] = sorted(
+        works.values(), key=lambda work: work['work_date'], reverse=True
+    )
+    return passport_data
+
+
+def load_passport_from_file(passport_id, paths=None):
+    """Загружает паспорт из файла; разобранный файл берется из кэша, пока файл не изменился
+
+    paths - пути из resolve_passport_paths, если представление уже их нашло.
+    """
+    paths = paths or resolve_passport_paths(passport_id)
+    return get_file_cache().get_or_load(
+        'passport', passport_id, (paths.snapshot, paths.works_log), lambda: _read_passport_file(passport_id, paths)
+    )
+
+
+def _read_passport_file(passport_id, paths=None):
+    paths = paths or resolve_passport_paths(passport_id)
+    file_path = paths.snapshot
 
     if not os.path.exists(file_path):
         return None
 
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
+        with open(file_path, 'rb') as f:
+            passport_data = loads_passport(f.read())
+    except (PassportFileFormatError, FileNotFoundError):
         return None
 
+    log_path = paths.works_log
+    if os.path.exists(log_path):
+        try:
+            passport_data = _apply_works_log(passport_data, log_path)
+        except FileNotFoundError:
+            # Журнал уплотнен параллельно - снимок уже актуален; пути ищем заново,
+            # файлы могли и переехать в папку текущего разбиения
+            return _read_passport_file(passport_id)
 
-def delete_passport_file(passport_id):
-    """Удаляет файл паспорта"""
-    file_path = os.path.join(settings.PASSPORTS_DIR, f"{passport_id}.json")
-    history_file = os.path.join(settings.PASSPORTS_DIR, f"{passport_id}_history.json")
+    return passport_data
 
-    deleted_files = 0
 
-    if os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-            deleted_files += 1
-        except OSError:
-            pass
+def _encode_snapshot(path, file_format):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    return raw, dumps_passport(loads_passport(raw), file_format)
 
-    if os.path.exists(history_file):
+
+def convert_passport_file(path, file_format, dry_run=False):
+    """Перекодирует файл снимка в формат file_format
+
+    Возвращает (размер до, размер после) или None, если файл уже в этом
+    формате; с dry_run только считает размеры. Снимок читается и
+    перезаписывается под блокировкой журнала работ, как при сохранении
+    и уплотнении, поэтому параллельная запись не теряется.
+    """
+    if dry_run:
+        raw, data = _encode_snapshot(path, file_format)
+        return None if data == raw else (len(raw), len(data))
+
+    passport_id = passport_id_from_filename(os.path.basename(path))
+    log_path = os.path.join(os.path.dirname(path), f"{passport_id}_works.jsonl")
+    with _locked_log(log_path) as log:
         try:
-            os.remove(history_file)
-            deleted_files += 1
-        except OSError:
-            pass
+            raw, data = _encode_snapshot(path, file_format)
+            if data == raw:
+                return None
+            _write_file_atomic(path, data)
+        finally:
+            # Пустой журнал создан только ради блокировки
+            if os.fstat(log.fileno()).st_size == 0:
+                os.remove(log_path)
+
+    get_file_cache().invalidate('passport', passport_id)
+    return len(raw), len(data)
+
+
+def delete_passport_file(passport_id):
+    """Удаляет файлы паспорта - и в текущей подпапке, и еще не перенесенные из прежних"""
+    deleted_files = 0
 
+    for suffix in PASSPORT_FILE_SUFFIXES:
+        filename = f"{passport_id}{suffix}"
+        directories = [get_passport_dir(passport_id)] + _other_shard_dirs(passport_id)
+        for path in (os.path.join(directory, filename) for directory in directories):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            # Удаление считается успешным, если был файл снимка или истории
+            if suffix in ('.json', '_history.jsonl'):
+                deleted_files += 1
+
+    get_file_cache().invalidate('passport', passport_id)
+    get_file_cache().invalidate('history', passport_id)
     return deleted_files > 0
 
 
-def delete_multiple_passport_files(passport_ids):
-    """Удаляет файлы нескольких паспортов"""
-    success_count = 0
-    error_count = 0
+def delete_multiple_passport_files(passport_ids, workers=8):
+    """Удаляет файлы нескольких паспортов в пуле потоков
 
-    for passport_id in passport_ids:
-        if delete_passport_file(passport_id):
-            success_count += 1
-        else:
-            error_count += 1
+    Возвращает (паспортов с удаленными файлами, паспортов без файлов).
+    """
+    passport_ids = list(passport_ids)
+    if len(passport_ids) <= 1 or workers <= 1:
+        results = [delete_passport_file(passport_id) for passport_id in passport_ids]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(delete_passport_file, passport_ids))
 
-    return success_count, error_count
+    success_count = sum(results)
+    return success_count, len(results) - success_count
 
 
-def get_passport_history(passport_id):
-    """Получает историю изменений паспорта"""
-    history_file = os.path.join(settings.PASSPORTS_DIR, f"{passport_id}_history.json")
+@contextmanager
+def _file_lock(f):
+    """Эксклюзивная блокировка открытого файла между процессами"""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def _locked_log(path):
+    """Журнал, открытый на дозапись под эксклюзивной блокировкой
+
+    Уплотнение удаляет журнал под этой же блокировкой. Если файл удалили,
+    пока блокировка ожидалась, открытый файл уже не в папке - открываем
+    журнал заново.
+    """
+    while True:
+        with _open_log_for_append(path) as f:
+            with _file_lock(f):
+                try:
+                    current = os.path.samestat(os.fstat(f.fileno()), os.stat(path))
+                except FileNotFoundError:
+                    current = False
+                if current:
+                    yield f
+                    return
+
+
+def _load_legacy_history(passport_id, paths=None):
+    """Читает историю в старом формате JSON-массива"""
+    path = paths.legacy_history if paths else get_legacy_history_file_path(passport_id)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, FileNotFoundError):
+        return []
+
+
+def _parse_history_line(line):
+    """Разбирает строку журнала истории, пропуская поврежденные строки"""
+    try:
+        return json.loads(line)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+
+
+def _iter_lines_reversed(path, block_size=8192):
+    """Читает строки файла с конца блоками, не загружая файл целиком"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        tail = b''
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            lines = (f.read(read_size) + tail).split(b'\n')
+            # Первая строка блока может быть неполной - переносим ее в следующий блок
+            tail = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line
+        if tail:
+            yield tail
+
+
+def iter_passport_history(passport_id, paths=None):
+    """Потоково отдает записи истории паспорта в хронологическом порядке"""
+    paths = paths or resolve_passport_paths(passport_id)
+    yield from _load_legacy_history(passport_id, paths)
+
+    try:
+        with open(paths.history, 'r', encoding='utf-8') as f:
+            for line in f:
+                entry = _parse_history_line(line)
+                if entry is not None:
+                    yield entry
+    except FileNotFoundError:
+        return
+
+
+def iter_passport_history_reversed(passport_id, paths=None):
+    """Потоково отдает записи истории паспорта от новых к старым"""
+    paths = paths or resolve_passport_paths(passport_id)
+    history_file = paths.history
 
     if os.path.exists(history_file):
         try:
-            with open(history_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return []
-    return []
+            for line in _iter_lines_reversed(history_file):
+                entry = _parse_history_line(line)
+                if entry is not None:
+                    yield entry
+        except FileNotFoundError:
+            pass
+
+    yield from reversed(_load_legacy_history(passport_id, paths))
+
+
+def get_passport_history(passport_id, limit=None, offset=0, paths=None):
+    """Получает историю изменений паспорта
+
+    Без limit/offset возвращается вся история. С ними - страница из limit записей,
+    отсчитанная от самых новых с пропуском offset записей; записи страницы идут
+    в хронологическом порядке. Страницы кэшируются, пока файл истории не изменился.
+    paths - пути из resolve_passport_paths, если представление уже их нашло.
+    """
+    paths = paths or resolve_passport_paths(passport_id)
+    return get_file_cache().get_or_load(
+        'history', passport_id, (paths.history, paths.legacy_history),
+        lambda: _read_passport_history(passport_id, limit, offset, paths),
+        variant=(limit, offset)
+    )
 
 
+def _read_passport_history(passport_id, limit, offset, paths=None):
+    if limit is None and not offset:
+        return list(iter_passport_history(passport_id, paths))
+
+    page = []
+    for index, entry in enumerate(iter_passport_history_reversed(passport_id, paths)):
+        if index < offset:
+            continue
+        if limit is not None and len(page) >= limit:
+            break
+        page.append(entry)
+
+    page.reverse()
+    return page
+
 
 def get_changed_fields(initial_data, new_data):
     """Сравнивает начальные и новые данные, возвращает список измененных полей."""
@@ -132,55 +732,51 @@ def get_changed_fields(initial_data, new_data):
 
 
 def cleanup_orphaned_files():
-    """Очищает файлы, для которых нет соответствующих записей в базе данных"""
-    from .models import EquipmentPassport
-    import os
-
-    existing_passport_ids = set(str(passport.id) for passport in EquipmentPassport.objects.all())
-    files_in_directory = set()
-
-    if os.path.exists(settings.PASSPORTS_DIR):
-        for filename in os.listdir(settings.PASSPORTS_DIR):
-            if filename.endswith('.json'):
-                # Извлекаем UUID из имени файла
-                file_id = filename.split('.')[0]
-                if '_history' in file_id:
-                    file_id = file_id.replace('_history', '')
-                files_in_directory.add(file_id)
+    """Очищает файлы, для которых нет соответствующих записей в базе данных
 
-    orphaned_files = files_in_directory - existing_passport_ids
-    deleted_count = 0
+    Возвращает количество паспортов, файлы которых были удалены.
+    """
+    from .cleanup import find_and_remove_orphaned_files
+    return find_and_remove_orphaned_files().orphaned_passports
 
-    for orphan_id in orphaned_files:
-        if delete_passport_file(orphan_id):
-            deleted_count += 1
 
-    return deleted_count
+def make_history_entry(user, changed_fields):
+    """Запись истории изменений с моментом изменения"""
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'user': user.username,
+        'changed_fields': changed_fields
+    }
 
 
 def add_passport_history_entry(passport_instance, user, changed_fields):
     """Добавляет запись в историю изменений"""
-    history_file = os.path.join(settings.PASSPORTS_DIR, f"{passport_instance.id}_history.json")
+    append_history_entries(passport_instance.id, [make_history_entry(user, changed_fields)])
 
-    history_entry = {
-        'timestamp': datetime.now().isoformat(),
-        'user': user.username,
-        'changed_fields': changed_fields
-    }
 
-    # Загружаем существующую историю
-    history = []
-    if os.path.exists(history_file):
-        try:
-            with open(history_file, 'r', encoding='utf-8') as f:
-                history = json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            history = []
-
-    # Добавляем новую запись
-    history.append(history_entry)
-
-    # Сохраняем обновленную историю
-    os.makedirs(os.path.dirname(history_file), exist_ok=True)
-    with open(history_file, 'w', encoding='utf-8') as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
\ No newline at end of file
+def append_history_entries(passport_id, entries):
+    """Дописывает готовые записи в журнал истории паспорта под одной блокировкой"""
+    _migrate_shard_files(passport_id)
+    history_file = get_history_file_path(passport_id)
+    legacy_file = get_legacy_history_file_path(passport_id)
+
+    with _open_log_for_append(history_file) as f:
+        with _file_lock(f):
+            created = _terminate_partial_line(f)
+
+            # Переносим историю старого формата в журнал при первой записи
+            migrate_legacy = os.path.exists(legacy_file)
+            if migrate_legacy:
+                for entry in _load_legacy_history(passport_id):
+                    f.write(_jsonl(entry))
+
+            # Одна запись - одна строка, дописываемая в конец файла
+            for entry in entries:
+                f.write(_jsonl(entry))
+            _sync_written_file(f, history_file, created)
+
+            # Старый файл удаляется только после того, как записи сохранены в журнале
+            if migrate_legacy:
+                os.remove(legacy_file)
+
+    get_file_cache().invalidate('history', passport_id)
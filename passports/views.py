@@ -1,7 +1,12 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponseForbidden
+from django.conf import settings
+from django.http import JsonResponse, HttpResponseForbidden, FileResponse, Http404
+from django.utils.cache import patch_cache_control
+from django.utils.safestring import mark_safe
+from django.template.loader import render_to_string
 from django.db import models
 from django.core.paginator import Paginator
 from django.utils.dateparse import parse_date
@@ -10,14 +15,21 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from .models import EquipmentPassport, MaintenanceWork, EquipmentType
 from .forms import PassportForm, MaintenanceWorkForm, CustomFieldForm
-from .utils import save_passport_to_file, load_passport_from_file, delete_passport_file, add_passport_history_entry, \
-    get_passport_history, delete_multiple_passport_files
+from .utils import load_passport_from_file, get_passport_history, resolve_passport_paths
+from .search import filter_by_number, search_passports
+from .custom_fields import CustomFieldFilterError, filter_custom_fields
+from .mirror import schedule_history_entry, schedule_passport_save, schedule_work_save
+from .deletion import bulk_delete_passports, delete_passport_with_files, start_bulk_delete_job
+from .thumbnails import get_thumbnail, largest_size, photo_version, thumbnail_sizes, thumbnail_url
+from .conditional import not_modified, passport_file_validators, set_validators
+from .permissions import can_access_passport, is_admin, scope_label, scope_passports
+from .list_cache import get_or_render
 import json
 import uuid
 
 
-def is_admin(user):
-    return user.is_superuser or user.is_staff
+# Сколько секунд запрос ждет создания копии фото
+THUMBNAIL_TIMEOUT = 30
 
 
 @login_required
@@ -49,7 +61,7 @@ def create_passport(request):
 
             passport.save()
 
-            save_passport_to_file(passport)
+            schedule_passport_save(passport)
             messages.success(request, 'Паспорт успешно создан!')
             return redirect('passports:view_passport', pk=passport.pk)
         else:
@@ -69,28 +81,43 @@ def passport_list(request):
     status_filter = request.GET.get('status', 'all')
     sort = request.GET.get('sort', '-created_at')
     search_query = request.GET.get('q', '')
+    admin = is_admin(request.user)
+
+    # Таблица со страницами берется из кэша, запросы выполняются только при промахе
+    passport_table = get_or_render(
+        scope_label(request.user),
+        {'status': status_filter, 'sort': sort, 'q': search_query, 'page': request.GET.get('page')},
+        lambda: _render_passport_table(request, status_filter, sort, search_query, admin),
+    )
+
+    return render(request, 'passports/passport_list.html', {
+        'passport_table': mark_safe(passport_table),
+        'status_filter': status_filter,
+        'sort': sort,
+        'search_query': search_query,
+    })
 
-    if request.user.is_superuser or request.user.is_staff:
-        passports = EquipmentPassport.objects.all()
-    else:
-        passports = EquipmentPassport.objects.filter(created_by=request.user)
+
+def _render_passport_table(request, status_filter, sort, search_query, admin):
+    passports = scope_passports(request.user)
 
     if status_filter != 'all':
         passports = passports.filter(status=status_filter)
 
     if search_query:
-        passports = passports.filter(
-            models.Q(name__icontains=search_query) |
-            models.Q(serial_number__icontains=search_query) |
-            models.Q(inventory_number__icontains=search_query) |
-            models.Q(description__icontains=search_query) |
-            models.Q(location__icontains=search_query)
-        )
+        passports = search_passports(passports, search_query)
 
     if sort == 'oldest':
         passports = passports.order_by('created_at')
     elif sort == 'name':
         passports = passports.order_by('name')
+    elif sort == 'last_work':
+        passports = passports.order_by(models.F('last_work_date').desc(nulls_last=True), '-created_at')
+    elif sort == 'no_work':
+        # Давно не обслуживавшиеся первыми
+        passports = passports.order_by(models.F('last_work_date').asc(nulls_first=True), 'created_at')
+    elif sort == 'works_cost':
+        passports = passports.order_by('-works_total_cost', '-created_at')
     else:
         passports = passports.order_by('-created_at')
 
@@ -98,12 +125,13 @@ def passport_list(request):
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
 
-    return render(request, 'passports/passport_list.html', {
+    return render_to_string('passports/includes/passport_table.html', {
         'page_obj': page_obj,
         'status_filter': status_filter,
         'sort': sort,
-        'search_query': search_query
-    })
+        'search_query': search_query,
+        'is_admin': admin,
+    }, request=request)
 
 
 @login_required
@@ -116,34 +144,39 @@ def passport_search(request):
     location = request.GET.get('location', '')
     keywords = request.GET.get('keywords', '')
     status = request.GET.get('status', '')
+    exact_numbers = request.GET.get('exact_numbers') == '1'
 
-    passports = EquipmentPassport.objects.all()
-
-    if not (request.user.is_superuser or request.user.is_staff):
-        passports = passports.filter(created_by=request.user)
+    passports = scope_passports(request.user)
 
     if name:
         passports = passports.filter(name__icontains=name)
+    # Номер ищется по части; номер целиком - по индексу UPPER(номер)
     if serial_number:
-        passports = passports.filter(serial_number__icontains=serial_number)
+        if exact_numbers:
+            passports = filter_by_number(passports, 'serial_number', serial_number)
+        else:
+            passports = passports.filter(serial_number__icontains=serial_number)
     if inventory_number:
-        passports = passports.filter(inventory_number__icontains=inventory_number)
+        if exact_numbers:
+            passports = filter_by_number(passports, 'inventory_number', inventory_number)
+        else:
+            passports = passports.filter(inventory_number__icontains=inventory_number)
     if equipment_type:
         passports = passports.filter(equipment_type__name__icontains=equipment_type)
     if commissioning_date:
         passports = passports.filter(commissioning_date=commissioning_date)
     if location:
         passports = passports.filter(location__icontains=location)
-    if keywords:
-        passports = passports.filter(
-            models.Q(name__icontains=keywords) |
-            models.Q(description__icontains=keywords) |
-            models.Q(serial_number__icontains=keywords) |
-            models.Q(inventory_number__icontains=keywords) |
-            models.Q(location__icontains=keywords)
-        )
     if status:
         passports = passports.filter(status=status)
+    # Пользовательские поля: cf.<поле>__<сравнение>=<значение>
+    try:
+        passports = filter_custom_fields(passports, request.GET)
+    except CustomFieldFilterError as e:
+        messages.error(request, f'Фильтр по пользовательским полям не применен: {e}')
+    if keywords:
+        # Полнотекстовый поиск, лучшие совпадения первыми
+        passports = search_passports(passports, keywords).order_by('-search_rank')
 
     return render(request, 'passports/passport_search.html', {
         'passports': passports,
@@ -157,32 +190,83 @@ def passport_search(request):
 def view_passport(request, pk):
     passport = get_object_or_404(EquipmentPassport, pk=pk)
 
-    if not (request.user.is_superuser or request.user.is_staff or passport.created_by == request.user):
+    if not can_access_passport(request.user, passport):
         return HttpResponseForbidden("У вас нет прав для просмотра этого паспорта")
 
-    # Загружаем данные из файла
-    file_data = load_passport_from_file(passport.id)
+    # Пути к файлам ищем один раз: по ним и проверяется актуальность, и читаются файлы
+    paths = resolve_passport_paths(passport.id)
+    # Страница собирается из паспорта, его файлов и данных пользователя
+    # (меню, CSRF-токен форм). Если ничего не изменилось, отвечаем 304 без
+    # чтения файлов; при ожидающих сообщениях страницу нужно показать заново
+    etag, last_modified = passport_file_validators(
+        passport.id, request.user.pk, request.META.get('CSRF_COOKIE'),
+        history=True, modified=(passport.updated_at, passport.works_changed_at), paths=paths,
+    )
+    if not messages.get_messages(request):
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
 
-    # Загружаем историю
-    history = get_passport_history(passport.id)
+    # Загружаем данные из файла
+    file_data = load_passport_from_file(passport.id, paths)
 
-    # Отладочная информация
-    print(f"History entries: {len(history)}")
-    for i, entry in enumerate(history):
-        print(f"Entry {i}: {entry}")
+    # Загружаем последние записи истории (лишняя запись показывает, что есть еще)
+    history = get_passport_history(passport.id, limit=settings.PASSPORT_HISTORY_PREVIEW + 1, paths=paths)
+    has_more_history = len(history) > settings.PASSPORT_HISTORY_PREVIEW
+    if has_more_history:
+        history = history[1:]
 
-    return render(request, 'passports/view_passport.html', {
+    response = render(request, 'passports/view_passport.html', {
         'passport': passport,
         'file_data': file_data,
-        'history': history  # Добавляем историю в контекст
+        'history': history,  # Добавляем историю в контекст
+        'has_more_history': has_more_history,
+        'photo_thumbnail_url': _photo_preview_url(passport),
     })
+    return set_validators(response, etag, last_modified)
+
+
+def _photo_preview_url(passport):
+    """Фото на странице паспорта: наибольшая копия или, без копий, оригинал"""
+    if not passport.photo:
+        return None
+    size = largest_size()
+    return thumbnail_url(passport, size) if size else passport.photo.url
+
+
+@login_required
+def passport_thumbnail(request, pk, size):
+    """Уменьшенная копия фото паспорта; создается при первом запросе"""
+    passport = get_object_or_404(EquipmentPassport.objects.only('id', 'photo', 'created_by'), pk=pk)
+
+    if not can_access_passport(request.user, passport):
+        return HttpResponseForbidden("У вас нет прав для просмотра этого паспорта")
+    if not passport.photo or size not in thumbnail_sizes():
+        raise Http404('Нет такой копии фото')
+
+    # Адрес без версии текущего фото нельзя долго кэшировать - отправляем на адрес с версией
+    if request.GET.get('v') != photo_version(passport.photo.name):
+        return redirect(thumbnail_url(passport, size))
+
+    try:
+        name = get_thumbnail(passport.photo, size, timeout=THUMBNAIL_TIMEOUT)
+    except TimeoutError:
+        name = None
+    if name is None:
+        # Копию создать не удалось - отдаем оригинал
+        return redirect(passport.photo.url)
+
+    response = FileResponse(passport.photo.storage.open(name, 'rb'), content_type='image/jpeg')
+    # Версия в адресе меняется вместе с фото, поэтому копия неизменна
+    patch_cache_control(response, private=True, max_age=settings.PASSPORT_THUMBNAIL_MAX_AGE, immutable=True)
+    return response
 
 @login_required
 def edit_passport(request, pk):
     passport = get_object_or_404(EquipmentPassport, pk=pk)
     equipment_types = EquipmentType.objects.all()
 
-    if not (request.user.is_superuser or request.user.is_staff or passport.created_by == request.user):
+    if not can_access_passport(request.user, passport):
         return HttpResponseForbidden("У вас нет прав для редактирования этого паспорта")
 
     # Сохраняем исходные значения до изменений
@@ -238,14 +322,14 @@ def edit_passport(request, pk):
                             'new': new_value
                         }
 
-            # Сохраняем историю изменений, если есть изменения
+            # Запись истории ставится в очередь зеркала вместе с файлом паспорта
             if changed_fields:
-                add_passport_history_entry(passport, request.user, changed_fields)
+                schedule_history_entry(passport, request.user, changed_fields)
 
             passport.save()
 
             # Сохраняем изменения в файл
-            save_passport_to_file(passport)
+            schedule_passport_save(passport)
 
             messages.success(request, 'Паспорт успешно обновлен!')
             return redirect('passports:view_passport', pk=pk)
@@ -265,15 +349,12 @@ def edit_passport(request, pk):
 def delete_passport(request, pk):
     passport = get_object_or_404(EquipmentPassport, pk=pk)
 
-    if not (request.user.is_superuser or request.user.is_staff or passport.created_by == request.user):
+    if not can_access_passport(request.user, passport):
         return JsonResponse({'status': 'forbidden'}, status=403)
 
     if request.method == 'DELETE':
-        # Удаляем файл паспорта
-        delete_passport_file(passport.id)
-
-        # Удаляем запись из БД
-        passport.delete()
+        # Сначала запись из БД, файлы - после фиксации
+        delete_passport_with_files(passport)
 
         return JsonResponse({'status': 'success'})
 
@@ -283,7 +364,7 @@ def delete_passport(request, pk):
 @login_required
 def delete_multiple_passports(request):
     """Массовое удаление паспортов через API"""
-    if not (request.user.is_superuser or request.user.is_staff):
+    if not is_admin(request.user):
         return JsonResponse({'status': 'forbidden'}, status=403)
 
     if request.method == 'POST':
@@ -306,19 +387,25 @@ def delete_multiple_passports(request):
             # Получаем паспорта для удаления
             passports = EquipmentPassport.objects.filter(id__in=valid_ids)
 
-            # Удаляем файлы
-            file_success, file_errors = delete_multiple_passport_files(valid_ids)
+            # Большая выборка удаляется фоновым заданием, ход - по job_id
+            if len(valid_ids) > settings.PASSPORT_BULK_DELETE_SYNC_LIMIT:
+                job = start_bulk_delete_job(passports, request.user)
+                return JsonResponse({
+                    'status': 'accepted',
+                    'message': f"Запущено фоновое удаление {job['total']} паспортов",
+                    'job_id': job['id'],
+                    'status_url': reverse('passports:equipmentpassport-bulk-delete-status', args=[job['id']]),
+                }, status=202)
 
-            # Удаляем записи из БД
-            db_count = passports.count()
-            passports.delete()
+            # Записи БД удаляются порциями, файлы - после фиксации каждой порции
+            report = bulk_delete_passports(passports)
 
             return JsonResponse({
                 'status': 'success',
-                'message': f'Удалено {db_count} паспортов из БД и {file_success} файлов',
-                'db_deleted': db_count,
-                'files_deleted': file_success,
-                'file_errors': file_errors
+                'message': f'Удалено {report.passports_deleted} паспортов из БД и {report.files_deleted} файлов',
+                'db_deleted': report.passports_deleted,
+                'files_deleted': report.files_deleted,
+                'file_errors': report.file_errors
             })
 
         except json.JSONDecodeError:
@@ -331,7 +418,7 @@ def delete_multiple_passports(request):
 def add_maintenance_work(request, pk):
     passport = get_object_or_404(EquipmentPassport, pk=pk)
 
-    if not (request.user.is_superuser or request.user.is_staff or passport.created_by == request.user):
+    if not can_access_passport(request.user, passport):
         return HttpResponseForbidden("У вас нет прав для добавления работ")
 
     if request.method == 'POST':
@@ -342,8 +429,8 @@ def add_maintenance_work(request, pk):
             work.created_by = request.user
             work.save()
 
-            # Обновляем файл паспорта
-            save_passport_to_file(passport)
+            # Дописываем работу в файл паспорта
+            schedule_work_save(work)
 
             messages.success(request, 'Работа успешно добавлена!')
             return redirect('passports:view_passport', pk=pk)
@@ -360,7 +447,7 @@ def add_maintenance_work(request, pk):
 def maintenance_work_list(request, pk):
     passport = get_object_or_404(EquipmentPassport, pk=pk)
 
-    if not (request.user.is_superuser or request.user.is_staff or passport.created_by == request.user):
+    if not can_access_passport(request.user, passport):
         return HttpResponseForbidden("У вас нет прав для просмотра работ")
 
     works = passport.maintenance_works.all()
@@ -396,14 +483,27 @@ def maintenance_work_list(request, pk):
 def passport_history(request, pk):
     passport = get_object_or_404(EquipmentPassport, pk=pk)
 
-    if not (request.user.is_superuser or request.user.is_staff or passport.created_by == request.user):
+    if not can_access_passport(request.user, passport):
         return HttpResponseForbidden("У вас нет прав для просмотра истории")
 
-    history = get_passport_history(passport.id)
+    # Страницы отсчитываются от самых новых записей
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    page_size = settings.PASSPORT_HISTORY_PAGE_SIZE
+
+    history = get_passport_history(passport.id, limit=page_size + 1, offset=(page - 1) * page_size)
+    has_older = len(history) > page_size
+    if has_older:
+        history = history[1:]
 
     return render(request, 'passports/passport_history.html', {
         'passport': passport,
-        'history': history
+        'history': history,
+        'page': page,
+        'has_older': has_older,
+        'has_newer': page > 1
     })
 
 
@@ -411,22 +511,11 @@ def passport_history(request, pk):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def api_passport_list(request):
-    if request.user.is_superuser or request.user.is_staff:
-        passports = EquipmentPassport.objects.all()
-    else:
-        passports = EquipmentPassport.objects.filter(created_by=request.user)
-
-    data = []
-    for passport in passports:
-        data.append({
-            'id': str(passport.id),
-            'name': passport.name,
-            'serial_number': passport.serial_number,
-            'status': passport.status,
-            'created_at': passport.created_at
-        })
+    """Краткий список паспортов; потоковая выгрузка всех полей - GET /passports/api/passports/export/"""
+    passports = scope_passports(request.user)
 
-    return Response(data)
+    # Ответ проходит через рендереры DRF, поэтому собирается целиком - только нужные столбцы
+    return Response(list(passports.values('id', 'name', 'serial_number', 'status', 'created_at')))
 
 
 @api_view(['GET'])
@@ -434,8 +523,17 @@ def api_passport_list(request):
 def api_passport_detail(request, pk):
     passport = get_object_or_404(EquipmentPassport, pk=pk)
 
-    if not (request.user.is_superuser or request.user.is_staff or passport.created_by == request.user):
+    if not can_access_passport(request.user, passport):
         return Response({'error': 'Permission denied'}, status=403)
 
-    file_data = load_passport_from_file(passport.id)
-    return Response(file_data)
\ No newline at end of file
+    paths = resolve_passport_paths(passport.id)
+    # Формат ответа выбирается по Accept - он тоже часть представления
+    etag, last_modified = passport_file_validators(
+        passport.id, request.accepted_renderer.format, request.user.pk, paths=paths
+    )
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+
+    file_data = load_passport_from_file(passport.id, paths)
+    return set_validators(Response(file_data), etag, last_modified)
\ No newline at end of file
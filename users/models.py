@@ -8,4 +8,6 @@ class UserRole(User):
 
     @property
     def is_admin(self):
-        return self.is_staff or self.is_superuser or self.groups.filter(name='Администраторы').exists()
\ No newline at end of file
+        # Роль кэшируется, см. passports.permissions
+        from passports.permissions import is_admin
+        return is_admin(self)
\ No newline at end of file
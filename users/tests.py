@@ -1,3 +1,43 @@
-from django.test import TestCase
+import shutil
+import tempfile
 
-# Create your tests here.
+from django.contrib.auth.models import Group
+from django.test import TestCase, override_settings
+
+from passports.permissions import ADMIN_GROUP
+
+from .models import UserRole
+
+CACHE_DIR = tempfile.mkdtemp(prefix='users-tests-')
+
+
+def tearDownModule():
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+class UserRoleTests(TestCase):
+    def role(self, user):
+        # Новый объект: роль хранится на объекте пользователя
+        return UserRole.objects.get(pk=user.pk)
+
+    def check_is_admin(self):
+        user = UserRole.objects.create_user('user', password='pass')
+        staff = UserRole.objects.create_user('staff', password='pass', is_staff=True)
+        self.assertFalse(self.role(user).is_admin)
+        self.assertTrue(self.role(staff).is_admin)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.groups.add(Group.objects.create(name=ADMIN_GROUP))
+        self.assertTrue(self.role(user).is_admin)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.groups.clear()
+        self.assertFalse(self.role(user).is_admin)
+
+    def test_is_admin(self):
+        self.check_is_admin()
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                           'LOCATION': CACHE_DIR}})
+    def test_is_admin_with_shared_cache(self):
+        self.check_is_admin()